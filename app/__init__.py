@@ -6,8 +6,10 @@ from flask_mail import Mail
 from flask_bootstrap import Bootstrap
 from flask_wtf.csrf import CSRFProtect
 from config import Config
+from app.database import RoutingSession
+import logging
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 migrate = Migrate()
 login = LoginManager()
 login.login_view = 'auth.login'
@@ -19,16 +21,27 @@ def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
 
-    # Debug print for mail configuration
-    print("Mail Configuration:")
-    print(f"MAIL_SERVER: {app.config.get('MAIL_SERVER')}")
-    print(f"MAIL_PORT: {app.config.get('MAIL_PORT')}")
-    print(f"MAIL_USE_TLS: {app.config.get('MAIL_USE_TLS')}")
-    print(f"MAIL_USE_SSL: {app.config.get('MAIL_USE_SSL')}")
-    print(f"MAIL_USERNAME: {app.config.get('MAIL_USERNAME')}")
-    print(f"Raw MAIL_PASSWORD length: {len(str(app.config.get('MAIL_PASSWORD')))}")
-    print(f"MAIL_PASSWORD: {app.config.get('MAIL_PASSWORD')}")  # Be careful with this in production
-    print(f"MAIL_DEFAULT_SENDER: {app.config.get('MAIL_DEFAULT_SENDER')}")
+    # First, so everything below logs through it
+    from app.log import structured_logging
+    structured_logging.init_app(app)
+    logging.getLogger(__name__).info('Mail configuration', extra={
+        'mail_server': app.config.get('MAIL_SERVER'),
+        'mail_port': app.config.get('MAIL_PORT'),
+        'mail_use_tls': app.config.get('MAIL_USE_TLS'),
+        'mail_use_ssl': app.config.get('MAIL_USE_SSL'),
+        'mail_username': app.config.get('MAIL_USERNAME'),
+        'mail_password_set': bool(app.config.get('MAIL_PASSWORD')),
+        'mail_default_sender': app.config.get('MAIL_DEFAULT_SENDER')
+    })
+
+    from app.instrumentation import request_metrics
+    request_metrics.init_app(app)
+
+    # Before db.init_app, which reads SQLALCHEMY_ENGINE_OPTIONS and SQLALCHEMY_BINDS
+    from app.database import configure_engines
+    configure_engines(app)
+    from app.metrics import metrics
+    metrics.init_app(app)
 
     db.init_app(app)
     migrate.init_app(app, db)
@@ -37,6 +50,21 @@ def create_app(config_class=Config):
     bootstrap.init_app(app)
     csrf.init_app(app)
 
+    from app.jobs import job_queue
+    job_queue.init_app(app)
+
+    from app.completions import completion_cache
+    completion_cache.init_app(app)
+
+    from app.email import mail_queue
+    mail_queue.init_app(app)
+
+    from app.identity import identity_cache
+    identity_cache.init_app(app)
+
+    from app.tickets.similar import similarity_index
+    similarity_index.init_app(app)
+
     from app.main import bp as main_bp
     app.register_blueprint(main_bp)
 
@@ -49,6 +77,9 @@ def create_app(config_class=Config):
     from app.tickets import bp as tickets_bp
     app.register_blueprint(tickets_bp, url_prefix='/tickets')
 
+    from app import cli
+    cli.register(app)
+
     return app
 
 from app import models 
\ No newline at end of file
@@ -7,19 +7,21 @@ from wtforms.validators import DataRequired, Email
 from flask_wtf.csrf import generate_csrf, validate_csrf
 from app.admin import bp
 from app.models import User, Organization, Invitation, SubscriptionPlan, Subscription, SubscriptionFeedback
-from app import db
+from app import db, csrf
+from app.billing import get_stripe, queue_stripe_call, record_webhook_event, subscription_snapshot
+from app.invitations import InvalidInviteList, invite_many, parse_invitees, summarize
+from app.jobs import job_queue
+from app.seats import enforce_seat_limit, member_counts
 from datetime import datetime, timedelta
+import json
+import logging
+import time
 import uuid
 import stripe
 
-def get_stripe():
-    """Get Stripe instance with current configuration"""
-    if not hasattr(get_stripe, 'stripe_instance'):
-        stripe.api_key = current_app.config.get('STRIPE_SECRET_KEY')
-        if not stripe.api_key or stripe.api_key == 'your-stripe-secret-key':
-            raise ValueError('Invalid Stripe secret key. Please check your configuration.')
-        get_stripe.stripe_instance = stripe
-    return get_stripe.stripe_instance
+logger = logging.getLogger(__name__)
+
+MEMBERS_PER_PAGE = 50
 
 class CreateOrganizationForm(FlaskForm):
     name = StringField('Organization Name', validators=[DataRequired()])
@@ -120,26 +122,6 @@ def manage_organization():
         flash('You need to be part of an organization to manage it.', 'warning')
         return redirect(url_for('main.index'))
     
-    # Detailed debug logging
-    current_app.logger.info("\n=== Organization Debug Info ===")
-    current_app.logger.info(f"Organization ID: {org.id}")
-    current_app.logger.info(f"Organization Name: {org.name}")
-    current_app.logger.info(f"Organization Domain: {org.domain}")
-    current_app.logger.info(f"Subscription Plan ID: {org.subscription_plan_id}")
-    current_app.logger.info(f"Current Subscription ID: {org.current_subscription_id}")
-    
-    # Get all subscriptions for this org
-    all_subs = Subscription.query.filter_by(organization_id=org.id).all()
-    current_app.logger.info("\n=== All Subscriptions ===")
-    for sub in all_subs:
-        current_app.logger.info(f"Subscription ID: {sub.id}")
-        current_app.logger.info(f"Status: {sub.status}")
-        current_app.logger.info(f"Plan ID: {sub.plan_id}")
-        current_app.logger.info(f"Start Date: {sub.start_date}")
-        current_app.logger.info(f"End Date: {sub.end_date}")
-        current_app.logger.info(f"Next Billing Date: {sub.next_billing_date}")
-        current_app.logger.info("---")
-    
     # Fix missing current subscription
     if not org.current_subscription_id:
         # Find the most recent active subscription
@@ -152,48 +134,29 @@ def manage_organization():
         if active_sub:
             org.current_subscription_id = active_sub.id
             db.session.commit()
-            current_app.logger.info(f"Fixed missing current_subscription_id. Set to: {active_sub.id}")
-    
-    if org.subscription_plan:
-        current_app.logger.info("\n=== Current Plan ===")
-        current_app.logger.info(f"Plan Name: {org.subscription_plan.name}")
-        current_app.logger.info(f"Plan Price: ${org.subscription_plan.price}/month")
-        current_app.logger.info(f"Team Size Limit: {org.subscription_plan.team_size_limit}")
+            logger.info(f'Fixed missing current_subscription_id for organization {org.id}',
+                        extra={'organization_id': org.id, 'subscription_id': active_sub.id})
     
-    if org.current_subscription:
-        current_app.logger.info("\n=== Current Subscription ===")
-        current_app.logger.info(f"Status: {org.current_subscription.status}")
-        current_app.logger.info(f"Start Date: {org.current_subscription.start_date}")
-        current_app.logger.info(f"End Date: {org.current_subscription.end_date}")
-        current_app.logger.info(f"Next Billing: {org.current_subscription.next_billing_date}")
-    
-    current_app.logger.info("\n=== End Debug Info ===\n")
+    # DEBUG records are sampled (LOG_DEBUG_SAMPLE_RATE), so this stays cheap on a busy page
+    logger.debug('Managing organization', extra={
+        'organization_id': org.id,
+        'subscription_plan_id': org.subscription_plan_id,
+        'current_subscription_id': org.current_subscription_id
+    })
     
     # Get subscription plans
     subscription_plans = SubscriptionPlan.query.filter_by(is_active=True).all()
     
-    # Check and enforce member limit
-    if org.subscription_plan:
-        member_limit = org.subscription_plan.team_size_limit
-        members = User.query.filter_by(organization_id=org.id).order_by(User.created_at.desc()).all()
-        if len(members) > member_limit:
-            # Get the excess members (newest members first, excluding admins)
-            excess_count = len(members) - member_limit
-            removed_count = 0
-            for member in members:
-                if removed_count >= excess_count:
-                    break
-                if member.role != 'admin':
-                    member.organization_id = None
-                    member.role = 'user'
-                    removed_count += 1
-            
-            db.session.commit()
-            flash(f'{removed_count} members were removed as they exceed your plan\'s limit of {member_limit} members.', 'warning')
-            # Refresh members list after removal
-            members = User.query.filter_by(organization_id=org.id).order_by(User.created_at.desc()).all()
-    else:
-        members = User.query.filter_by(organization_id=org.id).order_by(User.created_at.desc()).all()
+    # Seat limits are enforced when the plan changes (app/seats.py), so the
+    # page only reads: one aggregate for the counts, one page of members
+    role_counts = member_counts(org.id)
+    member_count = sum(role_counts.values())
+    per_page = max(1, min(request.args.get('per_page', MEMBERS_PER_PAGE, type=int), 100))
+    pages = max(1, -(-member_count // per_page))
+    page = max(1, min(request.args.get('page', 1, type=int), pages))
+    members = User.query.filter_by(organization_id=org.id).order_by(
+        User.created_at.desc(), User.id.desc()
+    ).offset((page - 1) * per_page).limit(per_page).all()
     
     pending_invites = Invitation.query.filter_by(
         organization_id=org.id,
@@ -207,6 +170,11 @@ def manage_organization():
     return render_template('admin/manage_organization.html', 
                          organization=org,
                          members=members,
+                         member_count=member_count,
+                         role_counts=role_counts,
+                         page=page,
+                         pages=pages,
+                         per_page=per_page,
                          pending_invites=pending_invites,
                          subscription_plans=subscription_plans,
                          stripe_public_key=current_app.config['STRIPE_PUBLIC_KEY'],
@@ -250,9 +218,12 @@ def change_plan(plan_id):
         # Update organization's subscription
         org.subscription_plan_id = plan.id
         org.current_subscription_id = subscription.id
+        removed = enforce_seat_limit(org, plan.team_size_limit)
         
         db.session.commit()
         flash(f'Successfully switched to {plan.name} plan.', 'success')
+        if removed:
+            flash(f'{removed} members were removed as they exceed your plan\'s limit of {plan.team_size_limit} members.', 'warning')
     except Exception as e:
         db.session.rollback()
         flash(f'Error changing subscription plan: {str(e)}', 'danger')
@@ -342,6 +313,39 @@ def invite_user():
     
     return render_template('admin/invite_user.html', form=form)
 
+@bp.route('/organization/invite/bulk', methods=['POST'])
+@login_required
+def bulk_invite():
+    """Invite many users at once from a CSV or JSON list; responds with per-row results"""
+    if not current_user.is_organization_admin:
+        return jsonify({'error': 'Admin access required.'}), 403
+    
+    started = time.perf_counter()
+    upload = request.files.get('file')
+    if upload is not None:
+        data, content_type = upload.read(), upload.mimetype or 'text/csv'
+        if upload.filename and upload.filename.lower().endswith('.csv'):
+            content_type = 'text/csv'
+    else:
+        data, content_type = request.get_data(), request.content_type
+    
+    try:
+        invitees = parse_invitees(data, content_type)
+    except InvalidInviteList as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        results = invite_many(current_user.organization, invitees)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f'Bulk invite for organization {current_user.organization_id} failed: {e}')
+        return jsonify({'error': 'An error occurred while sending the invitations.'}), 500
+    
+    summary = summarize(results, started)
+    logger.info(f'Bulk invite for organization {current_user.organization_id}: '
+                f'{summary["counts"]} in {summary["elapsed_ms"]} ms')
+    return jsonify({'results': results, **summary})
+
 @bp.route('/organization/members/<int:user_id>/remove', methods=['POST'])
 @login_required
 def remove_member(user_id):
@@ -511,7 +515,7 @@ def create_checkout_session():
         return jsonify({'id': checkout_session.id})
         
     except Exception as e:
-        print(f"Stripe Error: {str(e)}")  # Add logging for debugging
+        logger.warning(f'Stripe error creating checkout session: {e}')
         return jsonify({'error': str(e)}), 403
 
 @bp.route('/payment/success')
@@ -537,47 +541,10 @@ def payment_success():
         
         current_plan = org.subscription_plan
         current_subscription = org.current_subscription
-        stripe_instance = get_stripe()
-
-        def create_stripe_event_log(event_type, description, metadata=None):
-            """Helper function to log events to Stripe"""
-            try:
-                event_data = {
-                    'object': {
-                        'customer': org.stripe_customer_id,
-                        'description': description,
-                        'metadata': metadata or {},
-                        'livemode': False,  # Since we're in test mode
-                    }
-                }
-
-                # Add specific data based on event type
-                if event_type == 'checkout.session.completed':
-                    event_data['object'].update({
-                        'mode': 'subscription',
-                        'payment_status': 'paid',
-                    })
-                elif event_type.startswith('customer.subscription'):
-                    event_data['object'].update({
-                        'status': metadata.get('status', 'active'),
-                        'current_period_end': metadata.get('effective_date'),
-                        'cancel_at_period_end': metadata.get('action') == 'schedule_downgrade',
-                        'cancel_at': metadata.get('effective_date'),
-                    })
-                elif event_type.startswith('invoice'):
-                    event_data['object'].update({
-                        'status': 'paid',
-                        'amount_paid': metadata.get('amount', 0),
-                        'billing_reason': metadata.get('action', 'subscription_update'),
-                    })
-
-                # Create the event with enhanced visibility
-                stripe_instance.Event.create(
-                    type=event_type,
-                    data=event_data
-                )
-            except Exception as e:
-                print(f"Error logging Stripe event: {str(e)}")
+        # Billing period as last reported by Stripe; Stripe itself is only
+        # written to through the billing outbox after the commit below
+        snapshot = subscription_snapshot(org)
+        period_end = snapshot.current_period_end if snapshot else None
 
         # Handle different subscription scenarios
         if current_subscription:
@@ -585,73 +552,48 @@ def payment_success():
                 # Reactivating a cancelled subscription with the same plan
                 if current_plan and current_plan.id == plan.id:
                     if org.stripe_subscription_id:
-                        try:
-                            # Reactivate in Stripe first
-                            stripe_sub = stripe_instance.Subscription.modify(
-                                org.stripe_subscription_id,
-                                cancel_at_period_end=False,
-                                billing_cycle_anchor='unchanged',
-                                proration_behavior='none',
-                                metadata={
-                                    'action': 'reactivate',
-                                    'organization_id': str(org.id),
-                                    'plan_name': plan.name,
-                                    'previous_status': 'cancelled'
-                                }
-                            )
-                            # Log the reactivation event
-                            create_stripe_event_log(
-                                'subscription.reactivated',
-                                f'Subscription reactivated for {org.name}',
-                                {
-                                    'organization_id': str(org.id),
-                                    'plan_name': plan.name,
-                                    'next_billing_date': stripe_sub.current_period_end
-                                }
-                            )
-                            current_subscription.next_billing_date = datetime.fromtimestamp(stripe_sub.current_period_end)
-                        except Exception as e:
-                            print(f"Stripe reactivation error: {str(e)}")
-                            flash('Error syncing with payment system. Please contact support.', 'danger')
-                            return redirect(url_for('admin.manage_organization'))
+                        queue_stripe_call(
+                            'modify_subscription', org.id,
+                            subscription_id=org.stripe_subscription_id,
+                            cancel_at_period_end=False,
+                            billing_cycle_anchor='unchanged',
+                            proration_behavior='none',
+                            metadata={
+                                'action': 'reactivate',
+                                'organization_id': str(org.id),
+                                'plan_name': plan.name,
+                                'previous_status': 'cancelled'
+                            }
+                        )
+                        if period_end:
+                            current_subscription.next_billing_date = period_end
                     
                     current_subscription.status = 'active'
                     current_subscription.end_date = None
+                    if not current_subscription.next_billing_date:
+                        current_subscription.next_billing_date = datetime.utcnow() + timedelta(days=30)
                     flash(f'Your {plan.name} subscription has been reactivated. You will be charged on your next billing date: {current_subscription.next_billing_date.strftime("%B %d, %Y")}.', 'success')
             
             elif current_subscription.status == 'scheduled_downgrade':
                 if current_plan.price < plan.price:
                     # Reverting a scheduled downgrade (going back to higher tier)
                     if org.stripe_subscription_id:
-                        try:
-                            stripe_sub = stripe_instance.Subscription.modify(
-                                org.stripe_subscription_id,
-                                cancel_at_period_end=False,
-                                items=[{'price': current_plan.stripe_price_id}],
-                                billing_cycle_anchor='unchanged',
-                                proration_behavior='none',
-                                metadata={
-                                    'action': 'revert_downgrade',
-                                    'organization_id': str(org.id),
-                                    'plan_name': current_plan.name,
-                                    'previous_status': 'scheduled_downgrade'
-                                }
-                            )
-                            # Log the revert event
-                            create_stripe_event_log(
-                                'subscription.downgrade_reverted',
-                                f'Scheduled downgrade reverted for {org.name}',
-                                {
-                                    'organization_id': str(org.id),
-                                    'plan_name': current_plan.name,
-                                    'next_billing_date': stripe_sub.current_period_end
-                                }
-                            )
-                            current_subscription.next_billing_date = datetime.fromtimestamp(stripe_sub.current_period_end)
-                        except Exception as e:
-                            print(f"Stripe revert error: {str(e)}")
-                            flash('Error syncing with payment system. Please contact support.', 'danger')
-                            return redirect(url_for('admin.manage_organization'))
+                        queue_stripe_call(
+                            'modify_subscription', org.id,
+                            subscription_id=org.stripe_subscription_id,
+                            cancel_at_period_end=False,
+                            items=[{'price': current_plan.stripe_price_id}],
+                            billing_cycle_anchor='unchanged',
+                            proration_behavior='none',
+                            metadata={
+                                'action': 'revert_downgrade',
+                                'organization_id': str(org.id),
+                                'plan_name': current_plan.name,
+                                'previous_status': 'scheduled_downgrade'
+                            }
+                        )
+                        if period_end:
+                            current_subscription.next_billing_date = period_end
                     
                     # Delete any scheduled subscriptions
                     scheduled_sub = Subscription.query.filter_by(
@@ -668,40 +610,23 @@ def payment_success():
             else:  # Active subscription
                 if current_plan:
                     if plan.price < current_plan.price:
-                        # Downgrading to a cheaper plan
+                        # Downgrading to a cheaper plan at the end of the billing period
+                        next_billing_date = (period_end or current_subscription.next_billing_date
+                                             or datetime.utcnow() + timedelta(days=30))
                         if org.stripe_subscription_id:
-                            try:
-                                # Schedule the downgrade in Stripe
-                                stripe_sub = stripe_instance.Subscription.modify(
-                                    org.stripe_subscription_id,
-                                    cancel_at_period_end=True,
-                                    proration_behavior='none',
-                                    metadata={
-                                        'action': 'schedule_downgrade',
-                                        'organization_id': str(org.id),
-                                        'current_plan': current_plan.name,
-                                        'new_plan': plan.name,
-                                        'downgrade_date': datetime.fromtimestamp(stripe_sub.current_period_end).strftime('%Y-%m-%d')
-                                    }
-                                )
-                                # Log the downgrade scheduling event
-                                create_stripe_event_log(
-                                    'subscription.downgrade_scheduled',
-                                    f'Subscription downgrade scheduled for {org.name}',
-                                    {
-                                        'organization_id': str(org.id),
-                                        'from_plan': current_plan.name,
-                                        'to_plan': plan.name,
-                                        'effective_date': stripe_sub.current_period_end
-                                    }
-                                )
-                                next_billing_date = datetime.fromtimestamp(stripe_sub.current_period_end)
-                            except Exception as e:
-                                print(f"Stripe downgrade error: {str(e)}")
-                                flash('Error syncing with payment system. Please contact support.', 'danger')
-                                return redirect(url_for('admin.manage_organization'))
-                        else:
-                            next_billing_date = current_subscription.next_billing_date
+                            queue_stripe_call(
+                                'modify_subscription', org.id,
+                                subscription_id=org.stripe_subscription_id,
+                                cancel_at_period_end=True,
+                                proration_behavior='none',
+                                metadata={
+                                    'action': 'schedule_downgrade',
+                                    'organization_id': str(org.id),
+                                    'current_plan': current_plan.name,
+                                    'new_plan': plan.name,
+                                    'downgrade_date': next_billing_date.strftime('%Y-%m-%d')
+                                }
+                            )
                         
                         # Create new subscription that starts at the next billing date
                         new_subscription = Subscription(
@@ -723,71 +648,49 @@ def payment_success():
                     else:
                         # Upgrading to a more expensive plan - apply immediately with proration
                         if org.stripe_subscription_id:
-                            try:
-                                # Upgrade in Stripe immediately with proration
-                                stripe_sub = stripe_instance.Subscription.modify(
-                                    org.stripe_subscription_id,
-                                    items=[{'price': plan.stripe_price_id}],
-                                    proration_behavior='always_invoice',
-                                    billing_cycle_anchor='unchanged',
-                                    metadata={
-                                        'action': 'upgrade',
-                                        'organization_id': str(org.id),
-                                        'previous_plan': current_plan.name,
-                                        'new_plan': plan.name,
-                                        'upgrade_date': datetime.utcnow().strftime('%Y-%m-%d')
-                                    }
-                                )
-                                # Log the upgrade event
-                                create_stripe_event_log(
-                                    'subscription.upgraded',
-                                    f'Subscription upgraded for {org.name}',
-                                    {
-                                        'organization_id': str(org.id),
-                                        'from_plan': current_plan.name,
-                                        'to_plan': plan.name,
-                                        'proration_date': datetime.utcnow().timestamp()
-                                    }
-                                )
-                                next_billing_date = datetime.fromtimestamp(stripe_sub.current_period_end)
-                            except Exception as e:
-                                print(f"Stripe upgrade error: {str(e)}")
-                                flash('Error syncing with payment system. Please contact support.', 'danger')
-                                return redirect(url_for('admin.manage_organization'))
-                        else:
-                            next_billing_date = datetime.utcnow() + timedelta(days=30)
+                            queue_stripe_call(
+                                'modify_subscription', org.id,
+                                subscription_id=org.stripe_subscription_id,
+                                items=[{'price': plan.stripe_price_id}],
+                                proration_behavior='always_invoice',
+                                billing_cycle_anchor='unchanged',
+                                metadata={
+                                    'action': 'upgrade',
+                                    'organization_id': str(org.id),
+                                    'previous_plan': current_plan.name,
+                                    'new_plan': plan.name,
+                                    'upgrade_date': datetime.utcnow().strftime('%Y-%m-%d')
+                                }
+                            )
+                        # The billing anchor is unchanged, so the period end stays the same
+                        next_billing_date = period_end or datetime.utcnow() + timedelta(days=30)
                         
                         current_subscription.status = 'cancelled'
                         current_subscription.end_date = datetime.utcnow()
-        
-        # Create new subscription
+                        
+                        # Create new subscription
                         new_subscription = Subscription(
-            organization_id=org.id,
-            plan_id=plan.id,
-            status='active',
-            start_date=datetime.utcnow(),
+                            organization_id=org.id,
+                            plan_id=plan.id,
+                            status='active',
+                            start_date=datetime.utcnow(),
                             next_billing_date=next_billing_date
-        )
+                        )
                         db.session.add(new_subscription)
+                        db.session.flush()
                         org.current_subscription_id = new_subscription.id
-        
+                        
                         flash(f'Successfully upgraded to the {plan.name} plan! You will be charged a prorated amount for the upgrade.', 'success')
         
         # Update organization's plan
         org.subscription_plan_id = plan.id
+        removed = enforce_seat_limit(org, plan.team_size_limit)
         db.session.commit()
-        
-        # When upgrading, add invoice.paid event
-        create_stripe_event_log(
-            'invoice.paid',
-            f'Upgrade proration invoice paid for {org.name}',
-            {
-                'organization_id': str(org.id),
-                'from_plan': current_plan.name,
-                'to_plan': plan.name,
-                'amount': plan.price - current_plan.price
-            }
-        )
+        job_queue.wake()
+        if removed:
+            flash(f'{removed} members were removed as they exceed your plan\'s limit of {plan.team_size_limit} members.', 'warning')
+        logger.info(f'Organization {org.id} moved from plan '
+                    f'{current_plan.name if current_plan else None} to {plan.name}')
         
     except Exception as e:
         db.session.rollback()
@@ -797,69 +700,25 @@ def payment_success():
 
 @bp.route('/webhook', methods=['POST'])
 @bp.route('/admin/webhook', methods=['POST'])
+@csrf.exempt  # Stripe authenticates with the signature header instead
 def stripe_webhook():
-    """Handle Stripe webhook events"""
+    """Verify and store a Stripe webhook event; a background job applies it"""
     payload = request.get_data()
     sig_header = request.headers.get('Stripe-Signature')
     
     try:
-        print("Received webhook event")  # Debug logging
-        
-        # Initialize Stripe with the current secret key
-        stripe_instance = get_stripe()
-        
         # Verify webhook signature
         event = stripe.Webhook.construct_event(
             payload, sig_header, current_app.config['STRIPE_WEBHOOK_SECRET']
         )
-        
-        print(f"Webhook event type: {event.type}")  # Debug logging
-        
-        # Handle the event
-        if event.type == 'checkout.session.completed':
-            session = event.data.object
-            print(f"Processing completed checkout session: {session.id}")  # Debug logging
-            
-            # Get the organization and plan IDs from metadata
-            org_id = session.metadata.get('organization_id')
-            plan_id = session.metadata.get('plan_id')
-            
-            print(f"Organization ID: {org_id}, Plan ID: {plan_id}")  # Debug logging
-            
-            if org_id and plan_id:
-                org = Organization.query.get(org_id)
-                plan = SubscriptionPlan.query.get(plan_id)
-                
-                if org and plan:
-                    print(f"Updating subscription for org {org.name} to plan {plan.name}")  # Debug logging
-                    
-                    # Update the organization's subscription
-                    if org.current_subscription:
-                        org.current_subscription.status = 'cancelled'
-                        org.current_subscription.end_date = datetime.utcnow()
-                    
-                    # Create new subscription
-                    subscription = Subscription(
-                        organization_id=org.id,
-                        plan_id=plan.id,
-                        status='active',
-                        start_date=datetime.utcnow(),
-                        next_billing_date=datetime.utcnow() + timedelta(days=30)
-                    )
-                    db.session.add(subscription)
-                    
-                    # Update organization's subscription
-                    org.subscription_plan_id = plan.id
-                    org.current_subscription_id = subscription.id
-                    
-                    db.session.commit()
-                    print("Successfully updated subscription")  # Debug logging
-        
-        return jsonify({'status': 'success'}), 200
-        
-    except Exception as e:
-        print(f'Stripe webhook error: {str(e)}')
+    except (ValueError, stripe.error.SignatureVerificationError) as e:
+        logger.warning(f'Stripe webhook rejected: {e}')
         return jsonify({'error': str(e)}), 400
+    
+    # Acknowledge quickly so Stripe doesn't time out and redeliver
+    if not record_webhook_event(json.loads(payload)):
+        return jsonify({'status': 'duplicate', 'event': event.id}), 200
+    return jsonify({'status': 'queued', 'event': event.id}), 200
 
 @bp.route('/subscription/cancel', methods=['POST'])
 @login_required
@@ -911,7 +770,7 @@ def cancel_subscription():
     except Exception as e:
         db.session.rollback()
         error_msg = str(e)
-        print(f"Error cancelling subscription: {error_msg}")  # Log the error
+        logger.exception('Error cancelling subscription')
         return jsonify({'error': f'Failed to cancel subscription: {error_msg}'}), 400
 
 @bp.route('/api/subscription', methods=['GET'])
@@ -925,14 +784,8 @@ def get_subscription():
 
         subscription_data = None
         if org.current_subscription:
-            # Get Stripe subscription details if available
-            stripe_instance = get_stripe()
-            stripe_sub = None
-            if org.stripe_subscription_id:
-                try:
-                    stripe_sub = stripe_instance.Subscription.retrieve(org.stripe_subscription_id)
-                except Exception as e:
-                    print(f"Error fetching Stripe subscription: {e}")
+            # Stripe details come from the webhook-maintained snapshot, not a live call
+            stripe_sub = subscription_snapshot(org)
 
             subscription_data = {
                 'status': org.current_subscription.status,
@@ -953,6 +806,30 @@ def get_subscription():
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+@bp.route('/api/jobs', methods=['GET'])
+@login_required
+@admin_required
+def job_queue_stats():
+    """Background job queue depth, latency and failure counts"""
+    from app.jobs import job_queue
+    return jsonify(job_queue.stats())
+
+@bp.route('/api/mail_queue', methods=['GET'])
+@login_required
+@admin_required
+def mail_queue_stats():
+    """Outbound mail queue depth, failures and delivery latency"""
+    from app.email import mail_queue
+    return jsonify(mail_queue.stats())
+
+@bp.route('/api/ai_cache', methods=['GET'])
+@login_required
+@admin_required
+def ai_cache_stats():
+    """AI completion cache hit/miss counters for this process"""
+    from app.completions import completion_cache
+    return jsonify(completion_cache.stats())
+
 @bp.route('/fix_subscription')
 @login_required
 @admin_required
@@ -1070,17 +947,15 @@ def switch_plan():
         
         current_plan = org.subscription_plan
         current_subscription = org.current_subscription
-        stripe_instance = get_stripe()
 
         def log_subscription_change(action, details):
             """Helper function to log subscription changes"""
-            print(f"\n=== Subscription Change Log ===")
-            print(f"Action: {action}")
-            print(f"Organization: {org.name} (ID: {org.id})")
-            print(f"Current Plan: {current_plan.name} (${current_plan.price}/month)")
-            print(f"Target Plan: {plan.name} (${plan.price}/month)")
-            print("Details:", details)
-            print("==============================\n")
+            logger.info(f'Subscription change: {action}', extra={
+                'organization_id': org.id,
+                'current_plan': current_plan.name,
+                'target_plan': plan.name,
+                'details': details
+            })
 
         if not current_subscription or not current_plan:
             # New subscription - redirect to Stripe payment
@@ -1100,49 +975,28 @@ def switch_plan():
                 "Next Billing Date": next_billing_date
             })
             
-            # Only try to modify Stripe subscription if it exists
-            stripe_updated = False
-            if hasattr(org, 'stripe_subscription_id') and org.stripe_subscription_id:
-                try:
-                    # Get the current subscription from Stripe
-                    stripe_sub = stripe_instance.Subscription.retrieve(org.stripe_subscription_id)
-                    
-                    # Schedule the downgrade in Stripe by updating the subscription
-                    stripe_sub = stripe_instance.Subscription.modify(
-                        org.stripe_subscription_id,
-                        cancel_at_period_end=True,
-                        proration_behavior='none',
-                        metadata={
-                            'action': 'schedule_downgrade',
-                            'organization_id': str(org.id),
-                            'current_plan': current_plan.name,
-                            'new_plan': plan.name,
-                            'downgrade_date': datetime.fromtimestamp(stripe_sub.current_period_end).strftime('%Y-%m-%d')
-                        }
-                    )
-                    
-                    # Schedule the new subscription to start at period end
-                    stripe_instance.SubscriptionSchedule.create(
-                        customer=org.stripe_customer_id,
-                        start_date=stripe_sub.current_period_end,
-                        phases=[{
-                            'items': [{'price': plan.stripe_price_id, 'quantity': 1}],
-                            'start_date': stripe_sub.current_period_end
-                        }]
-                    )
-                    
-                    next_billing_date = datetime.fromtimestamp(stripe_sub.current_period_end)
-                    stripe_updated = True
-                    
-                    log_subscription_change("STRIPE_UPDATED", {
-                        "Subscription ID": org.stripe_subscription_id,
-                        "Cancel At Period End": True,
-                        "Period End": stripe_sub.current_period_end,
-                        "New Next Billing Date": next_billing_date
-                    })
-                except Exception as e:
-                    print(f"Stripe downgrade error: {str(e)}")
-                    # Continue with local changes even if Stripe update fails
+            # Prefer the billing period Stripe last reported
+            snapshot = subscription_snapshot(org)
+            if snapshot and snapshot.current_period_end:
+                next_billing_date = snapshot.current_period_end
+            
+            # Stripe is updated through the billing outbox once this commits
+            stripe_queued = False
+            if org.stripe_subscription_id:
+                queue_stripe_call(
+                    'schedule_downgrade', org.id,
+                    subscription_id=org.stripe_subscription_id,
+                    customer_id=org.stripe_customer_id,
+                    price_id=plan.stripe_price_id,
+                    metadata={
+                        'action': 'schedule_downgrade',
+                        'organization_id': str(org.id),
+                        'current_plan': current_plan.name,
+                        'new_plan': plan.name,
+                        'downgrade_date': next_billing_date.strftime('%Y-%m-%d')
+                    }
+                )
+                stripe_queued = True
             
             # Create new subscription that starts at the next billing date
             new_subscription = Subscription(
@@ -1173,9 +1027,10 @@ def switch_plan():
             
             try:
                 db.session.commit()
+                job_queue.wake()
                 log_subscription_change("CHANGES_COMMITTED", {
                     "Success": True,
-                    "Stripe Updated": stripe_updated,
+                    "Stripe Sync Queued": stripe_queued,
                     "Database Updated": True
                 })
             except Exception as e:
@@ -1222,41 +1077,27 @@ def cancel_downgrade():
         if scheduled_sub:
             db.session.delete(scheduled_sub)
 
-        # Update Stripe if we have a subscription ID
-        if hasattr(org, 'stripe_subscription_id') and org.stripe_subscription_id:
-            try:
-                stripe_instance = get_stripe()
-                # Cancel the scheduled cancellation in Stripe
-                stripe_sub = stripe_instance.Subscription.modify(
-                    org.stripe_subscription_id,
-                    cancel_at_period_end=False,
-                    metadata={
-                        'action': 'cancel_downgrade',
-                        'organization_id': str(org.id)
-                    }
-                )
-                # Update our next billing date to match Stripe
-                current_subscription.next_billing_date = datetime.fromtimestamp(stripe_sub.current_period_end)
-                
-                # Log the event in Stripe
-                create_stripe_event_log(
-                    'customer.subscription.updated',
-                    f'Scheduled downgrade cancelled for {org.name}',
-                    {
-                        'organization_id': str(org.id),
-                        'action': 'cancel_downgrade',
-                        'status': 'active'
-                    }
-                )
-            except Exception as e:
-                print(f"Stripe cancel downgrade error: {str(e)}")
-                # Continue with local changes even if Stripe update fails
+        # Cancel the scheduled cancellation in Stripe once this commits
+        if org.stripe_subscription_id:
+            queue_stripe_call(
+                'modify_subscription', org.id,
+                subscription_id=org.stripe_subscription_id,
+                cancel_at_period_end=False,
+                metadata={
+                    'action': 'cancel_downgrade',
+                    'organization_id': str(org.id)
+                }
+            )
+            snapshot = subscription_snapshot(org)
+            if snapshot and snapshot.current_period_end:
+                current_subscription.next_billing_date = snapshot.current_period_end
 
         # Reactivate the current subscription
         current_subscription.status = 'active'
         current_subscription.end_date = None
         
         db.session.commit()
+        job_queue.wake()
         flash('Your scheduled downgrade has been cancelled. You will keep your current plan.', 'success')
         
     except Exception as e:
@@ -5,8 +5,10 @@ from app.models import User
 from app.forms import LoginForm, RegistrationForm, ResetPasswordRequestForm, ResetPasswordForm
 from werkzeug.urls import url_parse
 import json
+import logging
 
 bp = Blueprint('auth', __name__)
+logger = logging.getLogger(__name__)
 
 @bp.route('/login', methods=['GET', 'POST'])
 def login():
@@ -52,7 +54,7 @@ def login():
             
         except Exception as e:
             flash('Invalid email or password', 'danger')
-            print(f"Login error: {str(e)}")
+            logger.warning(f'Login error: {e}')
             return render_template('auth/login.html', form=form)
     
     return render_template('auth/login.html', form=form)
@@ -94,7 +96,7 @@ def register():
             
         except Exception as e:
             flash('Registration failed. Please try again.', 'danger')
-            print(f"Registration error: {str(e)}")
+            logger.warning(f'Registration error: {e}')
             return render_template('auth/register.html', form=form)
     
     return render_template('auth/register.html', form=form)
@@ -106,7 +108,7 @@ def logout():
         # Sign out from Supabase
         current_app.supabase.auth.sign_out()
     except Exception as e:
-        print(f"Supabase logout error: {str(e)}")
+        logger.warning(f'Supabase logout error: {e}')
     
     # Sign out from Flask-Login
     logout_user()
@@ -131,7 +133,7 @@ def reset_password_request():
             flash('Check your email for instructions to reset your password.', 'info')
             return redirect(url_for('auth.login'))
         except Exception as e:
-            print(f"Password reset request error: {str(e)}")
+            logger.warning(f'Password reset request error: {e}')
             flash('Error sending password reset email.', 'danger')
     
     return render_template('auth/reset_password_request.html', form=form)
@@ -151,7 +153,7 @@ def reset_password(token):
             flash('Your password has been reset.', 'success')
             return redirect(url_for('auth.login'))
         except Exception as e:
-            print(f"Password reset error: {str(e)}")
+            logger.warning(f'Password reset error: {e}')
             flash('Error resetting password.', 'danger')
     
     return render_template('auth/reset_password.html', form=form)
@@ -169,7 +171,7 @@ def edit_profile():
             return redirect(url_for('auth.profile'))
         except Exception as e:
             flash('Error updating profile.', 'danger')
-            print(f"Profile update error: {str(e)}")
+            logger.warning(f'Profile update error: {e}')
     elif request.method == 'GET':
         form.username.data = current_user.username
     
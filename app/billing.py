@@ -0,0 +1,325 @@
+"""Billing sync between local subscriptions and Stripe.
+
+Routes change the local subscription state and commit straight away. Any
+Stripe mutation that goes with the change is written to the job queue in the
+same transaction (a transactional outbox), so it is sent after the commit,
+retried with backoff if Stripe is unreachable, and never sent for a change
+that was rolled back. Every outbox entry carries an idempotency key, so a
+retry after a timeout can't apply the same mutation twice.
+
+Outbox entries get STRIPE_CALL_MAX_ATTEMPTS attempts with the wait doubling
+up to STRIPE_CALL_MAX_BACKOFF, which rides out hours of Stripe downtime.
+Entries that still fail are sent again with
+`flask jobs retry --kind stripe_call`.
+
+Reads use StripeSubscriptionSnapshot, refreshed from webhook events and from
+the responses to outbox calls, instead of asking Stripe on every request.
+
+Webhooks are acknowledged as soon as the event is stored in
+processed_webhook_events and are applied by a background job. The event id is
+the table's primary key, so redeliveries are dropped on insert.
+"""
+from flask import current_app
+from app import db
+from app.instrumentation import external_call
+from app.jobs import job_queue
+from app.seats import enforce_seat_limit
+from app.models import (Organization, SubscriptionPlan, Subscription,
+                        StripeSubscriptionSnapshot, ProcessedWebhookEvent)
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+import logging
+import stripe
+import threading
+import uuid
+
+logger = logging.getLogger(__name__)
+
+_stripe_lock = threading.Lock()
+
+def get_stripe():
+    """Get Stripe instance with current configuration"""
+    if hasattr(get_stripe, 'stripe_instance'):
+        return get_stripe.stripe_instance
+    # Worker threads can get here together; configure the module once
+    with _stripe_lock:
+        if hasattr(get_stripe, 'stripe_instance'):
+            return get_stripe.stripe_instance
+        stripe.api_key = current_app.config.get('STRIPE_SECRET_KEY')
+        if not stripe.api_key or stripe.api_key == 'your-stripe-secret-key':
+            raise ValueError('Invalid Stripe secret key. Please check your configuration.')
+        # Point at a local fake server in development and tests
+        if current_app.config.get('STRIPE_API_BASE'):
+            stripe.api_base = current_app.config['STRIPE_API_BASE']
+        # The requests-based client keeps one session per thread
+        stripe.default_http_client = _timed_http_client(stripe.http_client.new_default_http_client(
+            verify_ssl_certs=stripe.verify_ssl_certs, proxy=stripe.proxy,
+            timeout=current_app.config['STRIPE_TIMEOUT']))
+        get_stripe.stripe_instance = stripe
+    return get_stripe.stripe_instance
+
+def _timed_http_client(client):
+    """Wrap a Stripe HTTP client so every API call is timed as an external call"""
+    for name in ('request_with_retries', 'request_stream_with_retries'):
+        def timed(*args, _call=getattr(client, name), **kwargs):
+            with external_call('stripe') as call:
+                content, status, headers = _call(*args, **kwargs)
+                # Stripe errors come back as responses, not exceptions
+                call.error = status >= 400
+                return content, status, headers
+        setattr(client, name, timed)
+    return client
+
+def _modify_subscription(stripe_instance, idempotency_key, subscription_id, **params):
+    return stripe_instance.Subscription.modify(subscription_id, idempotency_key=idempotency_key, **params)
+
+def _schedule_downgrade(stripe_instance, idempotency_key, subscription_id, customer_id, price_id, metadata):
+    """Cancel at period end, then start the cheaper plan when the period ends"""
+    subscription = stripe_instance.Subscription.modify(
+        subscription_id,
+        cancel_at_period_end=True,
+        proration_behavior='none',
+        metadata=metadata,
+        idempotency_key=f'{idempotency_key}-modify'
+    )
+    if customer_id and price_id:
+        stripe_instance.SubscriptionSchedule.create(
+            customer=customer_id,
+            start_date=subscription.current_period_end,
+            phases=[{
+                'items': [{'price': price_id, 'quantity': 1}],
+                'start_date': subscription.current_period_end
+            }],
+            idempotency_key=f'{idempotency_key}-schedule'
+        )
+    return subscription
+
+OPERATIONS = {
+    'modify_subscription': _modify_subscription,
+    'schedule_downgrade': _schedule_downgrade,
+}
+
+def queue_stripe_call(operation, organization_id, **params):
+    """Add a Stripe mutation to the outbox; it is sent once the caller commits.
+
+    Call job_queue.wake() after the commit so a worker picks it up promptly.
+    """
+    if operation not in OPERATIONS:
+        raise ValueError(f'Unknown Stripe operation {operation!r}')
+    return job_queue.enqueue(
+        'stripe_call',
+        operation=operation,
+        organization_id=organization_id,
+        params=params,
+        idempotency_key=uuid.uuid4().hex
+    )
+
+def _stripe_call_failed(operation, organization_id, params, idempotency_key):
+    logger.error(f'Stripe {operation} for organization {organization_id} failed after all retries '
+                 f'(idempotency key {idempotency_key}); local and Stripe state may disagree until '
+                 f'it is sent again with `flask jobs retry --kind stripe_call`')
+
+def _stripe_call_backoff(attempts):
+    """Doubling waits capped at STRIPE_CALL_MAX_BACKOFF seconds"""
+    if attempts >= current_app.config['STRIPE_CALL_MAX_ATTEMPTS']:
+        return None
+    return min(2 ** attempts, current_app.config['STRIPE_CALL_MAX_BACKOFF'])
+
+@job_queue.handler('stripe_call', on_failure=_stripe_call_failed, backoff=_stripe_call_backoff)
+def run_stripe_call(operation, organization_id, params, idempotency_key):
+    """Outbox worker: send one Stripe mutation and refresh the snapshot from the result"""
+    result = OPERATIONS[operation](get_stripe(), idempotency_key, **params)
+    if result is not None and result.get('object') == 'subscription':
+        refresh_snapshot(result, organization_id=organization_id)
+    db.session.commit()
+
+def _timestamp(value):
+    return datetime.utcfromtimestamp(value) if value else None
+
+def refresh_snapshot(stripe_subscription, organization_id=None, as_of=None):
+    """Store the state of a Stripe subscription object.
+
+    as_of is when Stripe reported this state (a webhook event's created time);
+    older reports than the stored one are ignored, since webhooks can arrive
+    out of order. The caller commits.
+    """
+    as_of = _timestamp(as_of) if as_of else datetime.utcnow()
+    snapshot = db.session.get(StripeSubscriptionSnapshot, stripe_subscription['id'])
+    if snapshot is None:
+        snapshot = StripeSubscriptionSnapshot(stripe_subscription_id=stripe_subscription['id'])
+        db.session.add(snapshot)
+    elif snapshot.source_updated_at and snapshot.source_updated_at > as_of:
+        return snapshot
+
+    if organization_id is None:
+        metadata = stripe_subscription.get('metadata') or {}
+        organization_id = metadata.get('organization_id')
+    if organization_id is not None:
+        snapshot.organization_id = int(organization_id)
+
+    items = (stripe_subscription.get('items') or {}).get('data') or []
+    snapshot.status = stripe_subscription.get('status')
+    snapshot.cancel_at_period_end = bool(stripe_subscription.get('cancel_at_period_end'))
+    snapshot.current_period_end = _timestamp(stripe_subscription.get('current_period_end'))
+    snapshot.price_id = items[0]['price']['id'] if items and items[0].get('price') else None
+    snapshot.source_updated_at = as_of
+    return snapshot
+
+def subscription_snapshot(org):
+    """Cached Stripe state for an organization's subscription, or None"""
+    if not org.stripe_subscription_id:
+        return None
+    return db.session.get(StripeSubscriptionSnapshot, org.stripe_subscription_id)
+
+WEBHOOK_HANDLERS = {}
+
+def webhook_handler(*event_types):
+    """Register the function that applies webhook events of these types"""
+    def decorator(f):
+        for event_type in event_types:
+            WEBHOOK_HANDLERS[event_type] = f
+        return f
+    return decorator
+
+def record_webhook_event(event):
+    """Store a verified webhook event and queue it for processing.
+
+    Returns False if the event id was already stored, i.e. Stripe redelivered
+    an event we have. Commits.
+    """
+    db.session.add(ProcessedWebhookEvent(event_id=event['id'], type=event['type'], payload=event))
+    job_queue.enqueue('stripe_webhook', event_id=event['id'])
+    try:
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return False
+    job_queue.wake()
+    return True
+
+def _webhook_failed(event_id):
+    ProcessedWebhookEvent.query.filter_by(event_id=event_id, status='received').update(
+        {ProcessedWebhookEvent.status: 'failed'}, synchronize_session=False
+    )
+    db.session.commit()
+    logger.error(f'Stripe webhook event {event_id} failed after all retries')
+
+@job_queue.handler('stripe_webhook', on_failure=_webhook_failed)
+def process_webhook_event(event_id):
+    """Apply one stored webhook event exactly once"""
+    record = db.session.get(ProcessedWebhookEvent, event_id)
+    if record is None or record.status != 'received':
+        return
+
+    event = stripe.Event.construct_from(record.payload, stripe.api_key)
+    handler = WEBHOOK_HANDLERS.get(event.type)
+    if handler is not None:
+        try:
+            handler(event)
+        except Exception as e:
+            # Keep the error on the event row too; the job queue retries it
+            db.session.rollback()
+            ProcessedWebhookEvent.query.filter_by(event_id=event_id).update(
+                {ProcessedWebhookEvent.last_error: f'{type(e).__name__}: {e}'}, synchronize_session=False
+            )
+            db.session.commit()
+            raise
+
+    # Mark the event done in the same transaction as its effects. If another
+    # worker got here first the UPDATE matches nothing and we roll back, so
+    # the state transition happens once however often the event is replayed.
+    marked = ProcessedWebhookEvent.query.filter_by(event_id=event_id, status='received').update({
+        ProcessedWebhookEvent.status: 'processed' if handler is not None else 'ignored',
+        ProcessedWebhookEvent.processed_at: datetime.utcnow(),
+        ProcessedWebhookEvent.last_error: None
+    }, synchronize_session=False)
+    if not marked:
+        db.session.rollback()
+        return
+    db.session.commit()
+
+def _organization_for(stripe_subscription_id, metadata=None):
+    """Organization linked to a Stripe subscription, falling back to its metadata"""
+    org = None
+    if stripe_subscription_id:
+        org = Organization.query.filter_by(stripe_subscription_id=stripe_subscription_id).first()
+    if org is None and metadata and metadata.get('organization_id'):
+        org = db.session.get(Organization, int(metadata['organization_id']))
+    return org
+
+@webhook_handler('checkout.session.completed')
+def _checkout_completed(event):
+    session = event.data.object
+    metadata = session.get('metadata') or {}
+    org_id = metadata.get('organization_id')
+    plan_id = metadata.get('plan_id')
+    if not (org_id and plan_id):
+        return
+    org = db.session.get(Organization, int(org_id))
+    plan = db.session.get(SubscriptionPlan, int(plan_id))
+    if not (org and plan):
+        return
+
+    # Replace the organization's subscription
+    if org.current_subscription:
+        org.current_subscription.status = 'cancelled'
+        org.current_subscription.end_date = datetime.utcnow()
+
+    subscription = Subscription(
+        organization_id=org.id,
+        plan_id=plan.id,
+        status='active',
+        start_date=datetime.utcnow(),
+        next_billing_date=datetime.utcnow() + timedelta(days=30)
+    )
+    db.session.add(subscription)
+    db.session.flush()
+
+    org.subscription_plan_id = plan.id
+    org.current_subscription_id = subscription.id
+    enforce_seat_limit(org, plan.team_size_limit)
+    # Remember the Stripe ids so later plan changes can be synced
+    if session.get('customer'):
+        org.stripe_customer_id = session.get('customer')
+    if session.get('subscription'):
+        org.stripe_subscription_id = session.get('subscription')
+    logger.info(f'Checkout completed: organization {org.id} subscribed to {plan.name}')
+
+@webhook_handler('customer.subscription.created', 'customer.subscription.updated')
+def _subscription_updated(event):
+    refresh_snapshot(event.data.object, as_of=event.created)
+
+@webhook_handler('customer.subscription.deleted')
+def _subscription_deleted(event):
+    stripe_subscription = event.data.object
+    refresh_snapshot(stripe_subscription, as_of=event.created)
+
+    org = _organization_for(stripe_subscription.get('id'), stripe_subscription.get('metadata'))
+    if org is None or org.stripe_subscription_id != stripe_subscription.get('id'):
+        return
+    current = org.current_subscription
+    if current and current.status != 'cancelled':
+        current.status = 'cancelled'
+        current.end_date = _timestamp(stripe_subscription.get('ended_at')) or datetime.utcnow()
+        logger.info(f'Stripe ended the subscription of organization {org.id}')
+
+@webhook_handler('invoice.paid')
+def _invoice_paid(event):
+    invoice = event.data.object
+    org = _organization_for(invoice.get('subscription'))
+    if org is None or org.current_subscription is None:
+        return
+    lines = (invoice.get('lines') or {}).get('data') or []
+    period_end = lines[0].get('period', {}).get('end') if lines else None
+    org.current_subscription.last_billing_date = _timestamp(event.created)
+    if period_end:
+        org.current_subscription.next_billing_date = _timestamp(period_end)
+
+@webhook_handler('invoice.payment_failed')
+def _invoice_payment_failed(event):
+    invoice = event.data.object
+    org = _organization_for(invoice.get('subscription'))
+    # Stripe follows up with customer.subscription.updated (status past_due),
+    # which updates the snapshot; here we only make the failure visible
+    logger.warning(f'Invoice payment failed for organization {org.id if org else None} '
+                   f'(invoice {invoice.get("id")}, attempt {invoice.get("attempt_count")})')
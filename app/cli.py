@@ -0,0 +1,137 @@
+import click
+from flask.cli import AppGroup
+
+stats_cli = AppGroup('stats', help='Materialized counter maintenance.')
+jobs_cli = AppGroup('jobs', help='Background job queue.')
+mail_cli = AppGroup('mail', help='Outbound mail queue.')
+maintenance_cli = AppGroup('maintenance', help='Purge and archive old rows.')
+similar_cli = AppGroup('similar', help='Similar-ticket index.')
+
+@stats_cli.command('verify')
+def verify_stats():
+    """Report drift between materialized counters and the source tables"""
+    from app.stats import verify_counters
+
+    drift = verify_counters()
+    if not drift:
+        click.echo('All counters match.')
+        return
+    for row in drift:
+        click.echo(f"{row['counter']} {row['key']}: stored={row['stored']} expected={row['expected']}")
+    click.echo(f'{len(drift)} counter(s) drifted. Run "flask stats rebuild" to fix them.')
+    raise SystemExit(1)
+
+@stats_cli.command('rebuild')
+def rebuild_stats():
+    """Recompute materialized counters from scratch"""
+    from app.stats import rebuild_counters, verify_counters
+
+    drift = verify_counters()
+    rebuild_counters()
+    click.echo(f'Counters rebuilt. {len(drift)} counter(s) had drifted.')
+
+@jobs_cli.command('work')
+def work_jobs():
+    """Run a job worker in the foreground until interrupted"""
+    from app.jobs import job_queue
+
+    click.echo('Job worker started. Press Ctrl+C to stop.')
+    try:
+        job_queue.work()
+    except KeyboardInterrupt:
+        click.echo('Job worker stopped.')
+
+@jobs_cli.command('stats')
+def job_stats():
+    """Show queue depth, failures and recent latency"""
+    from app.jobs import job_queue
+
+    stats = job_queue.stats()
+    click.echo(f"Pending: {stats['depth']}  Running: {stats['running']}  "
+               f"Failed: {stats['failed']}  Done: {stats['done']}")
+    click.echo(f"Average latency (last 100 jobs): {stats['recent_avg_latency_seconds']}s")
+
+@jobs_cli.command('retry')
+@click.option('--kind', help='Only jobs of this kind, e.g. stripe_call.')
+@click.option('--id', 'ids', type=int, multiple=True, help='Only this job (repeatable).')
+def retry_jobs(kind, ids):
+    """Queue failed jobs to run again, with their original payload"""
+    from app.jobs import job_queue
+
+    count = job_queue.retry_failed(kind=kind, ids=ids)
+    click.echo(f'{count} failed job(s) queued again.')
+
+@mail_cli.command('work')
+def work_mail():
+    """Run a mail worker in the foreground until interrupted"""
+    from app.email import mail_queue
+
+    click.echo('Mail worker started. Press Ctrl+C to stop.')
+    try:
+        mail_queue.work()
+    except KeyboardInterrupt:
+        click.echo('Mail worker stopped.')
+
+@mail_cli.command('stats')
+def mail_stats():
+    """Show mail queue depth, failures and delivery latency"""
+    from app.email import mail_queue
+
+    stats = mail_queue.stats()
+    click.echo(f"Pending: {stats['depth']}  Sending: {stats['sending']}  "
+               f"Failed: {stats['failed']}  Sent: {stats['sent']}")
+    click.echo(f"Oldest pending: {stats['oldest_pending_seconds']}s  "
+               f"Average latency (last 100 sent): {stats['recent_avg_latency_seconds']}s")
+
+@maintenance_cli.command('run')
+@click.option('--task', 'tasks', multiple=True, help='Task to run (repeatable); all tasks by default.')
+@click.option('--batch-size', type=int, help='Rows per batch; MAINTENANCE_BATCH_SIZE by default.')
+@click.option('--max-batches', type=int, help='Stop each task after this many batches.')
+def run_maintenance_tasks(tasks, batch_size, max_batches):
+    """Purge expired invitations and archive closed subscriptions"""
+    from app.maintenance import TASKS, run_maintenance
+
+    unknown = set(tasks) - set(TASKS)
+    if unknown:
+        raise click.BadParameter(f"unknown task(s) {', '.join(sorted(unknown))}; "
+                                 f"choose from {', '.join(TASKS)}", param_hint='--task')
+    totals = {name: [0, 0.0] for name in tasks or TASKS}
+    for result in run_maintenance(tasks, batch_size, max_batches):
+        click.echo(f"{result['task']} batch {result['batch']}: {result['rows']} rows in {result['ms']} ms")
+        totals[result['task']][0] += result['rows']
+        totals[result['task']][1] += result['ms']
+    for name, (rows, ms) in totals.items():
+        click.echo(f'{name}: {rows} rows in {round(ms, 1)} ms')
+
+@similar_cli.command('rebuild')
+@click.option('--organization-id', 'organization_ids', type=int, multiple=True,
+              help='Organization to rebuild (repeatable); all organizations by default.')
+def rebuild_similar(organization_ids):
+    """Recreate similarity indexes from the tickets table"""
+    from app import db
+    from app.models import Organization
+    from app.tickets.similar import organization_tickets, similarity_index
+
+    organization_ids = organization_ids or [row.id for row in db.session.query(Organization.id)]
+    for organization_id in organization_ids:
+        count = similarity_index.rebuild(organization_id, organization_tickets(organization_id))
+        click.echo(f'Organization {organization_id}: {count} tickets indexed.')
+
+@similar_cli.command('stats')
+def similar_stats():
+    """Show the size of each organization's similarity index"""
+    from app import db
+    from app.models import Organization
+    from app.tickets.similar import similarity_index
+
+    for (organization_id,) in db.session.query(Organization.id).order_by(Organization.id):
+        stats = similarity_index.stats(organization_id)
+        click.echo(f"Organization {organization_id}: {stats['tickets']} tickets, "
+                   f"capacity {stats['capacity']}, {stats['dims']} dims, {stats['bytes']} bytes")
+
+def register(app):
+    app.cli.add_command(stats_cli)
+    app.cli.add_command(jobs_cli)
+    app.cli.add_command(mail_cli)
+    app.cli.add_command(maintenance_cli)
+    app.cli.add_command(similar_cli)
@@ -0,0 +1,261 @@
+from app import db
+from app.database import upsert
+from app.instrumentation import external_call
+from app.models import CompletionCacheEntry
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import hashlib
+import json
+import re
+import threading
+import time
+
+def normalize(text):
+    """Collapse case and whitespace so trivially different prompts share a key"""
+    return re.sub(r'\s+', ' ', (text or '').strip()).casefold()
+
+def cache_key(model, system_prompt, user_content, temperature, max_tokens):
+    """Stable hash of everything that affects a completion"""
+    material = json.dumps([
+        model,
+        normalize(system_prompt),
+        normalize(user_content),
+        round(float(temperature), 3),
+        int(max_tokens)
+    ])
+    return hashlib.sha256(material.encode()).hexdigest()
+
+def _messages(system_prompt, user_content):
+    return [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_content}
+    ]
+
+class MemoryBackend:
+    """Per-process LRU dictionary with a TTL on every entry"""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Store a value and return how many entries were evicted"""
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            evicted = 0
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                evicted += 1
+            return evicted
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+class DatabaseBackend:
+    """Shared cache in the completion_cache table, visible to every worker.
+
+    Reads and writes run on their own connection and commit there, so a
+    lookup never commits or rolls back the caller's session. last_used_at,
+    which orders eviction, is only rewritten once per TOUCH_INTERVAL, so a
+    popular entry doesn't cost a write on every hit.
+    """
+
+    TOUCH_INTERVAL = timedelta(minutes=1)
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+    def get(self, key):
+        table = CompletionCacheEntry.__table__
+        now = datetime.utcnow()
+        with db.engine.begin() as connection:
+            entry = connection.execute(
+                db.select(table.c.value, table.c.expires_at, table.c.last_used_at).where(table.c.key == key)
+            ).first()
+            if entry is None:
+                return None
+            if entry.expires_at < now:
+                connection.execute(table.delete().where(table.c.key == key, table.c.expires_at < now))
+                return None
+            if now - entry.last_used_at >= self.TOUCH_INTERVAL:
+                connection.execute(table.update().where(table.c.key == key).values(last_used_at=now))
+            return entry.value
+
+    def set(self, key, value):
+        table = CompletionCacheEntry.__table__
+        now = datetime.utcnow()
+        expires_at = now + timedelta(seconds=self.ttl)
+        with db.engine.begin() as connection:
+            # Concurrent misses on the same prompt both get here; the later one wins
+            upsert(connection, table,
+                   dict(key=key, value=value, created_at=now, last_used_at=now, expires_at=expires_at),
+                   keys=['key'], set_=dict(value=value, last_used_at=now, expires_at=expires_at))
+
+            # Drop expired entries, then the least recently used beyond the limit
+            evicted = connection.execute(table.delete().where(table.c.expires_at < now)).rowcount
+            overflow = connection.scalar(db.select(db.func.count()).select_from(table)) - self.max_entries
+            if overflow > 0:
+                oldest = db.select(table.c.key).order_by(table.c.last_used_at).limit(overflow).subquery()
+                evicted += connection.execute(
+                    table.delete().where(table.c.key.in_(db.select(oldest.c.key)))
+                ).rowcount
+        return evicted
+
+    def clear(self):
+        with db.engine.begin() as connection:
+            connection.execute(CompletionCacheEntry.__table__.delete())
+
+class RedisBackend:
+    """Any Redis-compatible store; configure maxmemory-policy allkeys-lru for LRU eviction"""
+
+    prefix = 'completion:'
+
+    def __init__(self, url, ttl):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('AI_CACHE_BACKEND=redis requires the redis package (pip install redis).')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return value.decode() if value is not None else None
+
+    def set(self, key, value):
+        self.client.setex(self.prefix + key, self.ttl, value)
+        return 0  # Redis evicts on its own
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+class CompletionCache:
+    """Caches chat completions by a normalized hash of the request"""
+
+    def __init__(self, app=None):
+        self.backend = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('AI_CACHE_BACKEND', 'memory')
+        app.config.setdefault('AI_CACHE_TTL', 86400)
+        app.config.setdefault('AI_CACHE_MAX_ENTRIES', 1000)
+        app.config.setdefault('AI_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+
+        backend = app.config['AI_CACHE_BACKEND']
+        ttl = app.config['AI_CACHE_TTL']
+        max_entries = app.config['AI_CACHE_MAX_ENTRIES']
+        if backend == 'memory':
+            self.backend = MemoryBackend(max_entries, ttl)
+        elif backend == 'database':
+            self.backend = DatabaseBackend(max_entries, ttl)
+        elif backend == 'redis':
+            self.backend = RedisBackend(app.config['AI_CACHE_REDIS_URL'], ttl)
+        elif backend in ('none', ''):
+            self.backend = None
+        else:
+            raise ValueError(f'Unknown AI_CACHE_BACKEND {backend!r}')
+        app.extensions['completion_cache'] = self
+
+    def complete(self, client, model, system_prompt, user_content, max_tokens, temperature):
+        """Return the completion text, calling the API only on a cache miss"""
+        key = cache_key(model, system_prompt, user_content, temperature, max_tokens)
+        if self.backend is not None:
+            cached = self.backend.get(key)
+            if cached is not None:
+                self._record(hits=1)
+                return cached
+
+        self._record(misses=1)
+        with external_call('openai'):
+            response = client.chat.completions.create(
+                model=model,
+                messages=_messages(system_prompt, user_content),
+                max_tokens=max_tokens,
+                temperature=temperature
+            )
+        if not response.choices:
+            return None
+        content = response.choices[0].message.content
+        self._store(key, content)
+        return content
+
+    def stream(self, client, model, system_prompt, user_content, max_tokens, temperature):
+        """Yield the completion text as the model produces it.
+
+        A cached answer is replayed as a single chunk; a fresh one is cached
+        once the stream finishes, so abandoned streams are never stored.
+        """
+        key = cache_key(model, system_prompt, user_content, temperature, max_tokens)
+        if self.backend is not None:
+            cached = self.backend.get(key)
+            if cached is not None:
+                self._record(hits=1)
+                yield cached
+                return
+
+        self._record(misses=1)
+        # Only until the stream opens; the chunks arrive while the client reads
+        with external_call('openai'):
+            response = client.chat.completions.create(
+                model=model,
+                messages=_messages(system_prompt, user_content),
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True
+            )
+        parts = []
+        for chunk in response:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content
+            if delta:
+                parts.append(delta)
+                yield delta
+        self._store(key, ''.join(parts))
+
+    def _store(self, key, content):
+        if self.backend is not None and content:
+            self._record(evictions=self.backend.set(key, content))
+
+    def _record(self, hits=0, misses=0, evictions=0):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+            self.evictions += evictions
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': type(self.backend).__name__ if self.backend else None,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None
+            }
+
+completion_cache = CompletionCache()
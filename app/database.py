@@ -0,0 +1,186 @@
+"""Engine options and binds, built from the DB_* settings in config.py.
+
+create_app() calls configure_engines() before db.init_app(), so every engine
+Flask-SQLAlchemy creates (the primary and the optional "replica" bind) gets:
+
+- pool_pre_ping and pool_recycle, so connections dropped by a database
+  restart or an idle timeout are replaced instead of failing a request;
+- pool_size, max_overflow and pool_timeout (not for SQLite, whose pools
+  don't take them);
+- on PostgreSQL, a per-connection statement_timeout and application_name,
+  passed as libpq startup options so they cost no extra round trip; with
+  the psycopg 3 driver (postgresql+psycopg://) also prepare_threshold, which
+  turns on server-side prepared statements.
+
+Options already in SQLALCHEMY_ENGINE_OPTIONS win over the DB_* settings.
+
+Reads go to the replica only inside replica_reads(), which read-only views
+use as a decorator. RoutingSession (db's session class) then sends queries to
+the "replica" engine, while flushes and models with their own bind still go
+to the primary. A browser whose requests committed a write in the last
+DB_REPLICA_STICKY_SECONDS keeps reading from the primary, so users see
+their own new or updated tickets even while the replica lags.
+
+Pooled connections are never shared across a fork: a process that checks
+out a connection opened by its parent (gunicorn with preload_app) gets a
+fresh one instead, and the parent's socket is left alone.
+
+upsert() inserts a row or updates the one already holding its key, for
+counters and cache rows that concurrent requests may create at once.
+"""
+from contextlib import contextmanager
+from flask import current_app, has_request_context, session as flask_session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, exc
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import Pool
+import os
+import time
+
+REPLICA_BIND = 'replica'
+# Flask session key holding the time of this browser's last committed write
+LAST_WRITE_KEY = '_db_write_at'
+
+def normalize_url(url):
+    # Railway and Heroku hand out postgres://, which SQLAlchemy no longer accepts
+    if url and url.startswith('postgres://'):
+        return url.replace('postgres://', 'postgresql://', 1)
+    return url
+
+def engine_options(config, url):
+    """Engine keyword arguments for one database URL"""
+    options = {
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+    }
+    url = make_url(url)
+    if url.get_backend_name() == 'sqlite':
+        return options
+
+    options.update(
+        pool_size=config['DB_POOL_SIZE'],
+        max_overflow=config['DB_MAX_OVERFLOW'],
+        pool_timeout=config['DB_POOL_TIMEOUT'],
+    )
+    if url.get_backend_name() == 'postgresql':
+        connect_args = {}
+        if config['DB_APPLICATION_NAME']:
+            connect_args['application_name'] = config['DB_APPLICATION_NAME']
+        if config['DB_STATEMENT_TIMEOUT_MS']:
+            connect_args['options'] = f"-c statement_timeout={int(config['DB_STATEMENT_TIMEOUT_MS'])}"
+        # psycopg2 has no server-side prepared statements
+        if url.get_driver_name() == 'psycopg' and config['DB_PREPARE_THRESHOLD'] is not None:
+            connect_args['prepare_threshold'] = config['DB_PREPARE_THRESHOLD']
+        if connect_args:
+            options['connect_args'] = connect_args
+    return options
+
+def configure_engines(app):
+    """Fill in SQLALCHEMY_ENGINE_OPTIONS and the replica bind from config"""
+    config = app.config
+    config.setdefault('DB_POOL_SIZE', 5)
+    config.setdefault('DB_MAX_OVERFLOW', 10)
+    config.setdefault('DB_POOL_TIMEOUT', 30)
+    config.setdefault('DB_POOL_RECYCLE', 1800)
+    config.setdefault('DB_POOL_PRE_PING', True)
+    config.setdefault('DB_STATEMENT_TIMEOUT_MS', 0)
+    config.setdefault('DB_APPLICATION_NAME', None)
+    config.setdefault('DB_PREPARE_THRESHOLD', None)
+    config.setdefault('DATABASE_REPLICA_URL', None)
+    config.setdefault('DB_REPLICA_STICKY_SECONDS', 5)
+
+    url = normalize_url(config['SQLALCHEMY_DATABASE_URI'])
+    config['SQLALCHEMY_DATABASE_URI'] = url
+    config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        **engine_options(config, url), **(config.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    }
+
+    replica_url = normalize_url(config['DATABASE_REPLICA_URL'])
+    if replica_url:
+        binds = dict(config.get('SQLALCHEMY_BINDS') or {})
+        binds.setdefault(REPLICA_BIND, {'url': replica_url, **engine_options(config, replica_url)})
+        config['SQLALCHEMY_BINDS'] = binds
+
+def upsert(connection, table, values, keys, set_):
+    """Insert values, or apply set_ to the row that already has the same keys.
+
+    One INSERT ... ON CONFLICT DO UPDATE on PostgreSQL and SQLite, so two
+    requests inserting the same key never fail on its unique constraint.
+    keys must be the columns of a primary key or unique constraint.
+    """
+    dialect = connection.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        connection.execute(insert(table).values(**values).on_conflict_do_update(index_elements=keys, set_=set_))
+        return
+    # Other databases: insert in a savepoint and update if the key is taken
+    try:
+        with connection.begin_nested():
+            connection.execute(table.insert().values(**values))
+    except exc.IntegrityError:
+        connection.execute(table.update().where(*(table.c[key] == values[key] for key in keys)).values(**set_))
+
+@event.listens_for(Pool, 'connect')
+def _remember_pid(dbapi_connection, connection_record):
+    connection_record.info['pid'] = os.getpid()
+
+@event.listens_for(Pool, 'checkout')
+def _check_pid(dbapi_connection, connection_record, connection_proxy):
+    if connection_record.info.get('pid', os.getpid()) != os.getpid():
+        # Opened before a fork; drop it without closing the parent's socket
+        connection_record.dbapi_connection = connection_proxy.dbapi_connection = None
+        raise exc.DisconnectionError('Connection was opened in another process')
+
+class RoutingSession(Session):
+    """Session that reads from the replica inside replica_reads()"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        # Only the primary is swapped; explicit binds and other bind keys stay put
+        if bind is None and self.info.get('use_replica') and not self._flushing:
+            engines = self._db.engines
+            if engine is engines[None]:
+                return engines[REPLICA_BIND]
+        return engine
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _flushed(session, flush_context):
+    session.info['wrote'] = True
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _committed(session):
+    if session.info.pop('wrote', False) and has_request_context():
+        flask_session[LAST_WRITE_KEY] = time.time()
+
+@event.listens_for(RoutingSession, 'after_rollback')
+def _rolled_back(session):
+    session.info.pop('wrote', None)
+
+def wrote_recently():
+    """Whether this browser committed a write within DB_REPLICA_STICKY_SECONDS"""
+    if not has_request_context():
+        return False
+    written_at = flask_session.get(LAST_WRITE_KEY)
+    return written_at is not None and time.time() - written_at < current_app.config['DB_REPLICA_STICKY_SECONDS']
+
+@contextmanager
+def replica_reads():
+    """Send this block's queries to the replica, if there is one.
+
+    Also works as a view decorator (@replica_reads()); put it below
+    @login_required so the user and organization still load from the primary.
+    Falls back to the primary when no replica is configured or the user has
+    just written.
+    """
+    db = current_app.extensions['sqlalchemy']
+    if REPLICA_BIND not in db.engines or wrote_recently():
+        yield
+        return
+    session = db.session()
+    previous = session.info.get('use_replica', False)
+    session.info['use_replica'] = True
+    try:
+        yield
+    finally:
+        session.info['use_replica'] = previous
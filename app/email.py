@@ -1,59 +1,259 @@
 from flask import current_app
 from flask_mail import Message
-from app import mail
-from threading import Thread
-import traceback
+from app import db, mail
+from app.instrumentation import external_call
+from app.metrics import count_emails
+from app.models import OutboundEmail
+from datetime import datetime, timedelta
+from sqlalchemy import or_, and_, insert
+import smtplib
+import threading
+import time
 import logging
-import sys
-
-# Set up logging
-logging.basicConfig(
-    filename='email_debug.log',
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
-# Also log to console
-console_handler = logging.StreamHandler(sys.stdout)
-console_handler.setLevel(logging.DEBUG)
-logging.getLogger().addHandler(console_handler)
-
-def send_async_email(app, msg):
-    try:
-        with app.app_context():
-            logging.info(f"Attempting to send email to: {msg.recipients}")
-            logging.info(f"Using SMTP server: {app.config['MAIL_SERVER']}:{app.config['MAIL_PORT']}")
-            logging.info(f"SSL: {app.config['MAIL_USE_SSL']}, TLS: {app.config['MAIL_USE_TLS']}")
-            logging.info(f"Username: {app.config['MAIL_USERNAME']}")
-            logging.info(f"Password length: {len(app.config['MAIL_PASSWORD'])}")
-            mail.send(msg)
-            logging.info("Email sent successfully!")
-    except Exception as e:
-        logging.error(f"Error sending email: {str(e)}")
-        logging.error("Traceback:")
-        logging.error(traceback.format_exc())
-        # Re-raise the exception to ensure it's not silently caught
-        raise
+import os
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Errors that concern one message; anything else is treated as a broken connection
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+class MailQueue:
+    """Outbound mail stored in the outbound_emails table and sent by a fixed worker pool.
+
+    Each worker claims a batch of due messages and sends them over a single SMTP
+    connection. Failed messages are retried with exponential backoff. Point
+    MAIL_SERVER/MAIL_PORT at a local debugging server to watch what would be sent:
+
+        python -m smtpd -n -c DebuggingServer localhost:1025    # Python <= 3.11
+        python -m aiosmtpd -n -l localhost:1025                  # with aiosmtpd installed
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._wakeup = threading.Event()
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.batches = 0
+        self.send_seconds = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('MAIL_WORKERS', 1)
+        app.config.setdefault('MAIL_BATCH_SIZE', 20)
+        app.config.setdefault('MAIL_POLL_INTERVAL', 5.0)
+        app.config.setdefault('MAIL_MAX_ATTEMPTS', 5)
+        app.config.setdefault('MAIL_STALE_AFTER', 300)
+        self.app = app
+        app.extensions['mail_queue'] = self
+        # Threads don't survive a fork, so start them lazily in each worker process
+        app.before_request(self.ensure_started)
+
+    def enqueue(self, subject, sender, recipients, text_body, html_body):
+        """Add a message to the current session; it is sent after the caller commits"""
+        email = OutboundEmail(subject=subject, sender=sender, recipients=list(recipients),
+                              text_body=text_body, html_body=html_body)
+        db.session.add(email)
+        return email
+
+    def enqueue_many(self, messages):
+        """Add many messages with one multi-row INSERT; sent after the caller commits.
+
+        messages are dicts with the enqueue() arguments as keys.
+        """
+        if not messages:
+            return
+        now = datetime.utcnow()
+        db.session.execute(insert(OutboundEmail), [{
+            'subject': message['subject'],
+            'sender': message['sender'],
+            'recipients': list(message['recipients']),
+            'text_body': message['text_body'],
+            'html_body': message['html_body'],
+            'status': 'pending',
+            'attempts': 0,
+            'created_at': now,
+            'run_at': now
+        } for message in messages])
+
+    def wake(self):
+        """Tell idle workers that new messages were committed"""
+        self._wakeup.set()
+
+    def ensure_started(self):
+        if self._pid == os.getpid() or self.app.config['MAIL_WORKERS'] <= 0:
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._threads = []
+            for i in range(self.app.config['MAIL_WORKERS']):
+                thread = threading.Thread(target=self.work, name=f'mail-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def work(self, stop_event=None):
+        """Send batches until stop_event is set (forever if not given)"""
+        while stop_event is None or not stop_event.is_set():
+            sent_any = False
+            with self.app.app_context():
+                try:
+                    sent_any = self.send_batch() > 0
+                except Exception:
+                    db.session.rollback()
+                    logger.exception('Mail worker error')
+                finally:
+                    db.session.remove()
+            if not sent_any:
+                self._wakeup.wait(self.app.config['MAIL_POLL_INTERVAL'])
+                self._wakeup.clear()
+
+    def send_batch(self):
+        """Claim and send one batch of due messages; return how many were claimed"""
+        batch = self._claim_batch()
+        if not batch:
+            return 0
+
+        started = time.perf_counter()
+        sent, errors = [], {}
+        try:
+            # One SMTP session for the whole batch (Flask-Mail reconnects every MAIL_MAX_EMAILS)
+            with external_call('smtp'), mail.connect() as connection:
+                for email in batch:
+                    try:
+                        connection.send(self._message(email))
+                        sent.append(email.id)
+                    except MESSAGE_ERRORS as e:
+                        errors[email.id] = e
+        except Exception as e:
+            # Connection-level failure: everything not yet sent is retried
+            for email in batch:
+                if email.id not in sent and email.id not in errors:
+                    errors[email.id] = e
+        elapsed = time.perf_counter() - started
+
+        now = datetime.utcnow()
+        if sent:
+            OutboundEmail.query.filter(OutboundEmail.id.in_(sent)).update({
+                OutboundEmail.status: 'sent',
+                OutboundEmail.sent_at: now,
+                OutboundEmail.last_error: None,
+                OutboundEmail.claim_token: None
+            }, synchronize_session=False)
+        retried = failed = 0
+        for email in batch:
+            if email.id not in errors:
+                continue
+            error = errors[email.id]
+            email.last_error = f'{type(error).__name__}: {error}'
+            email.claim_token = None
+            if email.attempts < self.app.config['MAIL_MAX_ATTEMPTS']:
+                # Exponential backoff: 30s, 60s, 120s, ...
+                email.status = 'pending'
+                email.run_at = now + timedelta(seconds=15 * 2 ** email.attempts)
+                retried += 1
+            else:
+                email.status = 'failed'
+                failed += 1
+            logger.warning(f'Email {email.id} attempt {email.attempts} failed: {error}',
+                           extra={'email_id': email.id, 'attempts': email.attempts, 'status': email.status})
+        db.session.commit()
+
+        self._record(sent=len(sent), failed=failed, retried=retried, seconds=elapsed)
+        count_emails(sent=len(sent), retried=retried, failed=failed)
+        logger.info(f'Mail batch: {len(sent)} sent, {retried} retrying, {failed} failed in {elapsed * 1000:.0f}ms',
+                    extra={'sent': len(sent), 'retried': retried, 'failed': failed,
+                           'elapsed_ms': round(elapsed * 1000, 1)})
+        return len(batch)
+
+    def _claim_batch(self):
+        """Atomically mark a batch of due messages as sending and return them"""
+        now = datetime.utcnow()
+        stale_before = now - timedelta(seconds=self.app.config['MAIL_STALE_AFTER'])
+        claimable = or_(
+            and_(OutboundEmail.status == 'pending', OutboundEmail.run_at <= now),
+            # Messages left mid-send by a worker that died
+            and_(OutboundEmail.status == 'sending', OutboundEmail.started_at < stale_before)
+        )
+        candidates = db.session.query(OutboundEmail.id).filter(claimable).order_by(
+            OutboundEmail.run_at
+        ).limit(self.app.config['MAIL_BATCH_SIZE']).scalar_subquery()
+
+        # Re-checking claimable in the UPDATE keeps two workers from taking the same row
+        token = uuid.uuid4().hex
+        OutboundEmail.query.filter(OutboundEmail.id.in_(candidates), claimable).update({
+            OutboundEmail.status: 'sending',
+            OutboundEmail.attempts: OutboundEmail.attempts + 1,
+            OutboundEmail.claim_token: token,
+            OutboundEmail.started_at: now
+        }, synchronize_session=False)
+        db.session.commit()
+        return OutboundEmail.query.filter_by(claim_token=token).order_by(OutboundEmail.id).all()
+
+    def _message(self, email):
+        msg = Message(email.subject, sender=email.sender, recipients=email.recipients)
+        msg.body = email.text_body
+        msg.html = email.html_body
+        return msg
+
+    def _record(self, sent=0, failed=0, retried=0, seconds=0.0):
+        with self._stats_lock:
+            self.sent += sent
+            self.failed += failed
+            self.retried += retried
+            self.batches += 1
+            self.send_seconds += seconds
+
+    def stats(self):
+        """Queue depth and delivery latency from the database plus this process's counters"""
+        counts = dict(db.session.query(
+            OutboundEmail.status, db.func.count(OutboundEmail.id)
+        ).group_by(OutboundEmail.status).all())
+        oldest = db.session.query(db.func.min(OutboundEmail.created_at)).filter(
+            OutboundEmail.status == 'pending'
+        ).scalar()
+        recent = db.session.query(OutboundEmail.created_at, OutboundEmail.sent_at).filter(
+            OutboundEmail.status == 'sent'
+        ).order_by(OutboundEmail.sent_at.desc()).limit(100).all()
+        latencies = [(sent_at - created).total_seconds() for created, sent_at in recent]
+        with self._stats_lock:
+            process = {
+                'sent': self.sent,
+                'failed': self.failed,
+                'retried': self.retried,
+                'batches': self.batches,
+                'avg_send_ms': round(self.send_seconds / self.sent * 1000, 1) if self.sent else None,
+                'workers': sum(thread.is_alive() for thread in self._threads)
+            }
+        return {
+            'depth': counts.get('pending', 0),
+            'sending': counts.get('sending', 0),
+            'failed': counts.get('failed', 0),
+            'sent': counts.get('sent', 0),
+            'oldest_pending_seconds': round((datetime.utcnow() - oldest).total_seconds(), 1) if oldest else None,
+            'recent_avg_latency_seconds': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'process': process
+        }
+
+mail_queue = MailQueue()
 
 def send_email(subject, sender, recipients, text_body, html_body):
+    """Queue an email for delivery and commit it so it survives a restart"""
     try:
-        logging.info(f"\nPreparing to send email:")
-        logging.info(f"Subject: {subject}")
-        logging.info(f"From: {sender}")
-        logging.info(f"To: {recipients}")
-        msg = Message(subject, sender=sender, recipients=recipients)
-        msg.body = text_body
-        msg.html = html_body
-        
-        # Create a daemon thread that will not block the application
-        email_thread = Thread(target=send_async_email, args=(current_app._get_current_object(), msg))
-        email_thread.daemon = True
-        email_thread.start()
-        
-        logging.info("Email thread started")
-    except Exception as e:
-        logging.error(f"Error preparing email: {str(e)}")
-        logging.error("Traceback:")
-        logging.error(traceback.format_exc())
+        email = mail_queue.enqueue(subject, sender, recipients, text_body, html_body)
+        db.session.commit()
+        mail_queue.wake()
+        logger.info(f'Queued email {email.id}', extra={'email_id': email.id, 'recipients': len(recipients)})
+    except Exception:
+        db.session.rollback()
+        logger.exception('Error queueing email')
         # Re-raise the exception to ensure it's not silently caught
         raise
 
@@ -0,0 +1,133 @@
+from app import db, login
+from app.models import User, Organization, SubscriptionPlan, _previous_value
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+import threading
+import time
+
+def _load(user_id):
+    """User, organization and subscription plan in one joined query"""
+    return User.query.options(
+        joinedload(User.organization).joinedload(Organization.subscription_plan)
+    ).filter(User.id == user_id).first()
+
+def _columns(obj):
+    return {attr.key: getattr(obj, attr.key) for attr in obj.__mapper__.column_attrs}
+
+def _detached(cls, values):
+    """Clean detached instance built from cached column values"""
+    obj = cls.__mapper__.class_manager.new_instance()
+    for key, value in values.items():
+        set_committed_value(obj, key, value)
+    make_transient_to_detached(obj)
+    return obj
+
+class IdentityCache:
+    """Loads the logged-in user for Flask-Login.
+
+    The user, organization and plan come from one joined query and then live
+    in the request's session, so current_user.organization and its plan don't
+    lazy-load again. With IDENTITY_CACHE_TTL > 0 the loaded rows are also kept
+    in a process-local cache for that many seconds. Updates to a cached user,
+    organization or plan made in this process drop the affected entries; other
+    processes see them once the TTL runs out.
+    """
+
+    def __init__(self, app=None):
+        self.ttl = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('IDENTITY_CACHE_TTL', 0)
+        self.ttl = app.config['IDENTITY_CACHE_TTL']
+        app.extensions['identity_cache'] = self
+
+    def load(self, user_id):
+        if self.ttl <= 0:
+            return _load(user_id)
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[user_id]
+                entry = None
+            self.hits += entry is not None
+            self.misses += entry is None
+        if entry is not None:
+            return db.session.merge(self._rebuild(*entry[1:]), load=False)
+
+        user = _load(user_id)
+        if user is not None:
+            org = user.organization
+            plan = org.subscription_plan if org is not None else None
+            with self._lock:
+                self._entries[user_id] = (
+                    time.monotonic() + self.ttl,
+                    _columns(user),
+                    _columns(org) if org is not None else None,
+                    _columns(plan) if plan is not None else None
+                )
+        return user
+
+    def _rebuild(self, user_values, org_values, plan_values):
+        """Detached user graph that merge(load=False) can attach without a query"""
+        user = _detached(User, user_values)
+        org = None
+        if org_values is not None:
+            org = _detached(Organization, org_values)
+            plan = _detached(SubscriptionPlan, plan_values) if plan_values is not None else None
+            set_committed_value(org, 'subscription_plan', plan)
+        set_committed_value(user, 'organization', org)
+        return user
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def invalidate_organization(self, organization_id):
+        with self._lock:
+            for user_id in [user_id for user_id, entry in self._entries.items()
+                            if entry[2] is not None and entry[2]['id'] == organization_id]:
+                del self._entries[user_id]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'ttl': self.ttl, 'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+identity_cache = IdentityCache()
+
+# Role and membership changes (admin.update_member_role, admin.remove_member),
+# plan switches and seat changes must not be served from the cache
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def _user_changed(mapper, connection, target):
+    identity_cache.invalidate(target.id)
+    # Membership changes move the organizations' active user counters
+    for organization_id in {_previous_value(target, 'organization_id'), target.organization_id}:
+        if organization_id is not None:
+            identity_cache.invalidate_organization(organization_id)
+
+@event.listens_for(Organization, 'after_update')
+@event.listens_for(Organization, 'after_delete')
+def _organization_changed(mapper, connection, target):
+    identity_cache.invalidate_organization(target.id)
+
+@event.listens_for(SubscriptionPlan, 'after_update')
+@event.listens_for(SubscriptionPlan, 'after_delete')
+def _plan_changed(mapper, connection, target):
+    identity_cache.clear()
+
+@login.user_loader
+def load_user(id):
+    return identity_cache.load(int(id))
@@ -0,0 +1,258 @@
+"""Per-request timing: wall time, SQL, external calls and response size.
+
+Every request gets a RequestTiming in flask.g. SQLAlchemy cursor events add
+each statement's count and duration to it, and external_call() blocks add
+the time spent waiting on OpenAI, Stripe or SMTP. After the request:
+
+- a Server-Timing header breaks the time down for the browser's dev tools,
+- per-endpoint histograms in this process are updated (snapshot()),
+- requests slower than SLOW_REQUEST_MS are logged with their SQL, grouped
+  by statement with counts, so an N+1 shows up as one line with a big count.
+
+Outside a request (job and mail workers, the CLI) statements aren't
+tracked, but external calls still feed the per-service histograms and any
+listeners added with on_external_call().
+"""
+from flask import current_app, g, has_request_context, request, jsonify, abort
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+import hmac
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds in milliseconds; the last bucket is +Inf
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# Distinct statements kept per request for the slow-request log
+MAX_STATEMENTS = 100
+STATEMENT_CHARS = 1000
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS_MS):
+            if value <= bound:
+                break
+        else:
+            i = len(BUCKETS_MS)
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': round(self.sum, 1),
+            # [upper bound, count] pairs, in order
+            'buckets': [list(pair) for pair in zip([*BUCKETS_MS, '+Inf'], self.counts)]
+        }
+
+class RequestTiming:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.sql_count = 0
+        self.sql_ms = 0.0
+        # statement -> [count, total ms]
+        self.statements = {}
+        # service -> total ms
+        self.external = {}
+
+    def add_statement(self, statement, ms):
+        self.sql_count += 1
+        self.sql_ms += ms
+        entry = self.statements.get(statement)
+        if entry is None:
+            if len(self.statements) >= MAX_STATEMENTS:
+                return
+            entry = self.statements[statement] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += ms
+
+    def slowest_statements(self, limit):
+        ranked = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)
+        return [{'sql': sql[:STATEMENT_CHARS], 'count': count, 'ms': round(ms, 1)}
+                for sql, (count, ms) in ranked[:limit]]
+
+def current_timing():
+    return g.get('_request_timing') if has_request_context() else None
+
+class ExternalCall:
+    """Yielded by external_call(); set error for failures that don't raise"""
+
+    def __init__(self, service):
+        self.service = service
+        self.error = False
+        self.seconds = None
+
+_external_listeners = []
+
+def on_external_call(listener):
+    """Call listener(call) after every external call, e.g. to export metrics"""
+    if listener not in _external_listeners:
+        _external_listeners.append(listener)
+    return listener
+
+@contextmanager
+def external_call(service):
+    """Time a call to an outside service (openai, stripe, smtp)"""
+    call = ExternalCall(service)
+    started = time.perf_counter()
+    try:
+        yield call
+    except Exception:
+        call.error = True
+        raise
+    finally:
+        call.seconds = time.perf_counter() - started
+        ms = call.seconds * 1000
+        timing = current_timing()
+        if timing is not None:
+            timing.external[service] = timing.external.get(service, 0.0) + ms
+        request_metrics.observe_external(service, ms)
+        for listener in _external_listeners:
+            listener(call)
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if current_timing() is not None:
+        conn.info.setdefault('_query_started', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timing = current_timing()
+    started = conn.info.get('_query_started')
+    if timing is not None and started:
+        timing.add_statement(statement, (time.perf_counter() - started.pop()) * 1000)
+
+class EndpointStats:
+    def __init__(self):
+        self.wall_ms = Histogram()
+        self.sql_ms = Histogram()
+        self.sql_statements = 0
+        self.external_ms = {}
+        self.response_bytes = 0
+        self.statuses = {}
+
+    def snapshot(self):
+        return {
+            'requests': self.wall_ms.count,
+            'wall_ms': self.wall_ms.snapshot(),
+            'sql_ms': self.sql_ms.snapshot(),
+            'sql_statements': self.sql_statements,
+            'external_ms': {service: round(ms, 1) for service, ms in self.external_ms.items()},
+            'response_bytes': self.response_bytes,
+            'statuses': dict(self.statuses)
+        }
+
+class RequestMetrics:
+    """Collects RequestTiming for every request; see the module docstring.
+
+    snapshot() returns this process's histograms. With INSTRUMENTATION_TOKEN
+    set they are also served as JSON at /_timings to requests that send
+    "Authorization: Bearer <token>".
+    """
+
+    def __init__(self, app=None):
+        self.enabled = True
+        self._endpoints = {}
+        self._external = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('INSTRUMENTATION_ENABLED', True)
+        app.config.setdefault('SERVER_TIMING_HEADER', True)
+        app.config.setdefault('SLOW_REQUEST_MS', 1000)
+        app.config.setdefault('SLOW_REQUEST_STATEMENTS', 10)
+        app.config.setdefault('INSTRUMENTATION_TOKEN', None)
+        app.extensions['request_metrics'] = self
+        self.enabled = app.config['INSTRUMENTATION_ENABLED']
+        if not self.enabled:
+            return
+
+        if not event.contains(Engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        # First in line, so CSRF checks and the other hooks are inside the wall time
+        app.before_request_funcs.setdefault(None, []).insert(0, self._start)
+        app.after_request(self._finish)
+        if app.config['INSTRUMENTATION_TOKEN']:
+            app.add_url_rule('/_timings', 'request_timings', self._timings_view)
+
+    @staticmethod
+    def _start():
+        g._request_timing = RequestTiming()
+
+    def _finish(self, response):
+        timing = current_timing()
+        if timing is None:
+            return response
+        config = current_app.config
+        wall_ms = (time.perf_counter() - timing.started) * 1000
+        endpoint = request.endpoint or '<unmatched>'
+        size = response.calculate_content_length() or 0
+
+        if config['SERVER_TIMING_HEADER']:
+            parts = [f'app;dur={wall_ms:.1f}', f'db;dur={timing.sql_ms:.1f};desc="{timing.sql_count} queries"']
+            parts += [f'{service};dur={ms:.1f}' for service, ms in timing.external.items()]
+            response.headers['Server-Timing'] = ', '.join(parts)
+
+        with self._lock:
+            stats = self._endpoints.get(endpoint)
+            if stats is None:
+                stats = self._endpoints[endpoint] = EndpointStats()
+            stats.wall_ms.observe(wall_ms)
+            stats.sql_ms.observe(timing.sql_ms)
+            stats.sql_statements += timing.sql_count
+            for service, ms in timing.external.items():
+                stats.external_ms[service] = stats.external_ms.get(service, 0.0) + ms
+            stats.response_bytes += size
+            stats.statuses[response.status_code] = stats.statuses.get(response.status_code, 0) + 1
+
+        if wall_ms >= config['SLOW_REQUEST_MS']:
+            logger.warning(f'Slow request: {request.method} {request.path} took {wall_ms:.0f}ms', extra={
+                'endpoint': endpoint,
+                'method': request.method,
+                'path': request.path,
+                'status': response.status_code,
+                'wall_ms': round(wall_ms, 1),
+                'sql_count': timing.sql_count,
+                'sql_ms': round(timing.sql_ms, 1),
+                'external_ms': {service: round(ms, 1) for service, ms in timing.external.items()},
+                'response_bytes': size,
+                'statements': timing.slowest_statements(config['SLOW_REQUEST_STATEMENTS'])
+            })
+        return response
+
+    def observe_external(self, service, ms):
+        with self._lock:
+            histogram = self._external.get(service)
+            if histogram is None:
+                histogram = self._external[service] = Histogram()
+            histogram.observe(ms)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'endpoints': {name: stats.snapshot() for name, stats in sorted(self._endpoints.items())},
+                'external': {name: histogram.snapshot() for name, histogram in sorted(self._external.items())}
+            }
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+            self._external.clear()
+
+    def _timings_view(self):
+        expected = f"Bearer {current_app.config['INSTRUMENTATION_TOKEN']}"
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), expected):
+            abort(404)
+        return jsonify(self.snapshot())
+
+request_metrics = RequestMetrics()
@@ -0,0 +1,172 @@
+"""Bulk organization invitations.
+
+invite_many() handles a whole list of invitees in a fixed number of
+statements, however long the list is: one query each for existing members
+and pending invitations, one DELETE for stale invitations, one multi-row
+INSERT for the new ones, one more for their emails, and one commit.
+"""
+from flask import current_app, url_for
+from markupsafe import escape
+from app import db
+from app.email import mail_queue
+from app.models import Invitation, User
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert, or_
+import csv
+import io
+import json
+import re
+import time
+import uuid
+
+ROLES = ('user', 'staff', 'admin')
+MAX_ROWS = 1000
+INVITATION_DAYS = 7
+EMAIL_PATTERN = re.compile(r'^[^@\s]+@[^@\s]+\.[^@\s]+$')
+
+class InvalidInviteList(ValueError):
+    pass
+
+def parse_invitees(data, content_type):
+    """(email, role) pairs from a CSV body or a JSON list.
+
+    CSV needs an email column and may have a role column. JSON may be a list
+    of addresses, a list of {"email", "role"} objects, or either of those
+    under an "invitations" key.
+    """
+    if 'csv' in (content_type or ''):
+        try:
+            reader = csv.DictReader(io.StringIO(data.decode('utf-8-sig')))
+            if not reader.fieldnames or 'email' not in [name.strip().lower() for name in reader.fieldnames]:
+                raise InvalidInviteList('CSV needs an "email" column.')
+            rows = [{(key or '').strip().lower(): value for key, value in row.items()} for row in reader]
+        except UnicodeDecodeError:
+            raise InvalidInviteList('CSV must be UTF-8 text.')
+        except csv.Error as e:
+            raise InvalidInviteList(f'Could not read the CSV: {e}.')
+    else:
+        try:
+            rows = json.loads(data or b'null')
+        except ValueError:
+            raise InvalidInviteList('Body must be a JSON list or CSV.')
+        if isinstance(rows, dict):
+            rows = rows.get('invitations')
+        if not isinstance(rows, list):
+            raise InvalidInviteList('Expected a list of invitations.')
+        rows = [row if isinstance(row, dict) else {'email': row} for row in rows]
+
+    if len(rows) > MAX_ROWS:
+        raise InvalidInviteList(f'At most {MAX_ROWS} invitations per request.')
+    return [(str(row.get('email') or '').strip(), str(row.get('role') or 'user').strip().lower())
+            for row in rows]
+
+def invite_many(organization, invitees):
+    """Invite (email, role) pairs to an organization.
+
+    Returns one result per input row, in order, with a status of invited,
+    already_member, already_invited, duplicate or invalid.
+    """
+    now = datetime.utcnow()
+    results = [{'row': i + 1, 'email': email, 'role': role} for i, (email, role) in enumerate(invitees)]
+
+    # Validate and drop repeats within the list itself
+    candidates = {}
+    for result in results:
+        key = result['email'].lower()
+        if not EMAIL_PATTERN.match(result['email']):
+            result['status'] = 'invalid'
+            result['detail'] = 'Not an email address.'
+        elif result['role'] not in ROLES:
+            result['status'] = 'invalid'
+            result['detail'] = f'Role must be one of {", ".join(ROLES)}.'
+        elif key in candidates:
+            result['status'] = 'duplicate'
+            result['detail'] = f'Same address as row {candidates[key]["row"]}.'
+        else:
+            candidates[key] = result
+
+    if candidates:
+        keys = list(candidates)
+        members = db.session.query(func.lower(User.email)).filter(
+            User.organization_id == organization.id,
+            func.lower(User.email).in_(keys)
+        ).all()
+        for (key,) in members:
+            if key in candidates:
+                candidates.pop(key)['status'] = 'already_member'
+
+        pending = db.session.query(func.lower(Invitation.email)).filter(
+            Invitation.organization_id == organization.id,
+            func.lower(Invitation.email).in_(keys),
+            Invitation.accepted == False,
+            Invitation.expires_at > now
+        ).all()
+        for (key,) in pending:
+            if key in candidates:
+                candidates.pop(key)['status'] = 'already_invited'
+
+    if candidates:
+        # Expired or accepted invitations for these addresses are replaced
+        Invitation.query.filter(
+            Invitation.organization_id == organization.id,
+            func.lower(Invitation.email).in_(list(candidates)),
+            or_(Invitation.expires_at <= now, Invitation.accepted == True)
+        ).delete(synchronize_session=False)
+
+        expires_at = now + timedelta(days=INVITATION_DAYS)
+        rows = []
+        for result in candidates.values():
+            result['status'] = 'invited'
+            result['token'] = str(uuid.uuid4())
+            rows.append({
+                'email': result['email'],
+                'organization_id': organization.id,
+                'token': result['token'],
+                'created_at': now,
+                'expires_at': expires_at,
+                # Both admin and staff get admin privileges, as in invite_user
+                'is_admin_invite': result['role'] in ('admin', 'staff'),
+                'accepted': False
+            })
+        db.session.execute(insert(Invitation), rows)
+
+        join_url = url_for('main.index', _external=True)
+        mail_queue.enqueue_many([_invitation_email(organization, result['email'], result['token'], join_url)
+                                 for result in candidates.values()])
+
+    db.session.commit()
+    if candidates:
+        mail_queue.wake()
+    return results
+
+def _invitation_email(organization, email, token, join_url):
+    # The organization name is chosen by its creator, so escape it (and the rest) in the HTML body
+    html_name, html_url, html_token = escape(organization.name), escape(join_url), escape(token)
+    return dict(
+        subject=f'You have been invited to join {organization.name}',
+        sender=current_app.config['MAIL_DEFAULT_SENDER'],
+        recipients=[email],
+        text_body=f'''You have been invited to join {organization.name} on QHelpDesk.
+
+Sign in or register with this email address at {join_url} to accept the
+invitation, or join with this token: {token}
+
+The invitation expires in {INVITATION_DAYS} days.
+
+Best regards,
+The QHelpDesk Team''',
+        html_body=f'''
+<p>You have been invited to join <strong>{html_name}</strong> on QHelpDesk.</p>
+<p><a href="{html_url}">Sign in or register</a> with this email address to accept the invitation, or join with this token: <code>{html_token}</code></p>
+<p>The invitation expires in {INVITATION_DAYS} days.</p>
+<p>Best regards,<br>The QHelpDesk Team</p>
+'''
+    )
+
+def summarize(results, started):
+    """Counts per status plus the elapsed time since started (a perf_counter value)"""
+    counts = {}
+    for result in results:
+        counts[result['status']] = counts.get(result['status'], 0) + 1
+    return {'total': len(results), 'counts': counts,
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)}
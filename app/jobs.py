@@ -0,0 +1,240 @@
+from app import db
+from app.models import Job
+from datetime import datetime, timedelta
+from sqlalchemy import or_, and_
+import logging
+import os
+import threading
+import traceback
+
+logger = logging.getLogger(__name__)
+
+class JobQueue:
+    """Database-backed job queue drained by a fixed pool of worker threads.
+
+    Jobs are rows in the jobs table, so they survive restarts and any process
+    can pick them up. Workers claim a job with a conditional UPDATE, which keeps
+    two gunicorn workers from running the same job.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self.handlers = {}
+        self._wakeup = threading.Event()
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+        self.completed = 0
+        self.failed = 0
+        self.retried = 0
+        self.total_latency = 0.0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('JOB_WORKERS', 2)
+        app.config.setdefault('JOB_POLL_INTERVAL', 2.0)
+        app.config.setdefault('JOB_MAX_ATTEMPTS', 3)
+        app.config.setdefault('JOB_STALE_AFTER', 300)
+        self.app = app
+        app.extensions['job_queue'] = self
+        # Threads don't survive a fork, so start them lazily in each worker process
+        app.before_request(self.ensure_started)
+
+    def handler(self, kind, on_failure=None, backoff=None):
+        """Register the function that runs jobs of this kind.
+
+        backoff(attempts) gives the seconds to wait before the next attempt,
+        or None to give up and call on_failure. By default a job gets
+        JOB_MAX_ATTEMPTS attempts, 2s, 4s, 8s, ... apart.
+        """
+        def decorator(f):
+            self.handlers[kind] = (f, on_failure, backoff or self._default_backoff)
+            return f
+        return decorator
+
+    def _default_backoff(self, attempts):
+        if attempts >= self.app.config['JOB_MAX_ATTEMPTS']:
+            return None
+        return 2 ** attempts
+
+    def enqueue(self, kind, **payload):
+        """Add a job to the current session; it becomes visible when the caller commits"""
+        job = Job(kind=kind, payload=payload)
+        db.session.add(job)
+        return job
+
+    def wake(self):
+        """Tell idle workers that new jobs were committed"""
+        self._wakeup.set()
+
+    def ensure_started(self):
+        if self._pid == os.getpid() or self.app.config['JOB_WORKERS'] <= 0:
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._threads = []
+            for i in range(self.app.config['JOB_WORKERS']):
+                thread = threading.Thread(target=self.work, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def work(self, stop_event=None):
+        """Run jobs until stop_event is set (forever if not given)"""
+        while stop_event is None or not stop_event.is_set():
+            job_id = None
+            with self.app.app_context():
+                try:
+                    job_id = self._claim_next()
+                    if job_id is not None:
+                        self._run(job_id)
+                except Exception:
+                    db.session.rollback()
+                    logger.error(f'Job worker error:\n{traceback.format_exc()}')
+                finally:
+                    db.session.remove()
+            if job_id is None:
+                self._wakeup.wait(self.app.config['JOB_POLL_INTERVAL'])
+                self._wakeup.clear()
+
+    def _claim_next(self):
+        """Atomically move the next due job to running and return its id"""
+        now = datetime.utcnow()
+        stale_before = now - timedelta(seconds=self.app.config['JOB_STALE_AFTER'])
+        candidates = db.session.query(Job.id, Job.kind, Job.status, Job.attempts).filter(
+            or_(
+                and_(Job.status == 'pending', Job.run_at <= now),
+                # Jobs left running by a worker that died mid-job
+                and_(Job.status == 'running', Job.started_at < stale_before)
+            )
+        ).order_by(Job.run_at).limit(5).all()
+
+        for job_id, kind, status, attempts in candidates:
+            if status == 'running' and self._handler(kind)[2](attempts) is None:
+                # Out of attempts: a job that keeps killing its worker mustn't run forever
+                self._fail_stale(job_id, attempts)
+                continue
+            # attempts changes on every claim, so it doubles as a compare-and-swap token
+            claimed = Job.query.filter_by(id=job_id, status=status, attempts=attempts).update({
+                Job.status: 'running',
+                Job.attempts: attempts + 1,
+                Job.started_at: now
+            }, synchronize_session=False)
+            db.session.commit()
+            if claimed:
+                return job_id
+        return None
+
+    def _fail_stale(self, job_id, attempts):
+        """Mark a stale running job that has no attempts left as failed"""
+        now = datetime.utcnow()
+        failed = Job.query.filter_by(id=job_id, status='running', attempts=attempts).update({
+            Job.status: 'failed',
+            Job.finished_at: now,
+            Job.last_error: 'Worker stopped while running the job'
+        }, synchronize_session=False)
+        db.session.commit()
+        if not failed:
+            return  # Another worker got to it first
+        job = db.session.get(Job, job_id)
+        self._record(failed=1)
+        on_failure = self._handler(job.kind)[1]
+        if on_failure is not None:
+            on_failure(**job.payload)
+            db.session.commit()
+        logger.warning(f'Job {job_id} ({job.kind}) failed: its worker stopped on the last attempt')
+
+    def _handler(self, kind):
+        """(handler, on_failure, backoff) for a job kind"""
+        return self.handlers.get(kind, (None, None, self._default_backoff))
+
+    def _run(self, job_id):
+        job = db.session.get(Job, job_id)
+        handler, on_failure, backoff = self._handler(job.kind)
+        try:
+            if handler is None:
+                raise LookupError(f'No handler registered for job kind {job.kind!r}')
+            handler(**job.payload)
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(Job, job_id)
+            job.last_error = f'{type(e).__name__}: {e}'
+            delay = backoff(job.attempts)
+            if delay is not None:
+                job.status = 'pending'
+                job.run_at = datetime.utcnow() + timedelta(seconds=delay)
+                self._record(retried=1)
+            else:
+                job.status = 'failed'
+                job.finished_at = datetime.utcnow()
+                self._record(failed=1)
+                if on_failure is not None:
+                    on_failure(**job.payload)
+            db.session.commit()
+            logger.warning(f'Job {job_id} ({job.kind}) attempt {job.attempts} failed: {e}')
+            return
+
+        job = db.session.get(Job, job_id)
+        job.status = 'done'
+        job.finished_at = datetime.utcnow()
+        job.last_error = None
+        db.session.commit()
+        self._record(completed=1, latency=(job.finished_at - job.created_at).total_seconds())
+
+    def retry_failed(self, kind=None, ids=()):
+        """Queue failed jobs to run again with a fresh attempt budget.
+
+        The payload is kept as it was, so a job that carries an idempotency
+        key sends the same key again. Returns how many jobs were queued.
+        """
+        query = Job.query.filter(Job.status == 'failed')
+        if kind:
+            query = query.filter(Job.kind == kind)
+        if ids:
+            query = query.filter(Job.id.in_(ids))
+        count = query.update({
+            Job.status: 'pending',
+            Job.attempts: 0,
+            Job.run_at: datetime.utcnow(),
+            Job.started_at: None,
+            Job.finished_at: None
+        }, synchronize_session=False)
+        db.session.commit()
+        self.wake()
+        return count
+
+    def _record(self, completed=0, failed=0, retried=0, latency=0.0):
+        with self._stats_lock:
+            self.completed += completed
+            self.failed += failed
+            self.retried += retried
+            self.total_latency += latency
+
+    def stats(self):
+        """Queue depth and failures from the database plus this process's counters"""
+        counts = dict(db.session.query(Job.status, db.func.count(Job.id)).group_by(Job.status).all())
+        recent = db.session.query(Job.created_at, Job.finished_at).filter(
+            Job.status == 'done'
+        ).order_by(Job.finished_at.desc()).limit(100).all()
+        latencies = [(finished - created).total_seconds() for created, finished in recent]
+        with self._stats_lock:
+            process = {
+                'completed': self.completed,
+                'failed': self.failed,
+                'retried': self.retried,
+                'avg_latency_seconds': round(self.total_latency / self.completed, 3) if self.completed else None,
+                'workers': sum(thread.is_alive() for thread in self._threads)
+            }
+        return {
+            'depth': counts.get('pending', 0),
+            'running': counts.get('running', 0),
+            'failed': counts.get('failed', 0),
+            'done': counts.get('done', 0),
+            'recent_avg_latency_seconds': round(sum(latencies) / len(latencies), 3) if latencies else None,
+            'process': process
+        }
+
+job_queue = JobQueue()
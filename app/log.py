@@ -0,0 +1,236 @@
+"""Structured logging for the app, its jobs and its CLI commands.
+
+Every record becomes one JSON object per line:
+
+    {"ts": "2024-05-01T12:00:00.123Z", "level": "INFO", "logger": "app.billing",
+     "msg": "...", "request_id": "5f0c...", "pid": 12, ...extra fields}
+
+Callers only queue records: a QueueHandler on the root logger hands them to a
+QueueListener thread that does the formatting and the write, so a slow stdout
+pipe under gunicorn doesn't hold up a request. When the queue is full the
+record is dropped rather than blocking; once there is room again a warning
+says how many were lost (at most once a minute), and listeners added with
+on_dropped() hear about every drop (app/metrics.py counts them).
+
+Levels are set per logger from LOG_LEVELS ("app.email=DEBUG,sqlalchemy=WARNING").
+DEBUG records pass with probability LOG_DEBUG_SAMPLE_RATE; a call can
+override that with extra={'sample_rate': ...}. Records logged during a
+request carry its X-Request-ID (taken from the request or generated), which
+is also sent back in the response.
+"""
+from flask import g, has_request_context, request
+from flask.logging import default_handler
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import sys
+import time
+import traceback
+import uuid
+
+# Attributes every LogRecord has; anything else was passed in extra=
+RESERVED_ATTRS = frozenset(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'request_id', 'sample_rate'}
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._:-]{1,64}$')
+# Seconds between warnings about dropped records
+DROP_WARNING_INTERVAL = 60
+
+_drop_listeners = []
+
+def on_dropped(listener):
+    """Call listener() whenever a record is dropped, e.g. to export metrics"""
+    if listener not in _drop_listeners:
+        _drop_listeners.append(listener)
+    return listener
+
+def parse_levels(value):
+    """{'logger.name': level} from "name=LEVEL,name=LEVEL" """
+    levels = {}
+    for item in (value or '').split(','):
+        name, _, level = item.strip().partition('=')
+        if name and level:
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+def current_request_id():
+    return getattr(g, 'request_id', None) if has_request_context() else None
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        entry['pid'] = record.process
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+    def formatTime(self, record, datefmt=None):
+        return super().formatTime(record, '%Y-%m-%dT%H:%M:%S') + f'.{int(record.msecs):03d}Z'
+
+    converter = time.gmtime
+
+class TextFormatter(logging.Formatter):
+    """Plain lines for a terminal (LOG_FORMAT=text)"""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s')
+
+    def format(self, record):
+        if not getattr(record, 'request_id', None):
+            record.request_id = '-'
+        return super().format(record)
+
+class ContextFilter(logging.Filter):
+    """Stamps the request id and drops unsampled DEBUG records.
+
+    Runs in the thread that logged, before the record is queued, so it sees
+    that thread's request context.
+    """
+
+    def __init__(self, debug_sample_rate=1.0):
+        super().__init__()
+        self.debug_sample_rate = debug_sample_rate
+
+    def filter(self, record):
+        rate = getattr(record, 'sample_rate', None)
+        if rate is None and record.levelno <= logging.DEBUG:
+            rate = self.debug_sample_rate
+        if rate is not None and rate < 1 and random.random() >= rate:
+            return False
+        record.request_id = current_request_id()
+        return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._reported = 0
+        self._reported_at = None
+
+    def prepare(self, record):
+        # Keep the traceback separate from the message, for the JSON "exc" field
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = ''.join(traceback.format_exception(*record.exc_info)).rstrip()
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        # Called with the handler's lock held, so the counters need no lock of their own
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            for listener in _drop_listeners:
+                listener()
+            return
+        if self.dropped > self._reported and (
+                self._reported_at is None or time.monotonic() - self._reported_at >= DROP_WARNING_INTERVAL):
+            self._warn_dropped()
+
+    def _warn_dropped(self):
+        count = self.dropped - self._reported
+        warning = logging.makeLogRecord({
+            'name': __name__, 'levelno': logging.WARNING, 'levelname': 'WARNING',
+            'msg': f'Dropped {count} log records because the log queue was full', 'dropped': count,
+        })
+        try:
+            self.queue.put_nowait(warning)
+        except queue.Full:
+            return
+        self._reported = self.dropped
+        self._reported_at = time.monotonic()
+
+class StructuredLogging:
+    """Configures the root logger once per process; see the module docstring"""
+
+    def __init__(self, app=None):
+        self.handler = None
+        self.listener = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LOG_LEVEL', 'INFO')
+        app.config.setdefault('LOG_LEVELS', {})
+        app.config.setdefault('LOG_FORMAT', 'json')
+        app.config.setdefault('LOG_DEBUG_SAMPLE_RATE', 1.0)
+        app.config.setdefault('LOG_QUEUE_SIZE', 10000)
+        app.extensions['structured_logging'] = self
+
+        self.configure(app.config)
+        # Flask's own stderr handler would write every app.logger record twice
+        app.logger.removeHandler(default_handler)
+        app.before_request(self._assign_request_id)
+        app.after_request(self._send_request_id)
+
+    def configure(self, config):
+        self.stop()
+        root = logging.getLogger()
+        if self.handler is not None:
+            root.removeHandler(self.handler)
+
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(TextFormatter() if config['LOG_FORMAT'] == 'text' else JsonFormatter())
+        self.handler = DroppingQueueHandler(queue.Queue(config['LOG_QUEUE_SIZE']))
+        self.handler.addFilter(ContextFilter(config['LOG_DEBUG_SAMPLE_RATE']))
+        self.listener = logging.handlers.QueueListener(self.handler.queue, output)
+
+        root.addHandler(self.handler)
+        root.setLevel(config['LOG_LEVEL'])
+        levels = config['LOG_LEVELS']
+        for name, level in (parse_levels(levels) if isinstance(levels, str) else levels).items():
+            logging.getLogger(name).setLevel(level)
+        self.start()
+
+    def start(self):
+        self.listener.start()
+
+    def stop(self):
+        """Flush queued records and stop the listener thread"""
+        if self.listener is not None and self.listener._thread is not None:
+            self.listener.stop()
+
+    def _restart_after_fork(self):
+        # The listener thread doesn't survive fork (gunicorn --preload); the
+        # child gets a fresh queue and thread of its own
+        if self.listener is not None:
+            self.listener._thread = None
+            self.handler.queue = self.listener.queue = queue.Queue(self.handler.queue.maxsize)
+            self.handler.dropped = self.handler._reported = 0
+            self.start()
+
+    @staticmethod
+    def _assign_request_id():
+        incoming = request.headers.get('X-Request-ID', '')
+        g.request_id = incoming if REQUEST_ID_PATTERN.match(incoming) else uuid.uuid4().hex
+
+    @staticmethod
+    def _send_request_id(response):
+        request_id = current_request_id()
+        if request_id:
+            response.headers['X-Request-ID'] = request_id
+        return response
+
+structured_logging = StructuredLogging()
+atexit.register(structured_logging.stop)
+os.register_at_fork(after_in_child=structured_logging._restart_after_fork)
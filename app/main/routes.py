@@ -2,12 +2,24 @@ from flask import render_template, flash, redirect, url_for, request, jsonify
 from flask_login import current_user, login_required
 from app.main import bp
 from app import db
+from sqlalchemy.orm import joinedload
 from openai import OpenAI
 import os
 from datetime import datetime
 from app.models import User, Invitation, Organization, Ticket
+from app.stats import organization_ticket_stats, user_ticket_stats
+from app.completions import completion_cache
+from app.database import replica_reads
+from app.streaming import wants_stream, stream_completion, log_timing
+import logging
+import time
 
-client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
+logger = logging.getLogger(__name__)
+
+# Same bounds as the tickets client: a slow completion must not hold a worker thread indefinitely
+client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'),
+                timeout=float(os.environ.get('OPENAI_TIMEOUT', '20')),
+                max_retries=int(os.environ.get('OPENAI_MAX_RETRIES', '1')))
 
 @bp.route('/')
 def index():
@@ -26,7 +38,7 @@ def index():
                 Invitation.expires_at > datetime.utcnow()
             ).all()
         except Exception as e:
-            print(f"Error fetching invitations: {str(e)}")
+            logger.warning(f'Error fetching invitations: {e}')
             pending_invites = []
         
         # If user has no organization, show landing page with options
@@ -36,55 +48,19 @@ def index():
                              message="You are not currently a member of any organization. Please join one or create your own.")
     
     # Prepare stats based on user role
-    if current_user.is_admin or current_user.role == 'staff':
-        # Admin/Staff stats - they can see all tickets
-        org_tickets = Ticket.query.filter_by(organization_id=org.id)
-        stats = {
-            'total_tickets': org_tickets.count(),
-            'open_tickets': org_tickets.filter_by(status='open').count(),
-            'high_priority': org_tickets.filter_by(priority='high').count(),
-            'team_members': User.query.filter_by(organization_id=org.id).count()
-        }
-        
-        # Calculate support overview stats
-        total_closed = org_tickets.filter_by(status='closed').count()
-        total_tickets = org_tickets.count()
-        resolution_rate = (total_closed / total_tickets * 100) if total_tickets > 0 else 0
-        
-        resolved_today = org_tickets.filter(
-            Ticket.status == 'closed',
-            Ticket.updated_at >= datetime.utcnow().date()
-        ).count()
-        
-        # Calculate average response time for tickets with first response
-        tickets_with_response = org_tickets.filter(Ticket.first_response_time.isnot(None)).all()
-        if tickets_with_response:
-            total_response_time = sum(
-                (ticket.first_response_time - ticket.created_at).total_seconds() 
-                for ticket in tickets_with_response
-            )
-            avg_response_time = total_response_time / len(tickets_with_response)
-            avg_response_hours = round(avg_response_time / 3600, 1)  # Convert to hours
+    with replica_reads():
+        if current_user.is_admin or current_user.role == 'staff':
+            # Admin/Staff stats - they can see all tickets
+            stats, support_stats = organization_ticket_stats(org.id)
+            # The staff dashboard lists tickets through tickets.filter_tickets
+            return render_template('main/dashboard.html', stats=stats, support_stats=support_stats)
         else:
-            avg_response_hours = 0
-        
-        support_stats = {
-            'avg_response_time': f"{avg_response_hours}h",
-            'resolved_today': resolved_today,
-            'resolution_rate': f"{round(resolution_rate, 1)}%"
-        }
-        
-        recent_tickets = org_tickets.order_by(Ticket.created_at.desc()).limit(5).all()
-        return render_template('main/dashboard.html', stats=stats, support_stats=support_stats, recent_tickets=recent_tickets)
-    else:
-        # Regular user stats - using submitter_id instead of user_id
-        stats = {
-            'open_tickets': Ticket.query.filter_by(submitter_id=current_user.id, status='open').count(),
-            'in_progress_tickets': Ticket.query.filter_by(submitter_id=current_user.id, status='in_progress').count(),
-            'closed_tickets': Ticket.query.filter_by(submitter_id=current_user.id, status='closed').count()
-        }
-        recent_tickets = Ticket.query.filter_by(submitter_id=current_user.id).order_by(Ticket.created_at.desc()).limit(5).all()
-        return render_template('main/user_dashboard.html', stats=stats, recent_tickets=recent_tickets)
+            # Regular user stats - using submitter_id instead of user_id
+            stats = user_ticket_stats(current_user.id)
+            recent_tickets = Ticket.query.options(
+                joinedload(Ticket.assignee), joinedload(Ticket.submitter)
+            ).filter_by(submitter_id=current_user.id).order_by(Ticket.created_at.desc()).limit(5).all()
+            return render_template('main/user_dashboard.html', stats=stats, recent_tickets=recent_tickets)
 
 @bp.route('/landing')
 @login_required
@@ -98,7 +74,7 @@ def landing():
             Invitation.expires_at > datetime.utcnow()
         ).all()
     except Exception as e:
-        print(f"Error fetching invitations: {str(e)}")
+        logger.warning(f'Error fetching invitations: {e}')
         pending_invites = []
     
     # Always show organization options if user has no organization
@@ -118,54 +94,15 @@ def dashboard():
         return redirect(url_for('main.landing'))
     
     # Get organization stats based on user role
-    if current_user.is_admin or current_user.role == 'staff':
-        # Admin/Staff stats - they can see all tickets
-        org_tickets = Ticket.query.filter_by(organization_id=current_user.organization_id)
-        stats = {
-            'total_tickets': org_tickets.count(),
-            'open_tickets': org_tickets.filter_by(status='open').count(),
-            'high_priority': org_tickets.filter_by(priority='high').count(),
-            'team_members': User.query.filter_by(organization_id=current_user.organization_id).count()
-        }
-        
-        # Calculate support overview stats
-        total_closed = org_tickets.filter_by(status='closed').count()
-        total_tickets = org_tickets.count()
-        resolution_rate = (total_closed / total_tickets * 100) if total_tickets > 0 else 0
-        
-        resolved_today = org_tickets.filter(
-            Ticket.status == 'closed',
-            Ticket.updated_at >= datetime.utcnow().date()
-        ).count()
-        
-        # Calculate average response time for tickets with first response
-        tickets_with_response = org_tickets.filter(Ticket.first_response_time.isnot(None)).all()
-        if tickets_with_response:
-            total_response_time = sum(
-                (ticket.first_response_time - ticket.created_at).total_seconds() 
-                for ticket in tickets_with_response
-            )
-            avg_response_time = total_response_time / len(tickets_with_response)
-            avg_response_hours = round(avg_response_time / 3600, 1)  # Convert to hours
+    with replica_reads():
+        if current_user.is_admin or current_user.role == 'staff':
+            # Admin/Staff stats - they can see all tickets
+            stats, support_stats = organization_ticket_stats(current_user.organization_id)
+            return render_template('main/dashboard.html', stats=stats, support_stats=support_stats)
         else:
-            avg_response_hours = 0
-        
-        support_stats = {
-            'avg_response_time': f"{avg_response_hours}h",
-            'resolved_today': resolved_today,
-            'resolution_rate': f"{round(resolution_rate, 1)}%"
-        }
-        
-        return render_template('main/dashboard.html', stats=stats, support_stats=support_stats)
-    else:
-        # Regular user stats
-        user_tickets = Ticket.query.filter_by(submitter_id=current_user.id)
-        stats = {
-            'total_tickets': user_tickets.count(),
-            'open_tickets': user_tickets.filter_by(status='open').count(),
-            'in_progress_tickets': user_tickets.filter_by(status='in_progress').count()
-        }
-        return render_template('main/user_dashboard.html', stats=stats)
+            # Regular user stats
+            stats = user_ticket_stats(current_user.id)
+            return render_template('main/user_dashboard.html', stats=stats)
 
 @bp.route('/accept_invite/<token>', methods=['POST'])
 @login_required
@@ -252,53 +189,50 @@ def ai_chat():
 @bp.route('/ai_chat/message', methods=['POST'])
 @login_required
 def ai_chat_message():
+    started = time.perf_counter()
     try:
         # Verify request is AJAX
         if not request.headers.get('X-Requested-With') == 'XMLHttpRequest':
             return jsonify({"response": "Invalid request method"}), 400
 
-        # Debug print the raw request data
-        print("Request data:", request.data)
-        print("Request content type:", request.content_type)
-        
         # Get and validate the JSON data
         if not request.is_json:
-            print("Error: Request is not JSON")
             return jsonify({"response": "Invalid content type. Please send JSON data."}), 400
             
         data = request.get_json()
-        print("Parsed JSON data:", data)  # Debug print
         
         if not data:
-            print("Error: No JSON data in request")
             return jsonify({"response": "No data provided"}), 400
             
         user_message = data.get('message')
         if not user_message:
-            print("Error: No message in JSON data")
             return jsonify({"response": "No message provided"}), 400
-            
-        print(f"Processing message: {user_message}")  # Debug print
-        print(f"Using OpenAI API Key: {os.environ.get('OPENAI_API_KEY')[:5]}...")  # Debug print (first 5 chars only)
         
-        # Make the API call
-        response = client.chat.completions.create(
+        completion_args = dict(
             model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a helpful IT support assistant. Provide specific and practical solutions for technical issues."},
-                {"role": "user", "content": user_message}
-            ],
+            system_prompt="You are a helpful IT support assistant. Provide specific and practical solutions for technical issues.",
+            user_content=user_message,
             max_tokens=150,
             temperature=0.7
         )
         
+        # Relay tokens as they are generated if the client asked for a stream
+        if wants_stream():
+            return stream_completion(
+                completion_cache.stream(client, **completion_args),
+                'main.ai_chat_message',
+                started,
+                "I apologize, but I encountered an error. Please try again later."
+            )
+        
+        # Make the API call (or reuse a cached answer to the same question)
+        ai_response = completion_cache.complete(client, **completion_args)
+        log_timing('main.ai_chat_message', started, time.perf_counter(), 1, 'completed')
+        
         # Validate the API response
-        if not response.choices:
-            print("Error: No choices in OpenAI response")
+        if not ai_response:
+            logger.warning('No choices in OpenAI response for main.ai_chat_message')
             return jsonify({"response": "I apologize, but I couldn't generate a response. Please try again."}), 500
-            
-        ai_response = response.choices[0].message.content
-        print(f"Success! AI Response: {ai_response}")  # Debug print
         
         # Return response with proper headers
         return jsonify({
@@ -309,11 +243,11 @@ def ai_chat_message():
         }
         
     except ValueError as e:
-        print(f"JSON parsing error: {str(e)}")
+        logger.info(f'Invalid JSON in main.ai_chat_message: {e}')
         return jsonify({"response": "Invalid JSON format"}), 400
     except Exception as e:
         error_msg = str(e)
-        print(f"Error details: {error_msg}")  # Debug print
+        logger.warning(f'OpenAI error in main.ai_chat_message: {error_msg}')
         
         if "api_key" in error_msg.lower():
             return jsonify({"response": "API key configuration error. Please contact support."}), 500
@@ -0,0 +1,106 @@
+"""Housekeeping for tables that otherwise only grow.
+
+Each task removes rows in batches of at most MAINTENANCE_BATCH_SIZE, one
+transaction per batch, so no single statement holds locks on a large range
+of a hot table. Run it from cron (or a scheduled Railway job):
+
+    flask maintenance run
+"""
+from flask import current_app
+from app import db
+from app.models import Invitation, Job, Subscription, ArchivedSubscription, Organization
+from datetime import datetime, timedelta
+from sqlalchemy import func, insert, literal, or_, select
+import time
+
+# Subscriptions in these states are over and only kept for history
+CLOSED_SUBSCRIPTION_STATUSES = ('cancelled', 'expired')
+# Jobs in these states will not run again unless retried by hand
+FINISHED_JOB_STATUSES = ('done', 'failed')
+
+def _expired_invitations(limit):
+    """Invitations past their retention window, oldest first"""
+    cutoff = datetime.utcnow() - timedelta(days=current_app.config['MAINTENANCE_INVITATION_RETENTION_DAYS'])
+    return [row.id for row in db.session.query(Invitation.id).filter(
+        or_(
+            Invitation.expires_at < cutoff,
+            # Accepted invitations are normally deleted on accept; these are leftovers
+            (Invitation.accepted == True) & (func.coalesce(Invitation.accepted_at, Invitation.created_at) < cutoff)
+        )
+    ).order_by(Invitation.id).limit(limit)]
+
+def _purge_invitations(ids):
+    return Invitation.query.filter(Invitation.id.in_(ids)).delete(synchronize_session=False)
+
+def _closed_subscriptions(limit):
+    """Closed subscriptions past their retention window that no organization points at"""
+    cutoff = datetime.utcnow() - timedelta(days=current_app.config['MAINTENANCE_SUBSCRIPTION_RETENTION_DAYS'])
+    in_use = select(Organization.current_subscription_id).where(
+        Organization.current_subscription_id.is_not(None)
+    )
+    return [row.id for row in db.session.query(Subscription.id).filter(
+        Subscription.status.in_(CLOSED_SUBSCRIPTION_STATUSES),
+        func.coalesce(Subscription.end_date, Subscription.updated_at) < cutoff,
+        Subscription.id.not_in(in_use)
+    ).order_by(Subscription.id).limit(limit)]
+
+def _finished_jobs(limit):
+    """Done and failed jobs that finished before the retention window"""
+    cutoff = datetime.utcnow() - timedelta(days=current_app.config['MAINTENANCE_JOB_RETENTION_DAYS'])
+    return [row.id for row in db.session.query(Job.id).filter(
+        Job.status.in_(FINISHED_JOB_STATUSES),
+        Job.finished_at < cutoff
+    ).order_by(Job.id).limit(limit)]
+
+def _purge_jobs(ids):
+    return Job.query.filter(Job.id.in_(ids)).delete(synchronize_session=False)
+
+COPIED_COLUMNS = ('id', 'organization_id', 'plan_id', 'status', 'start_date', 'end_date',
+                  'last_billing_date', 'next_billing_date', 'created_at', 'updated_at')
+
+def _archive_subscriptions(ids):
+    """Copy the rows to archived_subscriptions, then delete them"""
+    columns = [getattr(Subscription, name) for name in COPIED_COLUMNS]
+    db.session.execute(insert(ArchivedSubscription).from_select(
+        [*COPIED_COLUMNS, 'archived_at'],
+        select(*columns, literal(datetime.utcnow())).where(Subscription.id.in_(ids))
+    ))
+    return Subscription.query.filter(Subscription.id.in_(ids)).delete(synchronize_session=False)
+
+# name: (find up to n row ids, process those ids and return the row count)
+TASKS = {
+    'expired_invitations': (_expired_invitations, _purge_invitations),
+    'closed_subscriptions': (_closed_subscriptions, _archive_subscriptions),
+    'finished_jobs': (_finished_jobs, _purge_jobs),
+}
+
+def run_task(name, batch_size=None, max_batches=None):
+    """Run one task batch by batch, yielding {'task', 'batch', 'rows', 'ms'} per batch"""
+    find, process = TASKS[name]
+    batch_size = batch_size or current_app.config['MAINTENANCE_BATCH_SIZE']
+    pause = current_app.config['MAINTENANCE_BATCH_PAUSE']
+    batch = 0
+    while max_batches is None or batch < max_batches:
+        started = time.perf_counter()
+        try:
+            ids = find(batch_size)
+            rows = process(ids) if ids else 0
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        if not ids:
+            return
+        batch += 1
+        yield {'task': name, 'batch': batch, 'rows': rows,
+               'ms': round((time.perf_counter() - started) * 1000, 1)}
+        if len(ids) < batch_size:
+            return
+        # Give other writers a turn between batches
+        if pause:
+            time.sleep(pause)
+
+def run_maintenance(tasks=None, batch_size=None, max_batches=None):
+    """Run the given tasks (all by default) in order, yielding every batch"""
+    for name in tasks or TASKS:
+        yield from run_task(name, batch_size, max_batches)
@@ -0,0 +1,180 @@
+"""Prometheus metrics at /metrics, served only when METRICS_TOKEN is set and
+to scrapers that send "Authorization: Bearer <token>".
+
+Under gunicorn every worker keeps its own counters, so the metrics use
+prometheus_client's multiprocess mode: with PROMETHEUS_MULTIPROC_DIR set
+(gunicorn.conf.py sets and empties it when the master starts) each process
+writes its values to mmap-backed files in that directory, and /metrics adds
+them up across workers. Without it, as under `flask run`, the values live in
+this process only.
+
+Exported:
+
+    http_request_duration_seconds{endpoint, method, status}
+    db_pool_checkout_wait_seconds, db_pool_checked_out, db_pool_overflow,
+    db_pool_timeouts_total
+    external_call_duration_seconds{service, endpoint}, external_call_errors_total{service, endpoint}
+        (OpenAI, Stripe and SMTP; endpoint is "background" for jobs and workers)
+    emails_total{outcome}
+    tickets_created_total{organization_id}
+    log_records_dropped_total  (records lost because the log queue was full)
+    job_queue_jobs{status}, mail_queue_emails{status}  (read from the database at scrape time)
+"""
+from flask import Response, abort, current_app, has_request_context, request
+from app.instrumentation import current_timing, on_external_call
+from app.log import on_dropped
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge,
+                               Histogram, generate_latest, multiprocess)
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+import hmac
+import os
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by endpoint',
+    ['endpoint', 'method', 'status'], buckets=LATENCY_BUCKETS
+)
+POOL_WAIT = Histogram(
+    'db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled database connection',
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30)
+)
+POOL_CHECKED_OUT = Gauge('db_pool_checked_out', 'Database connections in use',
+                         multiprocess_mode='livesum')
+POOL_OVERFLOW = Gauge('db_pool_overflow', 'Connections open beyond the pool size',
+                      multiprocess_mode='livesum')
+POOL_TIMEOUTS = Counter('db_pool_timeouts_total', 'Checkouts that gave up waiting for a connection')
+EXTERNAL_LATENCY = Histogram(
+    'external_call_duration_seconds', 'Latency of calls to OpenAI, Stripe and SMTP',
+    ['service', 'endpoint'], buckets=LATENCY_BUCKETS
+)
+EXTERNAL_ERRORS = Counter('external_call_errors_total', 'Failed calls to OpenAI, Stripe and SMTP',
+                          ['service', 'endpoint'])
+EMAILS = Counter('emails_total', 'Outbound email delivery attempts by outcome', ['outcome'])
+TICKETS_CREATED = Counter('tickets_created_total', 'Tickets created', ['organization_id'])
+LOG_RECORDS_DROPPED = Counter('log_records_dropped_total', 'Log records dropped because the log queue was full')
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that reports checkout waits, connections in use and overflow"""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            POOL_TIMEOUTS.inc()
+            raise
+        finally:
+            POOL_WAIT.observe(time.perf_counter() - started)
+            self._report()
+
+    def _do_return_conn(self, record):
+        super()._do_return_conn(record)
+        self._report()
+
+    def _report(self):
+        POOL_CHECKED_OUT.set(self.checkedout())
+        POOL_OVERFLOW.set(max(0, self.overflow()))
+
+@on_external_call
+def _observe_external_call(call):
+    endpoint = (request.endpoint or '<unmatched>') if has_request_context() else 'background'
+    EXTERNAL_LATENCY.labels(call.service, endpoint).observe(call.seconds)
+    if call.error:
+        EXTERNAL_ERRORS.labels(call.service, endpoint).inc()
+
+@on_dropped
+def _count_dropped_log_record():
+    LOG_RECORDS_DROPPED.inc()
+
+def count_emails(sent=0, retried=0, failed=0):
+    for outcome, count in (('sent', sent), ('retried', retried), ('failed', failed)):
+        if count:
+            EMAILS.labels(outcome).inc(count)
+
+def count_ticket_created(organization_id):
+    TICKETS_CREATED.labels(str(organization_id)).inc()
+
+class QueueCollector:
+    """Job and mail queue depth by status, counted when /metrics is scraped"""
+
+    def collect(self):
+        from app import db
+        from app.models import Job, OutboundEmail
+
+        for name, model, description in (
+            ('job_queue_jobs', Job, 'Background jobs by status'),
+            ('mail_queue_emails', OutboundEmail, 'Queued emails by status'),
+        ):
+            family = GaugeMetricFamily(name, description, labels=['status'])
+            for status, count in db.session.query(model.status, db.func.count(model.id)).group_by(model.status):
+                family.add_metric([status], count)
+            yield family
+
+class Metrics:
+    """Serves /metrics and times every request; see the module docstring.
+
+    Call init_app() before db.init_app(): it puts TimedQueuePool into
+    SQLALCHEMY_ENGINE_OPTIONS for databases that use a QueuePool.
+    """
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.config.setdefault('METRICS_TOKEN', None)
+        app.extensions['metrics'] = self
+        if not app.config['METRICS_ENABLED']:
+            return
+
+        uri = app.config.get('SQLALCHEMY_DATABASE_URI') or ''
+        options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}
+        # SQLite uses its own pool classes
+        if not uri.startswith('sqlite') and 'poolclass' not in options:
+            app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {**options, 'poolclass': TimedQueuePool}
+
+        app.after_request(self._observe_request)
+        # Metrics are still collected without a token, but nothing serves them
+        if app.config['METRICS_TOKEN']:
+            app.add_url_rule('/metrics', 'metrics', self._metrics_view)
+
+    @staticmethod
+    def _observe_request(response):
+        timing = current_timing()
+        if timing is not None:
+            REQUEST_LATENCY.labels(
+                request.endpoint or '<unmatched>', request.method, str(response.status_code)
+            ).observe(time.perf_counter() - timing.started)
+        return response
+
+    @staticmethod
+    def registry():
+        registry = CollectorRegistry()
+        if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+            multiprocess.MultiProcessCollector(registry)
+        else:
+            registry.register(_Delegate(REGISTRY))
+        registry.register(QueueCollector())
+        return registry
+
+    def _metrics_view(self):
+        expected = f"Bearer {current_app.config['METRICS_TOKEN']}"
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), expected):
+            abort(404)
+        return Response(generate_latest(self.registry()), mimetype=CONTENT_TYPE_LATEST)
+
+class _Delegate:
+    """Exposes the default registry's metrics through another registry"""
+
+    def __init__(self, registry):
+        self._registry = registry
+
+    def collect(self):
+        return self._registry.collect()
+
+metrics = Metrics()
@@ -1,11 +1,12 @@
-from app import db, login
+from app import db
+from app.database import upsert
 from datetime import datetime, timedelta
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 import uuid
 import re
-from sqlalchemy.orm import relationship
-from sqlalchemy import event
+from sqlalchemy.orm import relationship, column_property
+from sqlalchemy import event, inspect
 
 class Organization(db.Model):
     __tablename__ = 'organizations'
@@ -16,6 +17,13 @@ class Organization(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     subscription_plan_id = db.Column(db.Integer, db.ForeignKey('subscription_plans.id', name='fk_org_subscription_plan'))
     current_subscription_id = db.Column(db.Integer, db.ForeignKey('subscriptions.id', name='fk_org_current_subscription'))
+    active_user_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')  # Maintained by User events
+    # Maintained by Ticket events: total and number of first-response times, for the average
+    response_seconds_sum = db.Column(db.BigInteger, default=0, nullable=False, server_default='0')
+    responded_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')
+    assignment_cursor = db.Column(db.Integer)  # Last user picked by round-robin ticket assignment
+    stripe_customer_id = db.Column(db.String(100))
+    stripe_subscription_id = db.Column(db.String(100))
     
     # Relationships
     users = db.relationship('User', backref='organization', lazy='dynamic')
@@ -40,10 +48,7 @@ class Organization(db.Model):
     @property
     def active_users_count(self):
         """Count of active users in the organization"""
-        return User.query.filter_by(
-            organization_id=self.id,
-            is_active=True
-        ).count()
+        return self.active_user_count or 0
 
     @property
     def can_add_user(self):
@@ -59,6 +64,10 @@ class Organization(db.Model):
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('ix_users_org_role', 'organization_id', 'role'),
+        db.Index('ix_users_org_created', 'organization_id', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(64), index=True, unique=True)
@@ -67,20 +76,22 @@ class User(UserMixin, db.Model):
     created_at = db.Column(db.DateTime(timezone=True), default=datetime.utcnow, nullable=False)
     last_sign_in_at = db.Column(db.DateTime(timezone=True))
     role = db.Column(db.String(20), default='user', nullable=False)
-    is_active = db.Column(db.Boolean, default=True, nullable=False)
+    # active_history keeps the old values around for the counter events below
+    is_active = column_property(db.Column(db.Boolean, default=True, nullable=False), active_history=True)
+    open_ticket_count = db.Column(db.Integer, default=0, nullable=False, server_default='0')  # Maintained by Ticket events
     
     # Organization relationship
-    organization_id = db.Column(db.Integer, db.ForeignKey('organizations.id'))
+    organization_id = column_property(db.Column(db.Integer, db.ForeignKey('organizations.id')), active_history=True)
     
-    # Relationships
+    # Relationships - loaded lazily by default; routes pick a loader strategy
+    # (joinedload/selectinload) for what their templates actually touch
     tickets = db.relationship('Ticket', 
                             foreign_keys='Ticket.submitter_id',
-                            backref=db.backref('submitter', lazy='joined'),
-                            lazy='dynamic',
+                            backref='submitter',
                             overlaps="submitted_tickets,author")
     assigned_tickets = db.relationship('Ticket',
                                      foreign_keys='Ticket.assignee_id',
-                                     backref=db.backref('assignee', lazy='joined'),
+                                     backref='assignee',
                                      lazy='dynamic')
     comments = db.relationship('TicketComment', backref='user', lazy='dynamic')
     responses = db.relationship('TicketResponse', back_populates='user')
@@ -109,32 +120,49 @@ class User(UserMixin, db.Model):
 
 class Ticket(db.Model):
     __tablename__ = 'tickets'
+    # Indexes match the query shapes in tickets/, main/ and app/stats.py
+    __table_args__ = (
+        db.Index('ix_tickets_org_created', 'organization_id', 'created_at', 'id'),
+        db.Index('ix_tickets_org_updated', 'organization_id', 'updated_at'),
+        db.Index('ix_tickets_org_status_priority', 'organization_id', 'status', 'priority'),
+        db.Index('ix_tickets_submitter_created', 'submitter_id', 'created_at'),
+        db.Index('ix_tickets_assignee_status', 'assignee_id', 'status'),
+        db.Index('ix_tickets_open_org_created', 'organization_id', 'created_at',
+                 postgresql_where=db.text("status = 'open'"),
+                 sqlite_where=db.text("status = 'open'")),
+        # needs_response filter: open tickets without a staff response yet
+        db.Index('ix_tickets_needs_response_org_created', 'organization_id', 'created_at', 'id',
+                 postgresql_where=db.text("status = 'open' AND last_response_by_staff IS NULL"),
+                 sqlite_where=db.text("status = 'open' AND last_response_by_staff IS NULL")),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text, nullable=False)
-    status = db.Column(db.String(20), default='open')  # open, in_progress, closed
-    priority = db.Column(db.String(20), default='medium')  # low, medium, high
+    # active_history keeps the old values around for the counter events below
+    status = column_property(db.Column(db.String(20), default='open'), active_history=True)  # open, in_progress, closed
+    priority = column_property(db.Column(db.String(20), default='medium'), active_history=True)  # low, medium, high
     category = db.Column(db.String(50), nullable=False, default='General')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     due_date = db.Column(db.DateTime(timezone=True))
     submitter_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    assignee_id = db.Column(db.Integer, db.ForeignKey('users.id'))
-    first_response_time = db.Column(db.DateTime)
+    assignee_id = column_property(db.Column(db.Integer, db.ForeignKey('users.id')), active_history=True)
+    first_response_time = column_property(db.Column(db.DateTime), active_history=True)
     last_response_by_staff = db.Column(db.DateTime)
     last_updated_by_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     ai_suggestion = db.Column(db.Text)
     
     # Organization relationship
-    organization_id = db.Column(db.Integer, db.ForeignKey('organizations.id'))
+    organization_id = column_property(db.Column(db.Integer, db.ForeignKey('organizations.id')), active_history=True)
     organization = relationship('Organization', back_populates='tickets')
 
     # Relationships
     comments = relationship('TicketComment', backref='ticket',
                              cascade='all, delete-orphan',
-                             lazy='dynamic')
-    responses = relationship('TicketResponse', backref='ticket', lazy='dynamic')
+                             order_by='TicketComment.created_at')
+    responses = relationship('TicketResponse', backref='ticket',
+                             order_by='TicketResponse.created_at')
     last_updated_by = relationship('User', foreign_keys=[last_updated_by_id])
 
     @property
@@ -200,6 +228,10 @@ class TicketComment(db.Model):
 
 class TicketResponse(db.Model):
     __tablename__ = 'ticket_responses'
+    __table_args__ = (
+        db.Index('ix_ticket_responses_ticket_created', 'ticket_id', 'created_at'),
+        db.Index('ix_ticket_responses_user_id', 'user_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text)
@@ -212,6 +244,11 @@ class TicketResponse(db.Model):
         return f'<TicketResponse {self.id}>'
 
 class Invitation(db.Model):
+    __table_args__ = (
+        db.Index('ix_invitation_email_org', 'email', 'organization_id'),
+        db.Index('ix_invitation_org_expires', 'organization_id', 'expires_at'),
+        db.Index('ix_invitation_expires_at', 'expires_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     email = db.Column(db.String(120), nullable=False)
     organization_id = db.Column(db.Integer, db.ForeignKey('organizations.id'))
@@ -236,6 +273,7 @@ class SubscriptionPlan(db.Model):
     team_size_limit = db.Column(db.Integer, nullable=False)
     description = db.Column(db.String(256))
     features = db.Column(db.JSON)  # Store features as JSON array
+    stripe_price_id = db.Column(db.String(100))
     is_active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
@@ -246,6 +284,9 @@ class SubscriptionPlan(db.Model):
 
 class Subscription(db.Model):
     __tablename__ = 'subscriptions'
+    __table_args__ = (
+        db.Index('ix_subscriptions_org_status', 'organization_id', 'status'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     organization_id = db.Column(db.Integer, db.ForeignKey('organizations.id', name='fk_subscription_org'))
     plan_id = db.Column(db.Integer, db.ForeignKey('subscription_plans.id', name='fk_subscription_plan'))
@@ -265,6 +306,60 @@ class Subscription(db.Model):
         return (self.status == 'active' and 
                 (self.end_date is None or self.end_date > datetime.utcnow()))
 
+class ArchivedSubscription(db.Model):
+    """Closed subscription moved out of the subscriptions table by `flask maintenance run`"""
+    __tablename__ = 'archived_subscriptions'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # Same id it had in subscriptions
+    organization_id = db.Column(db.Integer, index=True)
+    plan_id = db.Column(db.Integer)
+    status = db.Column(db.String(20))
+    start_date = db.Column(db.DateTime)
+    end_date = db.Column(db.DateTime)
+    last_billing_date = db.Column(db.DateTime)
+    next_billing_date = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<ArchivedSubscription {self.id} {self.organization_id}:{self.plan_id}>'
+
+class StripeSubscriptionSnapshot(db.Model):
+    """Last known state of a Stripe subscription, refreshed by webhooks and billing sync"""
+    __tablename__ = 'stripe_subscription_snapshots'
+
+    stripe_subscription_id = db.Column(db.String(100), primary_key=True)
+    organization_id = db.Column(db.Integer, db.ForeignKey('organizations.id'), index=True)
+    status = db.Column(db.String(30))
+    cancel_at_period_end = db.Column(db.Boolean, nullable=False, default=False)
+    current_period_end = db.Column(db.DateTime)
+    price_id = db.Column(db.String(100))
+    source_updated_at = db.Column(db.DateTime, nullable=False)  # When Stripe reported this state
+    synced_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<StripeSubscriptionSnapshot {self.stripe_subscription_id} {self.status}>'
+
+class ProcessedWebhookEvent(db.Model):
+    """Stripe webhook event, stored on receipt and processed by a background job.
+
+    The Stripe event id is the primary key, so a redelivered event can't be
+    stored (or processed) twice.
+    """
+    __tablename__ = 'processed_webhook_events'
+
+    event_id = db.Column(db.String(100), primary_key=True)
+    type = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='received')  # received, processed, ignored, failed
+    last_error = db.Column(db.Text)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    processed_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<ProcessedWebhookEvent {self.event_id} {self.type} {self.status}>'
+
 class SubscriptionFeedback(db.Model):
     __tablename__ = 'subscription_feedbacks'
     
@@ -276,6 +371,211 @@ class SubscriptionFeedback(db.Model):
     
     organization = db.relationship('Organization', back_populates='subscription_feedbacks')
 
-@login.user_loader
-def load_user(id):
-    return User.query.get(int(id)) 
\ No newline at end of file
+class TicketStats(db.Model):
+    """Materialized ticket counts per organization, status and priority"""
+    __tablename__ = 'ticket_stats'
+    __table_args__ = (
+        db.UniqueConstraint('organization_id', 'status', 'priority', name='uq_ticket_stats_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    organization_id = db.Column(db.Integer, db.ForeignKey('organizations.id'), nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    priority = db.Column(db.String(20), nullable=False)
+    count = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f'<TicketStats {self.organization_id}:{self.status}:{self.priority}={self.count}>'
+
+class Job(db.Model):
+    """Background job persisted so it survives worker restarts"""
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
+
+class OutboundEmail(db.Model):
+    """Queued email, stored until an SMTP worker has delivered it"""
+    __tablename__ = 'outbound_emails'
+    __table_args__ = (
+        db.Index('ix_outbound_emails_status_run_at', 'status', 'run_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    subject = db.Column(db.String(255), nullable=False)
+    sender = db.Column(db.String(255))
+    recipients = db.Column(db.JSON, nullable=False)
+    text_body = db.Column(db.Text)
+    html_body = db.Column(db.Text)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    claim_token = db.Column(db.String(32))
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    started_at = db.Column(db.DateTime)
+    sent_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<OutboundEmail {self.id} {self.subject!r} {self.status}>'
+
+class CompletionCacheEntry(db.Model):
+    """Cached AI completion, keyed by a hash of the normalized request"""
+    __tablename__ = 'completion_cache'
+
+    key = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+def _previous_value(target, attr):
+    """Value an attribute had before the current flush"""
+    history = inspect(target).attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.added:
+        # With active_history the old value is always loaded, so a change
+        # without a deleted entry means the attribute used to be None
+        return None
+    return getattr(target, attr)
+
+def _adjust_ticket_stats(connection, organization_id, status, priority, delta):
+    """Increment or decrement a single TicketStats counter row"""
+    if organization_id is None or status is None or priority is None:
+        return
+    table = TicketStats.__table__
+    if delta > 0:
+        # One statement, so concurrent first tickets for a key can't both insert it
+        upsert(connection, table,
+               dict(organization_id=organization_id, status=status, priority=priority, count=delta),
+               keys=['organization_id', 'status', 'priority'], set_=dict(count=table.c.count + delta))
+        return
+    # A decrement always follows the increment that created the row
+    connection.execute(
+        table.update()
+        .where(table.c.organization_id == organization_id,
+               table.c.status == status,
+               table.c.priority == priority)
+        .values(count=table.c.count + delta)
+    )
+
+def _adjust_active_users(connection, organization_id, delta):
+    """Increment or decrement an organization's active user counter"""
+    if organization_id is None:
+        return
+    table = Organization.__table__
+    connection.execute(
+        table.update()
+        .where(table.c.id == organization_id)
+        .values(active_user_count=table.c.active_user_count + delta)
+    )
+
+def response_seconds(created_at, first_response_time):
+    """Whole seconds from creation to first response, or None before a response"""
+    if created_at is None or first_response_time is None:
+        return None
+    return int((first_response_time - created_at).total_seconds())
+
+def _adjust_response_times(connection, organization_id, seconds, delta):
+    """Add (delta=1) or remove (delta=-1) one ticket's first-response time"""
+    if organization_id is None or seconds is None:
+        return
+    table = Organization.__table__
+    connection.execute(
+        table.update()
+        .where(table.c.id == organization_id)
+        .values(response_seconds_sum=table.c.response_seconds_sum + seconds * delta,
+                responded_count=table.c.responded_count + delta)
+    )
+
+def _is_open(status):
+    """Whether a ticket in this status counts towards its assignee's workload"""
+    return status is not None and status != 'closed'
+
+def _adjust_open_tickets(connection, user_id, delta):
+    """Increment or decrement a user's open assigned ticket counter"""
+    if user_id is None:
+        return
+    table = User.__table__
+    connection.execute(
+        table.update()
+        .where(table.c.id == user_id)
+        .values(open_ticket_count=table.c.open_ticket_count + delta)
+    )
+
+@event.listens_for(Ticket, 'after_insert')
+def ticket_inserted(mapper, connection, target):
+    _adjust_ticket_stats(connection, target.organization_id, target.status, target.priority, 1)
+    if _is_open(target.status):
+        _adjust_open_tickets(connection, target.assignee_id, 1)
+    _adjust_response_times(connection, target.organization_id,
+                           response_seconds(target.created_at, target.first_response_time), 1)
+
+@event.listens_for(Ticket, 'after_update')
+def ticket_updated(mapper, connection, target):
+    old_key = tuple(_previous_value(target, attr) for attr in ('organization_id', 'status', 'priority'))
+    new_key = (target.organization_id, target.status, target.priority)
+    if old_key != new_key:
+        _adjust_ticket_stats(connection, *old_key, -1)
+        _adjust_ticket_stats(connection, *new_key, 1)
+
+    old_load = (_previous_value(target, 'assignee_id'), _is_open(old_key[1]))
+    new_load = (target.assignee_id, _is_open(target.status))
+    if old_load != new_load:
+        if old_load[1]:
+            _adjust_open_tickets(connection, old_load[0], -1)
+        if new_load[1]:
+            _adjust_open_tickets(connection, new_load[0], 1)
+
+    old_response = (old_key[0], response_seconds(target.created_at, _previous_value(target, 'first_response_time')))
+    new_response = (target.organization_id, response_seconds(target.created_at, target.first_response_time))
+    if old_response != new_response:
+        _adjust_response_times(connection, *old_response, -1)
+        _adjust_response_times(connection, *new_response, 1)
+
+@event.listens_for(Ticket, 'after_delete')
+def ticket_deleted(mapper, connection, target):
+    _adjust_ticket_stats(connection,
+                         _previous_value(target, 'organization_id'),
+                         _previous_value(target, 'status'),
+                         _previous_value(target, 'priority'),
+                         -1)
+    if _is_open(_previous_value(target, 'status')):
+        _adjust_open_tickets(connection, _previous_value(target, 'assignee_id'), -1)
+    _adjust_response_times(connection, _previous_value(target, 'organization_id'),
+                           response_seconds(target.created_at, _previous_value(target, 'first_response_time')), -1)
+
+@event.listens_for(User, 'after_insert')
+def user_inserted(mapper, connection, target):
+    if target.is_active:
+        _adjust_active_users(connection, target.organization_id, 1)
+
+@event.listens_for(User, 'after_update')
+def user_updated(mapper, connection, target):
+    old_org_id = _previous_value(target, 'organization_id')
+    old_active = _previous_value(target, 'is_active')
+    if (old_org_id, old_active) != (target.organization_id, target.is_active):
+        if old_active:
+            _adjust_active_users(connection, old_org_id, -1)
+        if target.is_active:
+            _adjust_active_users(connection, target.organization_id, 1)
+
+@event.listens_for(User, 'after_delete')
+def user_deleted(mapper, connection, target):
+    if _previous_value(target, 'is_active'):
+        _adjust_active_users(connection, _previous_value(target, 'organization_id'), -1)
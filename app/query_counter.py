@@ -0,0 +1,25 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+
+class QueryCounter:
+    """Collects every SQL statement sent to the database"""
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+@contextmanager
+def count_queries(engine):
+    """Count the SQL statements an engine executes inside the block"""
+    counter = QueryCounter()
+    event.listen(engine, 'before_cursor_execute', counter)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', counter)
@@ -0,0 +1,54 @@
+from app import db
+from app.identity import identity_cache
+from app.models import Organization, User
+from sqlalchemy import func
+import logging
+
+logger = logging.getLogger(__name__)
+
+def member_counts(organization_id):
+    """Members per role in one aggregate query"""
+    return dict(db.session.query(User.role, func.count(User.id)).filter(
+        User.organization_id == organization_id
+    ).group_by(User.role).all())
+
+def enforce_seat_limit(organization, limit):
+    """Detach the newest non-admin members beyond a plan's team size limit.
+
+    Call this whenever an organization's plan changes. The excess members are
+    removed with one UPDATE over a LIMITed subquery instead of being loaded
+    and modified one at a time. Returns the number of members removed; the
+    caller commits.
+    """
+    member_count = db.session.query(func.count(User.id)).filter(
+        User.organization_id == organization.id
+    ).scalar()
+    excess = member_count - limit
+    if excess <= 0:
+        return 0
+
+    newest = db.session.query(User.id).filter(
+        User.organization_id == organization.id,
+        User.role != 'admin'
+    ).order_by(User.created_at.desc(), User.id.desc()).limit(excess)
+    removed = User.query.filter(User.id.in_(newest.scalar_subquery())).update(
+        {User.organization_id: None, User.role: 'user'},
+        synchronize_session=False
+    )
+
+    # A bulk UPDATE skips the User events that keep the counter and the
+    # identity cache current, so bring both up to date here
+    active_users = db.session.query(func.count(User.id)).filter(
+        User.organization_id == organization.id,
+        User.is_active == True
+    ).scalar_subquery()
+    Organization.query.filter_by(id=organization.id).update(
+        {Organization.active_user_count: active_users},
+        synchronize_session=False
+    )
+    db.session.expire(organization, ['active_user_count'])
+    identity_cache.invalidate_organization(organization.id)
+
+    logger.info(f'Removed {removed} member(s) from organization {organization.id} '
+                f'to fit its limit of {limit}')
+    return removed
@@ -0,0 +1,198 @@
+from app import db
+from app.models import Ticket, TicketStats, User, Organization, response_seconds
+from datetime import datetime, time
+from sqlalchemy import case, func
+
+def _count_where(condition):
+    """Conditional COUNT that can share a single aggregate query"""
+    return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+def _count_sum(condition):
+    """Conditional SUM over TicketStats counters"""
+    return func.coalesce(func.sum(case((condition, TicketStats.count), else_=0)), 0)
+
+def ticket_counts(organization_id):
+    """Read the materialized ticket counters for an organization"""
+    return db.session.query(
+        func.coalesce(func.sum(TicketStats.count), 0).label('total'),
+        _count_sum(TicketStats.status == 'open').label('open'),
+        _count_sum(TicketStats.priority == 'high').label('high_priority'),
+        _count_sum(TicketStats.status == 'closed').label('closed')
+    ).filter(TicketStats.organization_id == organization_id).one()
+
+def organization_ticket_stats(organization_id):
+    """Dashboard and support overview stats for an organization"""
+    counts = ticket_counts(organization_id)
+    organization = db.session.get(Organization, organization_id)
+
+    # Only tickets touched today, found through ix_tickets_org_updated
+    start_of_today = datetime.combine(datetime.utcnow().date(), time.min)
+    resolved_today = db.session.query(func.count(Ticket.id)).filter(
+        Ticket.organization_id == organization_id,
+        Ticket.updated_at >= start_of_today,
+        Ticket.status == 'closed'
+    ).scalar()
+
+    resolution_rate = (counts.closed / counts.total * 100) if counts.total > 0 else 0
+    avg_response_hours = round(organization.response_seconds_sum / organization.responded_count / 3600, 1) \
+        if organization.responded_count else 0
+
+    stats = {
+        'total_tickets': counts.total,
+        'open_tickets': counts.open,
+        'high_priority': counts.high_priority,
+        'team_members': organization.active_user_count
+    }
+    support_stats = {
+        'avg_response_time': f"{avg_response_hours}h",
+        'resolved_today': resolved_today,
+        'resolution_rate': f"{round(resolution_rate, 1)}%"
+    }
+    return stats, support_stats
+
+def user_ticket_stats(user_id):
+    """Ticket counts by status for tickets a user has submitted in one query"""
+    row = db.session.query(
+        func.count(Ticket.id).label('total'),
+        _count_where(Ticket.status == 'open').label('open'),
+        _count_where(Ticket.status == 'in_progress').label('in_progress'),
+        _count_where(Ticket.status == 'closed').label('closed')
+    ).filter(Ticket.submitter_id == user_id).one()
+
+    return {
+        'total_tickets': row.total,
+        'open_tickets': row.open,
+        'in_progress_tickets': row.in_progress,
+        'closed_tickets': row.closed
+    }
+
+def _expected_ticket_stats():
+    """Ticket counters recomputed from the tickets table"""
+    rows = db.session.query(
+        Ticket.organization_id, Ticket.status, Ticket.priority, func.count(Ticket.id)
+    ).filter(
+        Ticket.organization_id.isnot(None),
+        Ticket.status.isnot(None),
+        Ticket.priority.isnot(None)
+    ).group_by(Ticket.organization_id, Ticket.status, Ticket.priority).all()
+    return {(org_id, status, priority): count for org_id, status, priority, count in rows}
+
+def _expected_active_users():
+    """Active user counts recomputed from the users table"""
+    rows = db.session.query(User.organization_id, func.count(User.id)).filter(
+        User.organization_id.isnot(None),
+        User.is_active == True
+    ).group_by(User.organization_id).all()
+    return dict(rows)
+
+def _expected_response_times():
+    """(seconds sum, responded count) per organization recomputed from the tickets table"""
+    totals = {}
+    rows = db.session.query(Ticket.organization_id, Ticket.created_at, Ticket.first_response_time).filter(
+        Ticket.organization_id.isnot(None),
+        Ticket.first_response_time.isnot(None)
+    ).execution_options(yield_per=5000)
+    for org_id, created_at, first_response_time in rows:
+        seconds = response_seconds(created_at, first_response_time)
+        if seconds is not None:
+            total, count = totals.get(org_id, (0, 0))
+            totals[org_id] = (total + seconds, count + 1)
+    return totals
+
+def _expected_open_tickets():
+    """Open assigned ticket counts recomputed from the tickets table"""
+    rows = db.session.query(Ticket.assignee_id, func.count(Ticket.id)).filter(
+        Ticket.assignee_id.isnot(None),
+        Ticket.status != 'closed'
+    ).group_by(Ticket.assignee_id).all()
+    return dict(rows)
+
+def verify_counters():
+    """Compare materialized counters with the source tables and return any drift"""
+    drift = []
+
+    expected = _expected_ticket_stats()
+    stored = {
+        (row.organization_id, row.status, row.priority): row.count
+        for row in TicketStats.query.all()
+    }
+    for key in sorted(set(expected) | set(stored), key=str):
+        if expected.get(key, 0) != stored.get(key, 0):
+            drift.append({
+                'counter': 'ticket_stats',
+                'key': key,
+                'stored': stored.get(key, 0),
+                'expected': expected.get(key, 0)
+            })
+
+    expected_users = _expected_active_users()
+    for org_id, stored_count in db.session.query(Organization.id, Organization.active_user_count).all():
+        if (stored_count or 0) != expected_users.get(org_id, 0):
+            drift.append({
+                'counter': 'active_user_count',
+                'key': (org_id,),
+                'stored': stored_count or 0,
+                'expected': expected_users.get(org_id, 0)
+            })
+
+    expected_responses = _expected_response_times()
+    for org_id, stored_sum, stored_count in db.session.query(
+        Organization.id, Organization.response_seconds_sum, Organization.responded_count
+    ).all():
+        stored = (stored_sum or 0, stored_count or 0)
+        if stored != expected_responses.get(org_id, (0, 0)):
+            drift.append({
+                'counter': 'response_times',
+                'key': (org_id,),
+                'stored': stored,
+                'expected': expected_responses.get(org_id, (0, 0))
+            })
+
+    expected_open = _expected_open_tickets()
+    for user_id, stored_count in db.session.query(User.id, User.open_ticket_count).all():
+        if (stored_count or 0) != expected_open.get(user_id, 0):
+            drift.append({
+                'counter': 'open_ticket_count',
+                'key': (user_id,),
+                'stored': stored_count or 0,
+                'expected': expected_open.get(user_id, 0)
+            })
+
+    return drift
+
+def rebuild_counters():
+    """Recompute every materialized counter from scratch"""
+    TicketStats.query.delete(synchronize_session=False)
+    db.session.add_all([
+        TicketStats(organization_id=org_id, status=status, priority=priority, count=count)
+        for (org_id, status, priority), count in _expected_ticket_stats().items()
+    ])
+
+    active_users = db.session.query(func.count(User.id)).filter(
+        User.organization_id == Organization.id,
+        User.is_active == True
+    ).scalar_subquery()
+    db.session.query(Organization).update(
+        {Organization.active_user_count: active_users},
+        synchronize_session=False
+    )
+
+    db.session.query(Organization).update(
+        {Organization.response_seconds_sum: 0, Organization.responded_count: 0},
+        synchronize_session=False
+    )
+    for org_id, (total, count) in _expected_response_times().items():
+        db.session.query(Organization).filter(Organization.id == org_id).update(
+            {Organization.response_seconds_sum: total, Organization.responded_count: count},
+            synchronize_session=False
+        )
+
+    open_tickets = db.session.query(func.count(Ticket.id)).filter(
+        Ticket.assignee_id == User.id,
+        Ticket.status != 'closed'
+    ).scalar_subquery()
+    db.session.query(User).update(
+        {User.open_ticket_count: open_tickets},
+        synchronize_session=False
+    )
+    db.session.commit()
@@ -0,0 +1,55 @@
+from flask import Response, request, stream_with_context
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+def wants_stream():
+    """True when the client asked for Server-Sent Events instead of one JSON reply"""
+    return (request.accept_mimetypes.best == 'text/event-stream'
+            or request.args.get('stream') == '1')
+
+def sse_event(data, event=None):
+    """Format one Server-Sent Events frame"""
+    frame = f'event: {event}\n' if event else ''
+    return frame + f'data: {json.dumps(data)}\n\n'
+
+def log_timing(endpoint, started, first_byte, chunks, outcome):
+    """Log time-to-first-byte and total duration for one AI response"""
+    finished = time.perf_counter()
+    ttfb_ms = round((first_byte - started) * 1000, 1) if first_byte else None
+    total_ms = round((finished - started) * 1000, 1)
+    logger.info(f'{endpoint} {outcome}: ttfb_ms={ttfb_ms} total_ms={total_ms} chunks={chunks}')
+
+def stream_completion(chunks, endpoint, started, error_message):
+    """Relay completion chunks to the client as Server-Sent Events.
+
+    Each chunk is sent as a `data: {"token": ...}` frame as soon as the model
+    produces it, followed by a `done` event, or an `error` event carrying
+    error_message if the upstream call fails part way through.
+    """
+    def generate():
+        first_byte = None
+        count = 0
+        outcome = 'aborted'  # Client went away before the stream finished
+        try:
+            for chunk in chunks:
+                if first_byte is None:
+                    first_byte = time.perf_counter()
+                count += 1
+                yield sse_event({'token': chunk})
+            outcome = 'streamed'
+            yield sse_event({}, event='done')
+        except Exception as e:
+            outcome = 'failed'
+            logger.warning(f'{endpoint} stream failed after {count} chunks: {e}')
+            yield sse_event({'response': error_message}, event='error')
+        finally:
+            log_timing(endpoint, started, first_byte, count, outcome)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache, no-store, must-revalidate',
+        # Stop nginx and similar proxies from buffering the whole stream
+        'X-Accel-Buffering': 'no'
+    })
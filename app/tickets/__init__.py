@@ -2,4 +2,4 @@ from flask import Blueprint
 
 bp = Blueprint('tickets', __name__)
 
-from app.tickets import routes
+from app.tickets import routes, tasks
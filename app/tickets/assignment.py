@@ -0,0 +1,71 @@
+from flask import current_app
+from app import db
+from app.models import Organization, User
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Compare-and-swap retries before giving up on advancing the cursor
+MAX_CURSOR_ATTEMPTS = 5
+
+def _eligible_staff(organization_id):
+    """Active staff and admins who can be assigned tickets"""
+    return User.query.filter(
+        User.organization_id == organization_id,
+        User.role.in_(['staff', 'admin']),
+        User.is_active == True
+    )
+
+def round_robin(organization_id):
+    """Return the next staff member after the organization's rotation cursor.
+
+    The cursor is the id of the last user picked, so the next assignee is the
+    lowest eligible id above it (wrapping around to the lowest overall). The
+    cursor only advances if nobody moved it since it was read, so concurrent
+    submissions each get a different assignee.
+    """
+    assignee = None
+    for _ in range(MAX_CURSOR_ATTEMPTS):
+        cursor = db.session.query(Organization.assignment_cursor).filter(
+            Organization.id == organization_id
+        ).scalar()
+        staff = _eligible_staff(organization_id)
+        assignee = None
+        if cursor is not None:
+            assignee = staff.filter(User.id > cursor).order_by(User.id).first()
+        if assignee is None:
+            assignee = staff.order_by(User.id).first()
+        if assignee is None:
+            return None
+
+        unchanged = (Organization.assignment_cursor == cursor if cursor is not None
+                     else Organization.assignment_cursor.is_(None))
+        swapped = Organization.query.filter(Organization.id == organization_id, unchanged).update(
+            {Organization.assignment_cursor: assignee.id},
+            synchronize_session=False
+        )
+        if swapped:
+            return assignee
+
+    # Heavy contention: still assign the ticket, the rotation catches up on the next one
+    logger.warning(f'Assignment cursor for organization {organization_id} kept changing; '
+                   f'assigning to user {assignee.id} without advancing it')
+    return assignee
+
+def least_open_tickets(organization_id):
+    """Return the staff member with the fewest open assigned tickets"""
+    return _eligible_staff(organization_id).order_by(
+        User.open_ticket_count, User.id
+    ).first()
+
+STRATEGIES = {
+    'round_robin': round_robin,
+    'least_open': least_open_tickets,
+}
+
+def assign_ticket(organization_id, strategy=None):
+    """Pick an assignee for a new ticket, or None if there is no eligible staff"""
+    strategy = strategy or current_app.config.get('TICKET_ASSIGNMENT_STRATEGY', 'round_robin')
+    if strategy not in STRATEGIES:
+        raise ValueError(f'Unknown ticket assignment strategy {strategy!r}')
+    return STRATEGIES[strategy](organization_id)
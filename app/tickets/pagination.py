@@ -0,0 +1,67 @@
+from app.models import Ticket
+from datetime import datetime
+from sqlalchemy import and_, or_
+import base64
+import json
+
+# Each sort orders by one timestamp column with the ticket id as a tiebreaker,
+# so (value, id) uniquely identifies a position in the listing
+SORT_OPTIONS = {
+    'newest': (Ticket.created_at, 'desc'),
+    'oldest': (Ticket.created_at, 'asc'),
+    'recently_updated': (Ticket.updated_at, 'desc'),
+}
+DEFAULT_SORT = 'newest'
+MAX_PER_PAGE = 100
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(value, ticket_id):
+    """Opaque cursor for the position just after (value, ticket_id)"""
+    payload = json.dumps([value.isoformat() if value else None, ticket_id])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        value, ticket_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return (datetime.fromisoformat(value) if value else None), int(ticket_id)
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid pagination cursor.')
+
+def get_per_page(requested, default):
+    """Clamp a requested page size to a sane range"""
+    try:
+        per_page = int(requested) if requested else default
+    except (TypeError, ValueError):
+        per_page = default
+    return max(1, min(per_page, MAX_PER_PAGE))
+
+def paginate_tickets(query, sort=None, cursor=None, per_page=25):
+    """Return one page of tickets and the cursor for the next page (or None)"""
+    if sort not in SORT_OPTIONS:
+        sort = DEFAULT_SORT
+    column, direction = SORT_OPTIONS[sort]
+
+    if cursor:
+        value, ticket_id = decode_cursor(cursor)
+        if direction == 'desc':
+            query = query.filter(or_(column < value, and_(column == value, Ticket.id < ticket_id)))
+        else:
+            query = query.filter(or_(column > value, and_(column == value, Ticket.id > ticket_id)))
+
+    if direction == 'desc':
+        query = query.order_by(column.desc(), Ticket.id.desc())
+    else:
+        query = query.order_by(column.asc(), Ticket.id.asc())
+
+    # Fetch one extra row to find out whether there is a next page
+    tickets = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(tickets) > per_page:
+        tickets = tickets[:per_page]
+        last = tickets[-1]
+        next_cursor = encode_cursor(getattr(last, column.key), last.id)
+    return tickets, next_cursor
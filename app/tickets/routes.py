@@ -1,34 +1,61 @@
-from flask import render_template, redirect, url_for, flash, request, jsonify
+from flask import render_template, redirect, url_for, flash, request, jsonify, current_app
 from flask_login import login_required, current_user
 from app.tickets import bp
 from app.models import Ticket, TicketResponse, User
 from app.tickets.forms import TicketForm, ResponseForm
+from app.tickets.assignment import assign_ticket
+from app.tickets.pagination import paginate_tickets, get_per_page, InvalidCursor, SORT_OPTIONS
+from app.tickets.search import search_tickets
+from app.tickets.similar import index_ticket, similar_tickets
 from app import db
+from app.jobs import job_queue
+from app.completions import completion_cache
+from app.database import replica_reads
+from app.metrics import count_ticket_created
+from app.streaming import wants_stream, stream_completion, log_timing
+from sqlalchemy.orm import joinedload, selectinload
 from openai import OpenAI
+import logging
 import os
+import time
 from datetime import datetime, timedelta
 
-client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'))
+logger = logging.getLogger(__name__)
 
-def get_ai_suggestion(title, description):
-    print(f"Attempting to get AI suggestion for title: {title}")  # Debug print
+# Bound the OpenAI round-trip so a slow completion can't hold a worker indefinitely
+client = OpenAI(api_key=os.environ.get('OPENAI_API_KEY'),
+                timeout=float(os.environ.get('OPENAI_TIMEOUT', '20')),
+                max_retries=int(os.environ.get('OPENAI_MAX_RETRIES', '1')))
+
+# Characters of each earlier resolution passed to the model
+RESOLUTION_CONTEXT_CHARS = 500
+
+def get_ai_suggestion(title, description, resolved=()):
+    """Suggestion for a new ticket, grounded in how similar tickets were resolved.
+
+    resolved is a list of (title, resolution) pairs from similar_tickets().
+    """
+    user_content = f"Issue Title: {title}\nDescription: {description}"
+    if resolved:
+        user_content += "\n\nSimilar past tickets and how staff resolved them:\n" + "\n".join(
+            f"- {past_title}: {resolution[:RESOLUTION_CONTEXT_CHARS]}" for past_title, resolution in resolved
+        )
     try:
-        print(f"OpenAI API Key: {os.environ.get('OPENAI_API_KEY')[:10]}...")  # Debug print (first 10 chars only)
-        response = client.chat.completions.create(
+        suggestion = completion_cache.complete(
+            client,
             model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a helpful IT support assistant. Provide a brief, helpful suggestion for troubleshooting the following computer issue. Be specific and practical."},
-                {"role": "user", "content": f"Issue Title: {title}\nDescription: {description}"}
-            ],
+            system_prompt="You are a helpful IT support assistant. Provide a brief, helpful suggestion for troubleshooting the following computer issue. Be specific and practical. When similar past tickets are listed, prefer the fixes that worked for them.",
+            user_content=user_content,
             max_tokens=200,
             temperature=0.7
         )
-        suggestion = response.choices[0].message.content
-        print(f"AI Suggestion successfully generated: {suggestion}")  # Debug print
+        if not suggestion:
+            raise ValueError("No choices in OpenAI response")
+        logger.debug('AI suggestion generated', extra={'grounded': len(resolved), 'chars': len(suggestion)})
         return suggestion
     except Exception as e:
-        print(f"OpenAI API error details: {str(e)}")  # Debug print
-        return "Unable to generate AI suggestion at this time."
+        logger.warning(f'OpenAI error in get_ai_suggestion: {e}')
+        raise  # Let the job queue retry and count the failure
 
 def require_organization(f):
     """Decorator to require organization membership"""
@@ -43,19 +70,70 @@ def require_organization(f):
 @bp.route('/')
 @login_required
 @require_organization
+@replica_reads()
 def index():
     # Filter tickets based on user role
     if current_user.is_admin or current_user.role == 'staff':
         # Admin/Staff can see all tickets in their organization
-        tickets = Ticket.query.filter_by(organization_id=current_user.organization_id).all()
+        query = Ticket.query.filter_by(organization_id=current_user.organization_id)
     else:
         # Regular users can only see their own tickets
-        tickets = Ticket.query.filter_by(
+        query = Ticket.query.filter_by(
             organization_id=current_user.organization_id,
             submitter_id=current_user.id
-        ).all()
+        )
+    
+    # The list shows both usernames on every row
+    query = query.options(joinedload(Ticket.assignee), joinedload(Ticket.submitter))
+    
+    sort = request.args.get('sort')
+    per_page = get_per_page(request.args.get('per_page'), current_app.config['TICKETS_PER_PAGE'])
+    try:
+        tickets, next_cursor = paginate_tickets(query, sort, request.args.get('cursor'), per_page)
+    except InvalidCursor:
+        flash('That page of tickets is no longer available.', 'warning')
+        return redirect(url_for('tickets.index', sort=sort))
+    
+    return render_template('tickets/index.html', title='Tickets', tickets=tickets,
+                           next_cursor=next_cursor, sort=sort if sort in SORT_OPTIONS else 'newest',
+                           per_page=per_page)
+
+@bp.route('/search')
+@login_required
+@require_organization
+def search():
+    """Ranked full-text search over titles, descriptions and responses"""
+    q = request.args.get('q', '').strip()
+    page = max(1, request.args.get('page', 1, type=int))
+    per_page = get_per_page(request.args.get('per_page'), current_app.config['TICKETS_PER_PAGE'])
+    # Regular users only search their own tickets, as in the ticket list
+    submitter_id = None if current_user.is_staff else current_user.id
     
-    return render_template('tickets/index.html', title='Tickets', tickets=tickets)
+    started = time.perf_counter()
+    results, has_next = search_tickets(q, current_user.organization_id, submitter_id, page, per_page) if q else ([], False)
+    elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+    
+    if request.args.get('format') == 'json' or request.accept_mimetypes.best == 'application/json':
+        return jsonify({
+            'query': q,
+            'page': page,
+            'has_next': has_next,
+            'elapsed_ms': elapsed_ms,
+            'results': [{
+                'id': ticket.id,
+                'title': ticket.title,
+                'title_html': str(title_html),
+                'snippet_html': str(snippet_html),
+                'rank': rank,
+                'status': ticket.status,
+                'priority': ticket.priority,
+                'created_at': ticket.created_at.isoformat(),
+                'assignee': ticket.assignee.username if ticket.assignee else None
+            } for ticket, rank, title_html, snippet_html in results]
+        })
+    
+    return render_template('tickets/search.html', title='Search Tickets', q=q, results=results,
+                           page=page, per_page=per_page, has_next=has_next, elapsed_ms=elapsed_ms)
 
 @bp.route('/create', methods=['GET', 'POST'])
 @login_required
@@ -63,35 +141,8 @@ def index():
 def create():
     form = TicketForm()
     if form.validate_on_submit():
-        # Get AI suggestion if possible
-        ai_suggestion = get_ai_suggestion(form.title.data, form.description.data)
-        
-        # Get available staff members (staff and admins)
-        staff_members = User.query.filter(
-            User.organization_id == current_user.organization_id,
-            User.role.in_(['staff', 'admin']),
-            User.is_active == True
-        ).all()
-        
-        # Implement round-robin assignment
-        assignee = None
-        if staff_members:
-            # Get the last assigned ticket
-            last_ticket = Ticket.query.filter_by(
-                organization_id=current_user.organization_id
-            ).order_by(Ticket.created_at.desc()).first()
-            
-            if last_ticket and last_ticket.assignee_id:
-                # Find the next staff member in the rotation
-                current_idx = next(
-                    (i for i, staff in enumerate(staff_members) 
-                     if staff.id == last_ticket.assignee_id), -1
-                )
-                next_idx = (current_idx + 1) % len(staff_members)
-                assignee = staff_members[next_idx]
-            else:
-                # If no last ticket or it had no assignee, start with the first staff member
-                assignee = staff_members[0]
+        # Pick an assignee with the organization's assignment strategy
+        assignee = assign_ticket(current_user.organization_id)
         
         ticket = Ticket(
             title=form.title.data,
@@ -100,12 +151,21 @@ def create():
             category=form.category.data,
             submitter_id=current_user.id,
             organization_id=current_user.organization_id,
-            assignee_id=assignee.id if assignee else None,
-            ai_suggestion=ai_suggestion
+            assignee_id=assignee.id if assignee else None
         )
         
         db.session.add(ticket)
+        db.session.flush()
+        # The AI suggestion is filled in by a background job once the ticket is saved
+        job_queue.enqueue('ai_suggestion', ticket_id=ticket.id)
         db.session.commit()
+        count_ticket_created(ticket.organization_id)
+        # Before wake(), so the suggestion job can already find it
+        try:
+            index_ticket(ticket)
+        except Exception:
+            logger.exception(f'Could not add ticket {ticket.id} to the similarity index')
+        job_queue.wake()
         
         flash(f'Ticket created and assigned to {assignee.username if assignee else "unassigned"}!', 'success')
         return redirect(url_for('tickets.view', id=ticket.id))
@@ -116,7 +176,9 @@ def create():
 @login_required
 @require_organization
 def view(id):
-    ticket = Ticket.query.get_or_404(id)
+    ticket = Ticket.query.options(
+        selectinload(Ticket.responses).joinedload(TicketResponse.user)
+    ).filter_by(id=id).first_or_404()
     
     # Ensure user can only view tickets from their organization
     if ticket.organization_id != current_user.organization_id:
@@ -132,6 +194,42 @@ def view(id):
     form = ResponseForm()
     return render_template('tickets/view.html', title=f'Ticket #{id}', ticket=ticket, form=form)
 
+@bp.route('/<int:id>/ai_suggestion')
+@login_required
+@require_organization
+def ai_suggestion(id):
+    ticket = Ticket.query.get_or_404(id)
+    if ticket.organization_id != current_user.organization_id:
+        return jsonify({'error': 'Ticket not found'}), 404
+    if not (current_user.is_admin or current_user.role == 'staff') and ticket.submitter_id != current_user.id:
+        return jsonify({'error': 'Ticket not found'}), 404
+    
+    return jsonify({
+        'ready': ticket.ai_suggestion is not None,
+        'suggestion': ticket.ai_suggestion
+    })
+
+@bp.route('/<int:id>/similar')
+@login_required
+@require_organization
+def similar(id):
+    """Earlier tickets like this one and how staff resolved them"""
+    ticket = Ticket.query.get_or_404(id)
+    if ticket.organization_id != current_user.organization_id or not current_user.is_staff:
+        return jsonify({'error': 'Ticket not found'}), 404
+    
+    k = min(max(1, request.args.get('k', current_app.config['SIMILARITY_TOP_K'], type=int)), 20)
+    return jsonify({
+        'similar': [{
+            'id': match['ticket'].id,
+            'title': match['ticket'].title,
+            'status': match['ticket'].status,
+            'score': match['score'],
+            'resolution': match['resolution'],
+            'url': url_for('tickets.view', id=match['ticket'].id)
+        } for match in similar_tickets([ticket], k)[0]]
+    })
+
 @bp.route('/<int:id>/update', methods=['POST'])
 @login_required
 @require_organization
@@ -190,13 +288,15 @@ def add_response(id):
             user_id=current_user.id
         )
         
-        # Update ticket response tracking for staff responses
+        # Update ticket response tracking for staff responses; the
+        # needs_response filter relies on last_response_by_staff being set here
         if current_user.is_staff:
+            now = datetime.utcnow()
             # Set first response time if not set
             if not ticket.first_response_time:
-                ticket.first_response_time = datetime.utcnow()
+                ticket.first_response_time = now
             # Update last response by staff
-            ticket.last_response_by_staff = datetime.utcnow()
+            ticket.last_response_by_staff = now
             ticket.last_updated_by_id = current_user.id
         
         db.session.add(response)
@@ -207,29 +307,39 @@ def add_response(id):
 @bp.route('/<int:id>/chat', methods=['POST'])
 @login_required
 def chat(id):
+    started = time.perf_counter()
     ticket = Ticket.query.get_or_404(id)
     data = request.get_json()
     user_message = data.get('message')
+    error_message = "I apologize, but I encountered an error. Please try again later."
+    completion_args = dict(
+        model="gpt-3.5-turbo",
+        system_prompt="You are a helpful IT support assistant. Provide specific and practical solutions for the following computer issue.",
+        user_content=f"Ticket Title: {ticket.title}\nDescription: {ticket.description}\nUser Question: {user_message}",
+        max_tokens=200,
+        temperature=0.7
+    )
     
-    try:
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a helpful IT support assistant. Provide specific and practical solutions for the following computer issue."},
-                {"role": "user", "content": f"Ticket Title: {ticket.title}\nDescription: {ticket.description}\nUser Question: {user_message}"}
-            ],
-            max_tokens=200,
-            temperature=0.7
+    if wants_stream():
+        return stream_completion(
+            completion_cache.stream(client, **completion_args), 'tickets.chat', started, error_message
         )
-        ai_response = response.choices[0].message.content
+    
+    try:
+        ai_response = completion_cache.complete(client, **completion_args)
+        if not ai_response:
+            raise ValueError("No choices in OpenAI response")
+        log_timing('tickets.chat', started, time.perf_counter(), 1, 'completed')
         return jsonify({"response": ai_response})
     except Exception as e:
-        print(f"OpenAI API error in chat: {str(e)}")
-        return jsonify({"response": "I apologize, but I encountered an error. Please try again later."}), 500
+        logger.warning(f'OpenAI error in tickets.chat: {e}')
+        log_timing('tickets.chat', started, None, 0, 'failed')
+        return jsonify({"response": error_message}), 500
 
 @bp.route('/filter')
 @login_required
 @require_organization
+@replica_reads()
 def filter_tickets():
     filters = request.args.getlist('filters')
     
@@ -244,30 +354,18 @@ def filter_tickets():
             submitter_id=current_user.id
         )
     
-    if not filters:
-        # If no filters are active, return all tickets (based on user role)
-        tickets = query.order_by(Ticket.created_at.desc()).all()
-    else:
+    if filters:
         for filter_type in filters:
             if filter_type == 'assigned_to_me':
                 query = query.filter_by(assignee_id=current_user.id)
             elif filter_type == 'high_priority':
                 query = query.filter_by(priority='high')
             elif filter_type == 'needs_response':
-                # Get all tickets that have no responses from staff/admin
+                # Open tickets no staff member has answered yet; add_response
+                # stamps last_response_by_staff, so this is an indexed lookup
                 query = query.filter(
-                    Ticket.status == 'open'  # Only show open tickets
-                ).outerjoin(
-                    TicketResponse,  # Join with responses
-                    (TicketResponse.ticket_id == Ticket.id) & 
-                    (TicketResponse.user_id.in_(  # Where response is from staff/admin
-                        db.session.query(User.id).filter(
-                            User.organization_id == current_user.organization_id,
-                            User.role.in_(['staff', 'admin'])
-                        )
-                    ))
-                ).group_by(Ticket.id).having(
-                    db.func.count(TicketResponse.id) == 0  # No staff responses found
+                    Ticket.status == 'open',
+                    Ticket.last_response_by_staff.is_(None)
                 )
             elif filter_type == 'overdue':
                 # Show tickets that have been open for more than 24 hours
@@ -276,7 +374,15 @@ def filter_tickets():
                     Ticket.status == 'open',
                     Ticket.created_at <= twenty_four_hours_ago
                 )
-        tickets = query.order_by(Ticket.created_at.desc()).all()
+    
+    # Only the assignee's username is serialised
+    query = query.options(joinedload(Ticket.assignee))
+    
+    per_page = get_per_page(request.args.get('per_page'), current_app.config['TICKETS_PER_PAGE'])
+    try:
+        tickets, next_cursor = paginate_tickets(query, request.args.get('sort'), request.args.get('cursor'), per_page)
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     
     return jsonify({
         'tickets': [{
@@ -288,5 +394,6 @@ def filter_tickets():
             'status_class': ticket.status_class,
             'priority_class': ticket.priority_class,
             'assignee': ticket.assignee.username if ticket.assignee else None
-        } for ticket in tickets]
+        } for ticket in tickets],
+        'next_cursor': next_cursor
     }) 
\ No newline at end of file
@@ -0,0 +1,231 @@
+"""Full-text search over ticket titles, descriptions and responses.
+
+PostgreSQL: a trigger on ticket_responses keeps each ticket's concatenated
+responses in tickets.search_responses, and a generated tsvector column
+(tickets.search_vector, with a GIN index) covers the title, description and
+responses, so the database keeps it current.
+
+SQLite: an FTS5 table, ticket_search, holds one row per ticket (rowid is the
+ticket id) with the title, description and the concatenated responses.
+Triggers on tickets and ticket_responses keep it in sync.
+
+The DDL below is attached to the tables' after_create events, so
+db.create_all() sets it up too. Migrations 1d7e4a9c3b52 and 7b3d9f2a6c18
+run the same statements on existing databases. None of these objects are
+in the models, so migrations/env.py passes include_object() to autogenerate
+to keep it from dropping them.
+"""
+from flask import current_app
+from markupsafe import Markup, escape
+from app import db
+from app.models import Ticket, TicketResponse
+from sqlalchemy import DDL, event, text
+from sqlalchemy.orm import joinedload
+import re
+
+# Highlight markers. The text is escaped first and the markers swapped for
+# <mark> afterwards, so ticket content never reaches the page unescaped
+MARK_START = '\x02'
+MARK_END = '\x03'
+MAX_QUERY_TERMS = 16
+
+# Each ticket's responses, kept in tickets.search_responses by a trigger, so
+# one tsvector covers the whole ticket and terms may be split between the
+# ticket and its responses
+_POSTGRESQL_RESPONSES_OF = ("(SELECT string_agg(content, ' ' ORDER BY id) FROM ticket_responses "
+                            "WHERE ticket_id = {ticket})")
+
+POSTGRESQL_DDL = {
+    Ticket.__table__: [
+        "ALTER TABLE tickets ADD COLUMN search_responses text",
+        "ALTER TABLE tickets ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+        "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce(description, '')), 'B') || "
+        "setweight(to_tsvector('english', coalesce(search_responses, '')), 'C')) STORED",
+        "CREATE INDEX ix_tickets_search_vector ON tickets USING gin (search_vector)",
+    ],
+    TicketResponse.__table__: [
+        "CREATE OR REPLACE FUNCTION ticket_search_responses() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN "
+        "IF TG_OP <> 'INSERT' THEN "
+        f"UPDATE tickets SET search_responses = {_POSTGRESQL_RESPONSES_OF.format(ticket='OLD.ticket_id')} "
+        "WHERE id = OLD.ticket_id; END IF; "
+        "IF TG_OP <> 'DELETE' THEN "
+        f"UPDATE tickets SET search_responses = {_POSTGRESQL_RESPONSES_OF.format(ticket='NEW.ticket_id')} "
+        "WHERE id = NEW.ticket_id; END IF; "
+        "RETURN NULL; END $$",
+        "CREATE TRIGGER ticket_search_responses AFTER INSERT OR DELETE OR UPDATE OF content, ticket_id "
+        "ON ticket_responses FOR EACH ROW EXECUTE FUNCTION ticket_search_responses()",
+    ],
+}
+
+_RESPONSES_OF = ("(SELECT coalesce(group_concat(content, ' '), '') FROM ticket_responses "
+                 "WHERE ticket_id = {ticket})")
+
+SQLITE_DDL = {
+    Ticket.__table__: [
+        "CREATE VIRTUAL TABLE ticket_search USING fts5("
+        "title, description, responses, tokenize = 'porter unicode61')",
+        "CREATE TRIGGER ticket_search_insert AFTER INSERT ON tickets BEGIN "
+        "INSERT INTO ticket_search (rowid, title, description, responses) "
+        "VALUES (new.id, new.title, new.description, ''); END",
+        "CREATE TRIGGER ticket_search_update AFTER UPDATE OF title, description ON tickets BEGIN "
+        "UPDATE ticket_search SET title = new.title, description = new.description "
+        "WHERE rowid = new.id; END",
+        "CREATE TRIGGER ticket_search_delete AFTER DELETE ON tickets BEGIN "
+        "DELETE FROM ticket_search WHERE rowid = old.id; END",
+    ],
+    TicketResponse.__table__: [
+        # Appending is enough for a new response; edits and deletes rebuild the text
+        "CREATE TRIGGER ticket_search_response_insert AFTER INSERT ON ticket_responses BEGIN "
+        "UPDATE ticket_search SET responses = responses || ' ' || coalesce(new.content, '') "
+        "WHERE rowid = new.ticket_id; END",
+        "CREATE TRIGGER ticket_search_response_update AFTER UPDATE OF content, ticket_id ON ticket_responses BEGIN "
+        f"UPDATE ticket_search SET responses = {_RESPONSES_OF.format(ticket='old.ticket_id')} "
+        "WHERE rowid = old.ticket_id; "
+        f"UPDATE ticket_search SET responses = {_RESPONSES_OF.format(ticket='new.ticket_id')} "
+        "WHERE rowid = new.ticket_id; END",
+        "CREATE TRIGGER ticket_search_response_delete AFTER DELETE ON ticket_responses BEGIN "
+        f"UPDATE ticket_search SET responses = {_RESPONSES_OF.format(ticket='old.ticket_id')} "
+        "WHERE rowid = old.ticket_id; END",
+    ],
+}
+
+# Objects created by the DDL below, which autogenerate must leave alone
+SEARCH_TABLE_PREFIX = 'ticket_search'
+SEARCH_COLUMNS = frozenset({'search_vector', 'search_responses'})
+SEARCH_INDEXES = frozenset({'ix_tickets_search_vector'})
+
+for _dialect, _statements in (('postgresql', POSTGRESQL_DDL), ('sqlite', SQLITE_DDL)):
+    for _table, _ddl in _statements.items():
+        for _statement in _ddl:
+            event.listen(_table, 'after_create', DDL(_statement).execute_if(dialect=_dialect))
+event.listen(Ticket.__table__, 'after_drop',
+             DDL('DROP TABLE IF EXISTS ticket_search').execute_if(dialect='sqlite'))
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Alembic include_object hook that skips the search tables, columns and indexes"""
+    if type_ == 'table':
+        # ticket_search and its FTS5 shadow tables (_data, _idx, _content, ...)
+        return not name.startswith(SEARCH_TABLE_PREFIX)
+    if type_ == 'column':
+        return name not in SEARCH_COLUMNS
+    if type_ == 'index':
+        return name not in SEARCH_INDEXES
+    return True
+
+def highlight(value):
+    """Escape search output and turn the match markers into <mark> tags"""
+    value = str(escape(value or ''))
+    return Markup(value.replace(MARK_START, '<mark>').replace(MARK_END, '</mark>'))
+
+def _terms(query):
+    return re.findall(r'\w+', query)[:MAX_QUERY_TERMS]
+
+def _fts5_query(query):
+    """FTS5 MATCH expression: every term must match, the last one as a prefix"""
+    terms = [f'"{term}"' for term in _terms(query)]
+    if terms:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+def _tsquery(query):
+    """to_tsquery() input with the same meaning as _fts5_query(): all terms, last one as a prefix"""
+    terms = _terms(query)
+    if terms:
+        terms[-1] += ':*'
+    return ' & '.join(terms)
+
+# Ranking every match is what makes a very common term slow, so only the
+# organization's newest SEARCH_MAX_CANDIDATES matches are ranked. FTS5 walks
+# matches in rowid order cheaply, and the rowid range passes straight into
+# the index. Highlights are built for the final page only.
+_SQLITE_SEARCH = """
+WITH candidates AS (
+    SELECT t.id
+    FROM ticket_search JOIN tickets t ON t.id = ticket_search.rowid
+    WHERE ticket_search MATCH :query AND t.organization_id = :organization_id {submitter}
+    ORDER BY ticket_search.rowid DESC
+    LIMIT :candidates
+),
+page AS (
+    SELECT t.id, bm25(ticket_search, 10.0, 4.0, 1.0) AS rank
+    FROM ticket_search JOIN tickets t ON t.id = ticket_search.rowid
+    WHERE ticket_search MATCH :query
+      AND ticket_search.rowid >= (SELECT min(id) FROM candidates)
+      AND t.organization_id = :organization_id {submitter}
+    ORDER BY rank, t.id DESC
+    LIMIT :limit OFFSET :offset
+)
+SELECT page.id, page.rank,
+       highlight(ticket_search, 0, :start, :end) AS title,
+       snippet(ticket_search, -1, :start, :end, '…', 24) AS snippet
+FROM ticket_search JOIN page ON ticket_search.rowid = page.id
+WHERE ticket_search MATCH :query
+ORDER BY page.rank, page.id DESC
+"""
+
+# Same shape on PostgreSQL: newest candidates, then rank, page and headline.
+# The snippet comes from the description and responses together, so a match
+# found only in a response still shows where.
+_POSTGRESQL_SEARCH = """
+WITH q AS (SELECT to_tsquery('english', :query) AS query),
+candidates AS (
+    SELECT t.id
+    FROM tickets t, q
+    WHERE t.search_vector @@ q.query AND t.organization_id = :organization_id {submitter}
+    ORDER BY t.id DESC
+    LIMIT :candidates
+),
+ranked AS (
+    SELECT t.id, ts_rank_cd(t.search_vector, q.query) AS rank
+    FROM candidates JOIN tickets t ON t.id = candidates.id, q
+    ORDER BY rank DESC, t.id DESC
+    LIMIT :limit OFFSET :offset
+)
+SELECT ranked.id, ranked.rank,
+       ts_headline('english', t.title, q.query, :title_options) AS title,
+       ts_headline('english', concat_ws(' ', t.description, t.search_responses), q.query,
+                   :snippet_options) AS snippet
+FROM ranked JOIN tickets t ON t.id = ranked.id, q
+ORDER BY ranked.rank DESC, ranked.id DESC
+"""
+
+def search_tickets(query, organization_id, submitter_id=None, page=1, per_page=25):
+    """One page of ranked matches and whether there is a next page.
+
+    Returns ([(ticket, rank, title_html, snippet_html)], has_next). Pass
+    submitter_id to restrict the search to one user's own tickets.
+    """
+    if not _terms(query):
+        return [], False
+    submitter = 'AND t.submitter_id = :submitter_id' if submitter_id is not None else ''
+    params = {
+        'organization_id': organization_id,
+        'submitter_id': submitter_id,
+        # One extra row tells us whether there is a next page
+        'limit': per_page + 1,
+        'offset': (page - 1) * per_page,
+        'candidates': current_app.config.get('SEARCH_MAX_CANDIDATES', 5000),
+    }
+    if db.engine.dialect.name == 'postgresql':
+        sql = _POSTGRESQL_SEARCH.format(submitter=submitter)
+        params.update(
+            query=_tsquery(query),
+            title_options=f'StartSel={MARK_START}, StopSel={MARK_END}, HighlightAll=true',
+            snippet_options=f'StartSel={MARK_START}, StopSel={MARK_END}, MaxFragments=2, MaxWords=24, MinWords=8'
+        )
+    else:
+        sql = _SQLITE_SEARCH.format(submitter=submitter)
+        params.update(query=_fts5_query(query), start=MARK_START, end=MARK_END)
+
+    rows = db.session.execute(text(sql), params).all()
+    has_next = len(rows) > per_page
+    rows = rows[:per_page]
+    if not rows:
+        return [], False
+
+    tickets = {ticket.id: ticket for ticket in Ticket.query.options(
+        joinedload(Ticket.assignee)
+    ).filter(Ticket.id.in_([row[0] for row in rows]))}
+    return [(tickets[row[0]], row[1], highlight(row[2]), highlight(row[3]))
+            for row in rows if row[0] in tickets], has_next
@@ -0,0 +1,428 @@
+"""Similar-ticket lookup with a per-organization TF-IDF index.
+
+Each organization's index is one memory-mapped file under
+SIMILARITY_INDEX_DIR:
+
+    header   int64[8]             magic, dims, count, capacity
+    df       float32[dims]        document frequency per hashed term
+    ids      int64[capacity]      ticket id of each row
+    vectors  float32[capacity, dims]  log-scaled term frequencies
+
+Terms are hashed into SIMILARITY_DIMENSIONS buckets, so the vocabulary never
+has to be stored or agreed on between processes. Rows hold raw term
+frequencies; IDF weights come from df at query time, so adding a ticket is
+an append and never touches the existing rows.
+
+Every worker maps the same file, so the vectors live once in the page cache
+rather than once per process. Appends happen in place under a file lock.
+When the file is full a larger copy is written, a chunk of rows at a time,
+and renamed over it; readers notice the new inode and remap.
+
+A missing file (a new organization, or a fresh disk after a deploy or on a
+new replica) is built from the tickets table the first time the index is
+used, so `flask similar rebuild` is only needed after changing
+SIMILARITY_DIMENSIONS.
+"""
+from flask import current_app
+from app import db
+from app.models import Ticket, TicketResponse, User
+import fcntl
+import numpy as np
+import os
+import re
+import threading
+import zlib
+
+MAGIC = 0x54494458  # "TIDX"
+HEADER_SLOTS = 8
+MIN_CAPACITY = 1024
+# Rows scored per step, to bound the temporary arrays on large indexes
+QUERY_CHUNK = 8192
+# IDF weights and row norms are reused until the index grows by this much
+IDF_REFRESH_GROWTH = 0.1
+STOP_WORDS = frozenset('''
+a an and are as at be but by can could do does for from has have i if in
+into is it its me my no not of on or our please so that the their then there
+this to was we were when where which while will with would you your
+'''.split())
+
+def tokenize(text):
+    return [token for token in re.findall(r'[a-z0-9]+', (text or '').lower())
+            if len(token) > 1 and token not in STOP_WORDS]
+
+def ticket_text(title, description):
+    # The title is repeated so it counts for more than the description
+    return f'{title}\n{title}\n{description}'
+
+def _bucket(token, dims):
+    # crc32 rather than hash(), which differs between processes
+    return zlib.crc32(token.encode('utf-8')) % dims
+
+def vectorize(texts, dims):
+    """Log-scaled hashed term frequencies, one float32 row per text"""
+    matrix = np.zeros((len(texts), dims), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for token in tokenize(text):
+            matrix[row, _bucket(token, dims)] += 1
+    np.log1p(matrix, out=matrix)
+    return matrix
+
+class _Mapping:
+    """Views into one organization's index file"""
+
+    def __init__(self, path):
+        self.inode = os.stat(path).st_ino
+        self.raw = np.memmap(path, dtype=np.uint8, mode='r+')
+        self.header = self.raw[:HEADER_SLOTS * 8].view(np.int64)
+        if self.header[0] != MAGIC:
+            raise ValueError(f'{path} is not a similarity index')
+        self.dims = int(self.header[1])
+        self.capacity = int(self.header[3])
+        offset = HEADER_SLOTS * 8
+        self.df = self.raw[offset:offset + self.dims * 4].view(np.float32)
+        offset += self.dims * 4
+        self.ids = self.raw[offset:offset + self.capacity * 8].view(np.int64)
+        offset += self.capacity * 8
+        self.vectors = self.raw[offset:offset + self.capacity * self.dims * 4].view(np.float32).reshape(
+            self.capacity, self.dims)
+        # (count, idf, row norms) from the last query, see weights()
+        self._weights = (0, None, np.empty(0, dtype=np.float32))
+        self._weights_lock = threading.Lock()
+
+    @property
+    def count(self):
+        return int(self.header[2])
+
+    def weights(self, count):
+        """IDF weights and IDF-weighted row norms for the first count rows.
+
+        Computing every row norm is most of the cost of a query, so they are
+        kept between queries. Until the index grows by IDF_REFRESH_GROWTH the
+        same IDF is used and only new rows are normed; past that, both are
+        recomputed from the current document frequencies.
+        """
+        with self._weights_lock:
+            cached, idf, norms = self._weights
+            if idf is None or count > cached * (1 + IDF_REFRESH_GROWTH):
+                cached, idf = 0, np.log((1 + count) / (1 + self.df)) + 1
+                norms = np.empty(0, dtype=np.float32)
+            if count > cached:
+                idf_squared = idf * idf
+                added = [np.sqrt((block * block) @ idf_squared)
+                         for block in (self.vectors[start:min(start + QUERY_CHUNK, count)]
+                                       for start in range(cached, count, QUERY_CHUNK))]
+                norms = np.concatenate([norms[:cached], *added])
+                norms[norms == 0] = 1
+                self._weights = (count, idf, norms)
+            return idf, norms[:count]
+
+    @staticmethod
+    def size(dims, capacity):
+        return HEADER_SLOTS * 8 + dims * 4 + capacity * 8 + capacity * dims * 4
+
+    @classmethod
+    def write(cls, path, dims, capacity, ids, vectors, df, previous=None):
+        """Write a complete index to a temporary file and rename it into place.
+
+        When growing, previous is the current mapping: its rows are copied
+        ahead of ids and vectors QUERY_CHUNK rows at a time, so a large index
+        is never loaded into memory in one piece.
+        """
+        kept = previous.count if previous is not None else 0
+        count = kept + len(ids)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.truncate(cls.size(dims, capacity))
+        raw = np.memmap(tmp, dtype=np.uint8, mode='r+')
+        header = raw[:HEADER_SLOTS * 8].view(np.int64)
+        header[:4] = (MAGIC, dims, count, capacity)
+        offset = HEADER_SLOTS * 8
+        new_df = raw[offset:offset + dims * 4].view(np.float32)
+        offset += dims * 4
+        new_ids = raw[offset:offset + capacity * 8].view(np.int64)
+        offset += capacity * 8
+        new_vectors = raw[offset:offset + capacity * dims * 4].view(np.float32).reshape(capacity, dims)
+        new_df[:] = df
+        if previous is not None:
+            new_df += previous.df
+            new_ids[:kept] = previous.ids[:kept]
+            for start in range(0, kept, QUERY_CHUNK):
+                end = min(start + QUERY_CHUNK, kept)
+                new_vectors[start:end] = previous.vectors[start:end]
+        new_ids[kept:count] = ids
+        new_vectors[kept:count] = vectors
+        raw.flush()
+        del raw, header, new_df, new_ids, new_vectors
+        os.replace(tmp, path)
+
+class SimilarityIndex:
+    """Per-organization TF-IDF vectors in memory-mapped files.
+
+    add() appends tickets as they are created; query() scores a batch of
+    texts against everything in an organization's index at once. Ticket ids
+    that no longer exist are dropped by similar_tickets(), and `flask similar
+    rebuild` recreates an index from the database.
+    """
+
+    def __init__(self, app=None):
+        self.directory = None
+        self.dims = 1024
+        self._mappings = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('SIMILARITY_INDEX_DIR', os.path.join(app.instance_path, 'similarity'))
+        app.config.setdefault('SIMILARITY_DIMENSIONS', 1024)
+        app.config.setdefault('SIMILARITY_TOP_K', 5)
+        app.config.setdefault('SIMILARITY_MIN_SCORE', 0.2)
+        app.config.setdefault('SIMILARITY_GROUND_SCORE', 0.35)
+        app.config.setdefault('SIMILARITY_SKIP_SCORE', 0.9)
+        self.directory = app.config['SIMILARITY_INDEX_DIR']
+        self.dims = app.config['SIMILARITY_DIMENSIONS']
+        app.extensions['similarity_index'] = self
+
+    def path(self, organization_id):
+        return os.path.join(self.directory, f'org-{organization_id}.idx')
+
+    def _mapping(self, organization_id):
+        """Current mapping for an organization, or None if it has no index yet"""
+        path = self.path(organization_id)
+        try:
+            inode = os.stat(path).st_ino
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            mapping = self._mappings.get(organization_id)
+            if mapping is None or mapping.inode != inode:
+                mapping = self._mappings[organization_id] = _Mapping(path)
+            return mapping
+
+    def _file_lock(self, organization_id):
+        os.makedirs(self.directory, exist_ok=True)
+        return _FileLock(os.path.join(self.directory, f'org-{organization_id}.lock'))
+
+    def _build(self, organization_id):
+        """Index every ticket of an organization that has no index file yet.
+
+        Takes the file lock, so only one worker builds it; the others wait
+        and then map the finished file.
+        """
+        with self._file_lock(organization_id):
+            if self._mapping(organization_id) is None:
+                self._write_all(organization_id, organization_tickets(organization_id))
+        return self._mapping(organization_id)
+
+    def add(self, organization_id, tickets):
+        """Append (ticket_id, text) pairs to an organization's index"""
+        if not tickets:
+            return
+        with self._file_lock(organization_id):
+            mapping = self._mapping(organization_id)
+            if mapping is None:
+                # The database already has these tickets, along with every earlier one
+                self._write_all(organization_id, organization_tickets(organization_id))
+                mapping = self._mapping(organization_id)
+                indexed = set(mapping.ids[:mapping.count].tolist())
+                tickets = [(ticket_id, text) for ticket_id, text in tickets if ticket_id not in indexed]
+                if not tickets:
+                    return
+            dims = mapping.dims
+            ids = np.array([ticket_id for ticket_id, _ in tickets], dtype=np.int64)
+            vectors = vectorize([text for _, text in tickets], dims)
+            df = (vectors > 0).sum(axis=0, dtype=np.float32)
+
+            count = mapping.count
+            if count + len(ids) > mapping.capacity:
+                capacity = max(MIN_CAPACITY, (count + len(ids)) * 2)
+                _Mapping.write(self.path(organization_id), dims, capacity, ids, vectors, df, previous=mapping)
+                return
+
+            # Rows first, count last: readers never see a row that isn't written
+            mapping.ids[count:count + len(ids)] = ids
+            mapping.vectors[count:count + len(ids)] = vectors
+            mapping.df += df
+            mapping.header[2] = count + len(ids)
+            mapping.raw.flush()
+
+    def rebuild(self, organization_id, tickets):
+        """Replace an organization's index with (ticket_id, text) pairs"""
+        with self._file_lock(organization_id):
+            return self._write_all(organization_id, tickets)
+
+    def _write_all(self, organization_id, tickets):
+        """Write a new index file from (ticket_id, text) pairs; the caller holds the file lock"""
+        tickets = list(tickets)
+        ids = np.array([ticket_id for ticket_id, _ in tickets], dtype=np.int64)
+        vectors = vectorize([text for _, text in tickets], self.dims)
+        df = (vectors > 0).sum(axis=0, dtype=np.float32)
+        _Mapping.write(self.path(organization_id), self.dims, max(MIN_CAPACITY, len(ids) * 2),
+                       ids, vectors, df)
+        return len(ids)
+
+    def query(self, organization_id, texts, k=5, exclude=(), before=None, only=None):
+        """Top-k (ticket_id, score) lists for a batch of texts, by cosine similarity.
+
+        before, if given, holds one ticket id per text: only tickets with a
+        smaller id are considered for that text. only, if given, holds one
+        collection of ticket ids (or None for no limit) per text, and nothing
+        outside it is considered for that text.
+        """
+        results = [[] for _ in texts]
+        if not texts:
+            return results
+        mapping = self._mapping(organization_id) or self._build(organization_id)
+        count = mapping.count
+        if count == 0:
+            return results
+
+        # Smoothed IDF from the document frequencies
+        idf, row_norms = mapping.weights(count)
+        queries = vectorize(texts, mapping.dims) * idf
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        # (q * idf) . v / |v * idf| is the cosine with both sides IDF-weighted
+        queries = queries / norms * idf
+
+        exclude = np.array(list(exclude), dtype=np.int64)
+        want = k + len(exclude)
+        if before is not None:
+            before = np.asarray(before, dtype=np.int64)[:, None]
+        if only is not None:
+            only = [None if allowed is None else np.fromiter(allowed, dtype=np.int64) for allowed in only]
+        best_scores = np.empty((len(texts), 0), dtype=np.float32)
+        best_rows = np.empty((len(texts), 0), dtype=np.int64)
+        for start in range(0, count, QUERY_CHUNK):
+            block = mapping.vectors[start:min(start + QUERY_CHUNK, count)]
+            scores = (queries @ block.T) / row_norms[start:start + len(block)]
+            block_ids = mapping.ids[start:start + len(block)]
+            # Masked before the top-k cut, so tickets that don't qualify can't crowd out ones that do
+            if before is not None:
+                scores[block_ids >= before] = 0
+            if only is not None:
+                for i, allowed in enumerate(only):
+                    if allowed is not None:
+                        scores[i, ~np.isin(block_ids, allowed)] = 0
+            rows = np.broadcast_to(np.arange(start, start + len(block)), scores.shape)
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            best_rows = np.concatenate([best_rows, rows], axis=1)
+            if best_scores.shape[1] > want:
+                keep = np.argpartition(-best_scores, want - 1, axis=1)[:, :want]
+                best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                best_rows = np.take_along_axis(best_rows, keep, axis=1)
+
+        ids = mapping.ids[:count]
+        for i in range(len(texts)):
+            for j in np.argsort(-best_scores[i]):
+                ticket_id = int(ids[best_rows[i, j]])
+                if ticket_id in exclude or best_scores[i, j] <= 0:
+                    continue
+                results[i].append((ticket_id, float(best_scores[i, j])))
+                if len(results[i]) == k:
+                    break
+        return results
+
+    def stats(self, organization_id):
+        mapping = self._mapping(organization_id)
+        if mapping is None:
+            return {'tickets': 0, 'capacity': 0, 'dims': self.dims, 'bytes': 0}
+        return {'tickets': mapping.count, 'capacity': mapping.capacity, 'dims': mapping.dims,
+                'bytes': os.path.getsize(self.path(organization_id))}
+
+class _FileLock:
+    """Exclusive lock shared by threads in this process and by other processes"""
+    _thread_locks = {}
+    _guard = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        with self._guard:
+            self.thread_lock = self._thread_locks.setdefault(path, threading.Lock())
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        self.file = open(self.path, 'a')
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+        self.thread_lock.release()
+
+similarity_index = SimilarityIndex()
+
+def organization_tickets(organization_id):
+    """(ticket_id, text) pairs for every ticket in an organization, oldest first"""
+    rows = db.session.query(Ticket.id, Ticket.title, Ticket.description).filter(
+        Ticket.organization_id == organization_id
+    ).order_by(Ticket.id).execution_options(yield_per=5000)
+    return ((row.id, ticket_text(row.title, row.description)) for row in rows)
+
+def index_ticket(ticket):
+    """Add a newly created ticket to its organization's index"""
+    similarity_index.add(ticket.organization_id, [(ticket.id, ticket_text(ticket.title, ticket.description))])
+
+def resolutions(ticket_ids):
+    """Latest staff response per ticket, keyed by ticket id"""
+    if not ticket_ids:
+        return {}
+    rows = db.session.query(TicketResponse.ticket_id, TicketResponse.content).join(
+        User, User.id == TicketResponse.user_id
+    ).filter(
+        TicketResponse.ticket_id.in_(ticket_ids),
+        User.role.in_(('staff', 'admin'))
+    ).order_by(TicketResponse.ticket_id, TicketResponse.created_at.desc(), TicketResponse.id.desc())
+    latest = {}
+    for ticket_id, content in rows:
+        latest.setdefault(ticket_id, content)
+    return latest
+
+def similar_tickets(tickets, k=None, min_score=None, same_submitter=False):
+    """Most similar earlier tickets in the same organization, for each ticket.
+
+    Returns one list per ticket of {'ticket', 'score', 'resolution'} dicts,
+    best first; resolution is the latest staff response or None. The tickets
+    are queried as one batch per organization, with two more queries to load
+    the matches and their resolutions.
+
+    With same_submitter, each ticket only matches tickets from its own
+    submitter: the ones a regular user is allowed to see.
+    """
+    k = k or current_app.config['SIMILARITY_TOP_K']
+    min_score = current_app.config['SIMILARITY_MIN_SCORE'] if min_score is None else min_score
+    matches = [[] for _ in tickets]
+    by_organization = {}
+    for i, ticket in enumerate(tickets):
+        by_organization.setdefault(ticket.organization_id, []).append(i)
+    for organization_id, positions in by_organization.items():
+        only = None
+        if same_submitter:
+            submitted = {}
+            for submitter_id, ticket_id in db.session.query(Ticket.submitter_id, Ticket.id).filter(
+                Ticket.organization_id == organization_id,
+                Ticket.submitter_id.in_({tickets[i].submitter_id for i in positions})
+            ):
+                submitted.setdefault(submitter_id, []).append(ticket_id)
+            only = [submitted.get(tickets[i].submitter_id, []) for i in positions]
+        found = similarity_index.query(
+            organization_id,
+            [ticket_text(tickets[i].title, tickets[i].description) for i in positions],
+            # Only earlier tickets: a later one can't have helped with this one
+            k, before=[tickets[i].id for i in positions], only=only
+        )
+        for i, pairs in zip(positions, found):
+            matches[i] = [(ticket_id, score) for ticket_id, score in pairs if score >= min_score]
+
+    ids = {ticket_id for pairs in matches for ticket_id, _ in pairs}
+    if not ids:
+        return [[] for _ in tickets]
+    loaded = {ticket.id: ticket for ticket in Ticket.query.filter(Ticket.id.in_(ids))}
+    answers = resolutions(list(ids))
+    return [[{'ticket': loaded[ticket_id], 'score': round(score, 3), 'resolution': answers.get(ticket_id)}
+             for ticket_id, score in pairs
+             # Deleted or moved tickets stay in the index until the next rebuild
+             if ticket_id in loaded and loaded[ticket_id].organization_id == ticket.organization_id
+             and (not same_submitter or loaded[ticket_id].submitter_id == ticket.submitter_id)]
+            for ticket, pairs in zip(tickets, matches)]
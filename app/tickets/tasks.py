@@ -0,0 +1,42 @@
+from flask import current_app
+from app import db
+from app.jobs import job_queue
+from app.models import Ticket
+from app.tickets.routes import get_ai_suggestion
+from app.tickets.similar import similar_tickets
+
+AI_SUGGESTION_UNAVAILABLE = "Unable to generate AI suggestion at this time."
+
+def _suggestion_failed(ticket_id):
+    ticket = db.session.get(Ticket, ticket_id)
+    if ticket and not ticket.ai_suggestion:
+        ticket.ai_suggestion = AI_SUGGESTION_UNAVAILABLE
+
+def _reused_resolution(match):
+    return (f"A very similar ticket (#{match['ticket'].id}: {match['ticket'].title}) "
+            f"was resolved with: {match['resolution']}")
+
+@job_queue.handler('ai_suggestion', on_failure=_suggestion_failed)
+def generate_ai_suggestion(ticket_id):
+    """Fill in Ticket.ai_suggestion after the ticket has been created.
+
+    Earlier tickets with a staff resolution ground the completion; when the
+    closest one is a near-duplicate of a closed ticket its resolution is
+    reused and OpenAI isn't called at all. The suggestion is shown to the
+    submitter, so unless they are staff only their own tickets are used.
+    """
+    ticket = db.session.get(Ticket, ticket_id)
+    if ticket is None:
+        return  # Deleted before the job ran
+    own_only = ticket.submitter is None or not ticket.submitter.is_staff
+    resolved = [match for match in similar_tickets([ticket], same_submitter=own_only)[0]
+                if match['resolution'] and match['score'] >= current_app.config['SIMILARITY_GROUND_SCORE']]
+    if resolved and resolved[0]['score'] >= current_app.config['SIMILARITY_SKIP_SCORE'] \
+            and resolved[0]['ticket'].status == 'closed':
+        ticket.ai_suggestion = _reused_resolution(resolved[0])
+    else:
+        ticket.ai_suggestion = get_ai_suggestion(
+            ticket.title, ticket.description,
+            [(match['ticket'].title, match['resolution']) for match in resolved]
+        )
+    db.session.commit()
@@ -0,0 +1,213 @@
+"""Compare gunicorn worker settings under load on the ticket list, dashboard
+and ticket creation.
+
+Seeds a database, then for each configuration starts
+`gunicorn -c gunicorn.conf.py run:app` with that configuration's
+environment, logs in a number of concurrent clients and has them request
+/tickets/, /dashboard and /tickets/create for a fixed time:
+
+    python benchmark_gunicorn.py
+    python benchmark_gunicorn.py --clients 32 --duration 30 \\
+        --config sync:WEB_CONCURRENCY=4 \\
+        --config gthread:WEB_CONCURRENCY=2,GUNICORN_THREADS=16 \\
+        --config gevent:WEB_CONCURRENCY=2,GUNICORN_WORKER_CONNECTIONS=100
+    python benchmark_gunicorn.py --database-url postgresql://localhost/gunicorn_bench
+
+Without --database-url a temporary SQLite file is used, where concurrent
+ticket creation is limited by SQLite's single writer; use PostgreSQL to
+compare settings for production. The database must be empty.
+"""
+from app import create_app, db
+from app.models import Organization, SubscriptionPlan, User, Ticket
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+import argparse
+import os
+import random
+import re
+import requests
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+DEFAULT_CONFIGS = [
+    'sync:GUNICORN_WORKER_CLASS=sync,WEB_CONCURRENCY=4',
+    'gthread:GUNICORN_WORKER_CLASS=gthread,WEB_CONCURRENCY=2,GUNICORN_THREADS=8',
+    'gevent:GUNICORN_WORKER_CLASS=gevent,WEB_CONCURRENCY=2,GUNICORN_WORKER_CONNECTIONS=100',
+]
+# (name, weight)
+ENDPOINTS = [('list', 45), ('dashboard', 45), ('create', 10)]
+CSRF_PATTERN = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+PASSWORD = 'password'
+
+class BenchmarkConfig(Config):
+    TESTING = True
+    JOB_WORKERS = 0
+    MAIL_WORKERS = 0
+
+def seed(ticket_count, user_count):
+    """Organization with staff and regular users and their tickets; returns the login emails"""
+    rng = random.Random(1)
+    plan = SubscriptionPlan(name='Benchmark', price=0, team_size_limit=1000, features=[])
+    db.session.add(plan)
+    db.session.flush()
+    org = Organization(name='Benchmark', domain='bench.example.com', subscription_plan_id=plan.id)
+    db.session.add(org)
+    db.session.flush()
+    users = []
+    for i in range(user_count):
+        user = User(username=f'bench{i}', email=f'bench{i}@bench.example.com',
+                    role='staff' if i % 4 == 0 else 'user', organization_id=org.id)
+        user.set_password(PASSWORD)
+        users.append(user)
+    db.session.add_all(users)
+    db.session.flush()
+    staff = [user for user in users if user.role == 'staff']
+    for i in range(ticket_count):
+        db.session.add(Ticket(
+            title=f'Benchmark ticket {i}', description='Something is broken',
+            status=rng.choice(['open', 'in_progress', 'closed']), priority=rng.choice(['low', 'medium', 'high']),
+            category='general', organization_id=org.id, submitter_id=rng.choice(users).id,
+            assignee_id=rng.choice(staff).id
+        ))
+    db.session.commit()
+    return [user.email for user in users]
+
+def parse_config(spec):
+    name, _, assignments = spec.partition(':')
+    env = dict(item.split('=', 1) for item in assignments.split(',') if item)
+    return name, env
+
+def csrf_token(session, url):
+    match = CSRF_PATTERN.search(session.get(url).text)
+    if not match:
+        raise RuntimeError(f'No CSRF token on {url}')
+    return match.group(1)
+
+def start_server(env, base_url):
+    server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'run:app'], env=env,
+                              stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with status {server.returncode}')
+        try:
+            requests.get(f'{base_url}/auth/login', timeout=5)
+            return server
+        except requests.RequestException:
+            # Listening, but the workers may still be importing the app
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError('gunicorn did not start within 60 seconds')
+
+def run_client(base_url, email, deadline, seed):
+    """Requests until the deadline; returns {endpoint: [latency ms]} and an error count"""
+    rng = random.Random(seed)
+    session = requests.Session()
+    session.post(f'{base_url}/auth/login', data={
+        'csrf_token': csrf_token(session, f'{base_url}/auth/login'), 'email': email, 'password': PASSWORD
+    })
+    names = [name for name, _ in ENDPOINTS]
+    weights = [weight for _, weight in ENDPOINTS]
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    while time.monotonic() < deadline:
+        name = rng.choices(names, weights)[0]
+        started = time.perf_counter()
+        try:
+            if name == 'list':
+                response = session.get(f'{base_url}/tickets/')
+            elif name == 'dashboard':
+                response = session.get(f'{base_url}/dashboard')
+            else:
+                # Includes loading the form for its CSRF token, as a browser would
+                response = session.post(f'{base_url}/tickets/create', allow_redirects=False, data={
+                    'csrf_token': csrf_token(session, f'{base_url}/tickets/create'),
+                    'title': f'Load test ticket {rng.randrange(10 ** 6)}',
+                    'description': 'Created by benchmark_gunicorn.py',
+                    'priority': 'low', 'category': 'general'
+                })
+            # A created ticket redirects to its page; anything else is a failed form
+            ok = response.status_code == 302 if name == 'create' else \
+                response.status_code == 200 and not response.history
+        except requests.RequestException:
+            ok = False
+        latencies[name].append((time.perf_counter() - started) * 1000)
+        errors[name] += not ok
+    return latencies, errors
+
+def percentile(values, fraction):
+    return sorted(values)[min(len(values) - 1, int(len(values) * fraction))]
+
+def benchmark(name, config_env, args, emails, database_url, workdir):
+    base_url = f'http://127.0.0.1:{args.port}'
+    env = {
+        **os.environ,
+        'GUNICORN_WORKER_CLASS': 'gthread',
+        **config_env,
+        'PORT': str(args.port),
+        'DATABASE_URL': database_url,
+        'SESSION_COOKIE_SECURE': 'false',
+        'REMEMBER_COOKIE_SECURE': 'false',
+        'JOB_WORKERS': '0',
+        'MAIL_WORKERS': '0',
+        'LOG_LEVEL': 'WARNING',
+        'SIMILARITY_INDEX_DIR': os.path.join(workdir, 'similarity'),
+        'PROMETHEUS_MULTIPROC_DIR': os.path.join(workdir, 'metrics'),
+        'OPENAI_API_KEY': os.environ.get('OPENAI_API_KEY') or 'sk-benchmark',
+    }
+    server = start_server(env, base_url)
+    try:
+        deadline = time.monotonic() + args.duration
+        with ThreadPoolExecutor(max_workers=args.clients) as pool:
+            results = list(pool.map(lambda i: run_client(base_url, emails[i % len(emails)], deadline, i),
+                                    range(args.clients)))
+    finally:
+        server.terminate()
+        server.wait()
+
+    for endpoint, _ in ENDPOINTS:
+        latencies = [ms for client_latencies, _ in results for ms in client_latencies[endpoint]]
+        errors = sum(client_errors[endpoint] for _, client_errors in results)
+        if not latencies:
+            continue
+        print(f'{name:10} {endpoint:10} {len(latencies):7} {len(latencies) / args.duration:8.1f} '
+              f'{statistics.median(latencies):8.1f} {percentile(latencies, 0.95):8.1f} '
+              f'{percentile(latencies, 0.99):8.1f} {errors:7}')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--config', action='append', metavar='NAME:VAR=VALUE,...',
+                        help='environment for one run; repeat to compare (default: sync, gthread, gevent)')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20, help='seconds per configuration')
+    parser.add_argument('--tickets', type=int, default=2000)
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--database-url')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    BenchmarkConfig.SQLALCHEMY_DATABASE_URI = database_url
+    app = create_app(BenchmarkConfig)
+    try:
+        with app.app_context():
+            db.create_all()
+            emails = seed(args.tickets, args.users)
+            db.engine.dispose()
+        print(f'{args.tickets} tickets, {args.users} users, {args.clients} clients, {args.duration:g}s per configuration')
+        print(f'{"config":10} {"endpoint":10} {"requests":>7} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} '
+              f'{"p99 ms":>8} {"errors":>7}')
+        for spec in args.config or DEFAULT_CONFIGS:
+            name, config_env = parse_config(spec)
+            benchmark(name, config_env, args, emails, database_url, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
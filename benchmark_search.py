@@ -0,0 +1,155 @@
+"""Measure /tickets/search latency on a large generated data set.
+
+Creates the schema in an empty database, loads generated tickets and
+responses, then times search_tickets() for a mix of common, rare, multi-term
+and prefix queries:
+
+    python benchmark_search.py --tickets 100000
+    python benchmark_search.py --tickets 1000000
+    python benchmark_search.py --tickets 1000000 --database-url postgresql://localhost/search_bench
+
+Without --database-url a temporary SQLite file is used (FTS5); with a
+PostgreSQL URL the tsvector/GIN path is measured. The database must be empty.
+"""
+from app import create_app, db
+from app.models import Organization, SubscriptionPlan, User, Ticket, TicketResponse
+from app.tickets.search import search_tickets
+from config import Config
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+WORDS = ('printer network email password login vpn laptop monitor keyboard mouse wifi server '
+         'outlook calendar teams zoom license install update crash slow error timeout disk '
+         'backup restore permission access account locked reset phone headset camera driver '
+         'battery charger screen display blue freeze reboot browser chrome firefox certificate '
+         'proxy firewall dns dhcp router switch cable port sharepoint onedrive excel word sync '
+         'quota storage database query report dashboard invoice billing payment refund order '
+         'shipping delivery tracking mobile android iphone tablet app notification push token').split()
+RARE_WORD = 'zebracorn'
+BATCH = 5000
+
+class BenchmarkConfig(Config):
+    TESTING = True
+    JOB_WORKERS = 0
+    MAIL_WORKERS = 0
+
+def sentence(rng, weights, length):
+    return ' '.join(rng.choices(WORDS, weights=weights, k=length))
+
+def load(ticket_count, responses_per_ticket, seed):
+    """Insert the data set with multi-row inserts; returns (org_id, submitter_id)"""
+    rng = random.Random(seed)
+    # Zipf-like word frequencies, so some terms are common and some are rare
+    weights = [1 / (rank + 1) for rank in range(len(WORDS))]
+
+    plan = SubscriptionPlan(name='Benchmark', price=0, team_size_limit=1000, features=[])
+    db.session.add(plan)
+    db.session.flush()
+    org = Organization(name='Benchmark', domain='bench.example.com', subscription_plan_id=plan.id)
+    db.session.add(org)
+    db.session.flush()
+    users = [User(username=f'bench{i}', email=f'bench{i}@bench.example.com',
+                  role='staff' if i < 5 else 'user', organization_id=org.id) for i in range(50)]
+    db.session.add_all(users)
+    db.session.commit()
+    user_ids = [user.id for user in users]
+
+    started = time.perf_counter()
+    base = datetime.utcnow() - timedelta(days=365)
+    next_id = 1
+    for offset in range(0, ticket_count, BATCH):
+        tickets = []
+        for i in range(offset, min(offset + BATCH, ticket_count)):
+            description = sentence(rng, weights, rng.randint(12, 60))
+            if rng.random() < 0.001:
+                description += f' {RARE_WORD}'
+            created = base + timedelta(seconds=i * 30)
+            tickets.append({
+                'id': next_id, 'title': sentence(rng, weights, rng.randint(3, 8)),
+                'description': description, 'status': rng.choice(['open', 'in_progress', 'closed']),
+                'priority': rng.choice(['low', 'medium', 'high']), 'category': 'General',
+                'created_at': created, 'updated_at': created, 'organization_id': org.id,
+                'submitter_id': rng.choice(user_ids[5:]), 'assignee_id': rng.choice(user_ids[:5])
+            })
+            next_id += 1
+        db.session.execute(insert(Ticket.__table__), tickets)
+        responses = [{
+            'content': sentence(rng, weights, rng.randint(8, 40)), 'ticket_id': ticket['id'],
+            'user_id': ticket['assignee_id'], 'created_at': ticket['created_at']
+        } for ticket in tickets for _ in range(responses_per_ticket)]
+        if responses:
+            db.session.execute(insert(TicketResponse.__table__), responses)
+        db.session.commit()
+        print(f'\r  loaded {offset + len(tickets):,} tickets', end='', flush=True)
+    print(f' in {time.perf_counter() - started:.1f}s')
+    return org.id, user_ids[5]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tickets', type=int, default=100000)
+    parser.add_argument('--responses-per-ticket', type=int, default=1)
+    parser.add_argument('--runs', type=int, default=20, help='timed runs per query')
+    parser.add_argument('--database-url', help='empty database to use; a temporary SQLite file by default')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    path = None
+    if args.database_url:
+        BenchmarkConfig.SQLALCHEMY_DATABASE_URI = args.database_url
+    else:
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        BenchmarkConfig.SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+
+    app = create_app(BenchmarkConfig)
+    try:
+        with app.app_context():
+            db.create_all()
+            if Ticket.query.first() is not None:
+                print('The database already has tickets; point --database-url at an empty one.')
+                return 1
+            print(f'{db.engine.dialect.name}: {args.tickets:,} tickets, '
+                  f'{args.responses_per_ticket} response(s) each')
+            org_id, submitter_id = load(args.tickets, args.responses_per_ticket, args.seed)
+            if db.engine.dialect.name == 'postgresql':
+                db.session.execute(db.text('ANALYZE tickets'))
+                db.session.execute(db.text('ANALYZE ticket_responses'))
+                db.session.commit()
+
+            # (label, query, submitter_id, page)
+            cases = [
+                ('common term', WORDS[0], None, 1),
+                ('mid-frequency term', WORDS[40], None, 1),
+                ('rare term', RARE_WORD, None, 1),
+                ('two terms', f'{WORDS[1]} {WORDS[7]}', None, 1),
+                ('prefix', WORDS[10][:4], None, 1),
+                ('common term, page 10', WORDS[0], None, 10),
+                ('common term, own tickets', WORDS[0], submitter_id, 1),
+                ('no match', 'qqqqxz', None, 1),
+            ]
+            print(f'{"query":28} {"results":>7} {"p50 ms":>8} {"p95 ms":>8} {"max ms":>8}')
+            for label, query, submitter, page in cases:
+                timings = []
+                for _ in range(args.runs):
+                    started = time.perf_counter()
+                    results, _ = search_tickets(query, org_id, submitter, page=page, per_page=25)
+                    timings.append((time.perf_counter() - started) * 1000)
+                    db.session.remove()
+                timings.sort()
+                p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+                print(f'{label:28} {len(results):>7} {statistics.median(timings):>8.1f} '
+                      f'{p95:>8.1f} {timings[-1]:>8.1f}')
+        return 0
+    finally:
+        if path:
+            os.remove(path)
+
+if __name__ == '__main__':
+    sys.exit(main())
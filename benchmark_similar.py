@@ -0,0 +1,79 @@
+"""Measure the similar-ticket index on a large generated organization.
+
+Builds an index of generated tickets in a temporary directory, then times
+single appends and batched top-k queries:
+
+    python benchmark_similar.py --tickets 100000
+    python benchmark_similar.py --tickets 100000 --batch 32 --dims 2048
+
+No database is needed; the index is exercised directly.
+"""
+from app.tickets.similar import SimilarityIndex, ticket_text
+import argparse
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+WORDS = ('printer network email password login vpn laptop monitor keyboard mouse wifi server '
+         'outlook calendar teams zoom license install update crash slow error timeout disk '
+         'backup restore permission access account locked reset phone headset camera driver '
+         'battery charger screen display blue freeze reboot browser chrome firefox certificate '
+         'proxy firewall dns dhcp router switch cable port sharepoint onedrive excel word sync').split()
+
+def sentence(rng, weights, length):
+    return ' '.join(rng.choices(WORDS, weights=weights, k=length))
+
+def percentiles(timings):
+    timings = sorted(timings)
+    return statistics.median(timings), timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tickets', type=int, default=100000)
+    parser.add_argument('--dims', type=int, default=1024)
+    parser.add_argument('--batch', type=int, default=16, help='texts per batched query')
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    weights = [1 / (rank + 1) for rank in range(len(WORDS))]
+    directory = tempfile.mkdtemp()
+    index = SimilarityIndex()
+    index.directory, index.dims = directory, args.dims
+    try:
+        started = time.perf_counter()
+        index.rebuild(1, ((i, ticket_text(sentence(rng, weights, 5), sentence(rng, weights, 30)))
+                          for i in range(1, args.tickets + 1)))
+        stats = index.stats(1)
+        print(f"rebuild: {stats['tickets']:,} tickets, {stats['bytes'] / 2 ** 20:.0f} MiB "
+              f"in {time.perf_counter() - started:.1f}s")
+
+        timings = []
+        for i in range(args.runs):
+            started = time.perf_counter()
+            index.add(1, [(args.tickets + i + 1, ticket_text(sentence(rng, weights, 5), sentence(rng, weights, 30)))])
+            timings.append((time.perf_counter() - started) * 1000)
+        print('append 1:        p50 {:.2f} ms  p95 {:.2f} ms'.format(*percentiles(timings)))
+
+        for batch in sorted({1, args.batch}):
+            timings = []
+            for _ in range(args.runs):
+                texts = [sentence(rng, weights, 30) for _ in range(batch)]
+                started = time.perf_counter()
+                index.query(1, texts, args.k)
+                timings.append((time.perf_counter() - started) * 1000)
+            p50, p95 = percentiles(timings)
+            print(f'query x{batch:<3}       p50 {p50:.1f} ms  p95 {p95:.1f} ms  '
+                  f'({p50 / batch:.1f} ms per text)')
+        return 0
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""Fail when a route's SQL statement count grows past its budget.
+
+Seeds an in-memory SQLite database, requests each route as staff and as a
+regular user, and counts the statements issued. The seed is run at two sizes
+so a count that grows with the number of tickets or responses (an N+1) is
+reported even if it still fits the budget:
+
+    python check_query_counts.py
+"""
+from app import create_app, db
+from app.models import Organization, SubscriptionPlan, User, Ticket, TicketResponse
+from app.query_counter import count_queries
+from config import Config
+import sys
+
+class QueryCountConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+    WTF_CSRF_ENABLED = False
+    SESSION_COOKIE_SECURE = False
+    REMEMBER_COOKIE_SECURE = False
+    JOB_WORKERS = 0  # Worker polling would show up in the counts
+    MAIL_WORKERS = 0
+
+# (login email, url, max statements)
+ROUTE_BUDGETS = [
+    ('staff@example.com', '/', 3),
+    ('staff@example.com', '/dashboard', 3),
+    ('staff@example.com', '/tickets/', 2),
+    ('staff@example.com', '/tickets/filter', 2),
+    ('staff@example.com', '/tickets/filter?filters=high_priority&filters=needs_response', 2),
+    ('staff@example.com', '/tickets/filter?filters=needs_response&filters=high_priority', 2),
+    ('staff@example.com', '/tickets/1', 3),
+    ('user@example.com', '/', 3),
+    ('user@example.com', '/tickets/', 2),
+    ('user@example.com', '/tickets/1', 3),
+]
+
+def seed(ticket_count, responses_per_ticket):
+    plan = SubscriptionPlan(name='Free', price=0, team_size_limit=50, features=[])
+    db.session.add(plan)
+    db.session.flush()
+    org = Organization(name='Example', domain='example.com', subscription_plan_id=plan.id)
+    db.session.add(org)
+    db.session.flush()
+
+    users = []
+    for name, role in [('staff', 'staff'), ('user', 'user'), ('admin', 'admin')]:
+        user = User(username=name, email=f'{name}@example.com', role=role, organization_id=org.id)
+        user.set_password('password')
+        users.append(user)
+    db.session.add_all(users)
+    db.session.flush()
+    staff, user, admin = users
+
+    for i in range(ticket_count):
+        ticket = Ticket(title=f'Ticket {i}', description='Something is broken',
+                        status='open' if i % 2 else 'closed', priority='high' if i % 3 == 0 else 'low',
+                        organization_id=org.id, submitter_id=user.id,
+                        assignee_id=staff.id if i % 2 else admin.id)
+        db.session.add(ticket)
+        db.session.flush()
+        for j in range(responses_per_ticket):
+            db.session.add(TicketResponse(content='Response', ticket_id=ticket.id,
+                                          user_id=users[j % len(users)].id))
+    db.session.commit()
+
+def measure(ticket_count, responses_per_ticket):
+    """Statement count for every route at one data size"""
+    app = create_app(QueryCountConfig)
+    counts = {}
+    with app.app_context():
+        db.create_all()
+        seed(ticket_count, responses_per_ticket)
+        engine = db.engine
+
+    # Requests run outside the seeding context so each gets a fresh session,
+    # just like in production
+    for email in sorted({email for email, _, _ in ROUTE_BUDGETS}):
+        client = app.test_client()
+        client.post('/auth/login', data={'email': email, 'password': 'password'})
+        for login_email, url, _ in ROUTE_BUDGETS:
+            if login_email != email:
+                continue
+            with count_queries(engine) as counter:
+                response = client.get(url)
+            if response.status_code != 200:
+                raise RuntimeError(f'{url} as {email} returned {response.status_code}')
+            counts[(email, url)] = counter.count
+    return counts
+
+def main():
+    small = measure(ticket_count=3, responses_per_ticket=1)
+    large = measure(ticket_count=40, responses_per_ticket=4)
+    failures = 0
+    for email, url, budget in ROUTE_BUDGETS:
+        key = (email, url)
+        problems = []
+        if large[key] > budget:
+            problems.append(f'over budget of {budget}')
+        if large[key] != small[key]:
+            problems.append(f'grows with data ({small[key]} -> {large[key]})')
+        status = 'FAIL' if problems else 'OK'
+        failures += bool(problems)
+        print(f'  {status:5} {email:20} {url}: {large[key]} statements {"; ".join(problems)}')
+    print(f'{failures} route(s) failed their query budget.')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""Check that dashboards and ticket lists read from the replica, except right
+after the user has written.
+
+Two SQLite files stand in for the primary and a lagging replica: the replica
+only catches up when replicate() copies the primary over it.
+
+    python check_read_replica.py
+"""
+from app import create_app, db
+from app.models import Organization, SubscriptionPlan, User, Ticket
+from config import Config
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+STICKY_SECONDS = 0.5
+
+class ReplicaConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    SESSION_COOKIE_SECURE = False
+    REMEMBER_COOKIE_SECURE = False
+    JOB_WORKERS = 0
+    MAIL_WORKERS = 0
+    DB_REPLICA_STICKY_SECONDS = STICKY_SECONDS
+
+def seed():
+    plan = SubscriptionPlan(name='Free', price=0, team_size_limit=50, features=[])
+    db.session.add(plan)
+    db.session.flush()
+    org = Organization(name='Example', domain='example.com', subscription_plan_id=plan.id)
+    db.session.add(org)
+    db.session.flush()
+    staff = User(username='staff', email='staff@example.com', role='staff', organization_id=org.id)
+    staff.set_password('password')
+    db.session.add(staff)
+    db.session.flush()
+    db.session.add(Ticket(title='Replicated ticket', description='Something is broken', priority='low',
+                          organization_id=org.id, submitter_id=staff.id))
+    db.session.commit()
+
+def main():
+    workdir = tempfile.mkdtemp()
+    primary = os.path.join(workdir, 'primary.db')
+    replica = os.path.join(workdir, 'replica.db')
+    ReplicaConfig.SQLALCHEMY_DATABASE_URI = f'sqlite:///{primary}'
+    ReplicaConfig.DATABASE_REPLICA_URL = f'sqlite:///{replica}'
+    app = create_app(ReplicaConfig)
+
+    def replicate():
+        with app.app_context():
+            db.engines['replica'].dispose()
+        shutil.copyfile(primary, replica)
+
+    def listed_titles(client):
+        response = client.get('/tickets/filter')
+        return {ticket['title'] for ticket in response.get_json()['tickets']}
+
+    failures = 0
+
+    def check(name, ok):
+        nonlocal failures
+        failures += not ok
+        print(f'  {"OK" if ok else "FAIL":5} {name}')
+
+    try:
+        with app.app_context():
+            db.create_all()
+            seed()
+        replicate()
+
+        client = app.test_client()
+        client.post('/auth/login', data={'email': 'staff@example.com', 'password': 'password'})
+
+        for url in ('/', '/dashboard', '/tickets/'):
+            check(f'{url} renders from the replica', client.get(url).status_code == 200)
+        check('filter lists replicated tickets', 'Replicated ticket' in listed_titles(client))
+
+        # A write the replica hasn't seen yet, from another browser
+        other = app.test_client()
+        other.post('/auth/login', data={'email': 'staff@example.com', 'password': 'password'})
+        other.post('/tickets/create', data={'title': 'Lagging ticket', 'description': 'Not replicated yet',
+                                            'priority': 'low', 'category': 'general'})
+        check('other browsers read the lagging replica', 'Lagging ticket' not in listed_titles(client))
+        check('the writer reads its own write from the primary', 'Lagging ticket' in listed_titles(other))
+        check('ticket view always reads the primary',
+              b'Lagging ticket' in client.get('/tickets/2').data)
+
+        time.sleep(STICKY_SECONDS)
+        check('the writer goes back to the replica', 'Lagging ticket' not in listed_titles(other))
+        replicate()
+        check('the write shows once replicated', 'Lagging ticket' in listed_titles(client))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f'{failures} check(s) failed.')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
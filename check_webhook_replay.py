@@ -0,0 +1,129 @@
+"""Check that replayed Stripe webhooks change state exactly once.
+
+Signs a checkout.session.completed event, posts it to /admin/webhook from many
+threads at once, then lets several job workers race to apply it. Stripe
+retries deliveries it thinks failed, so this is the normal case, not a
+corner case:
+
+    python check_webhook_replay.py
+"""
+from app import create_app, db
+from app.billing import process_webhook_event
+from app.jobs import job_queue
+from app.models import Organization, SubscriptionPlan, Subscription, ProcessedWebhookEvent, Job
+from concurrent.futures import ThreadPoolExecutor
+from config import Config
+import hashlib
+import hmac
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+DELIVERIES = 20
+WORKERS = 4
+
+class ReplayConfig(Config):
+    TESTING = True
+    WTF_CSRF_ENABLED = False
+    JOB_WORKERS = 0  # Workers are started by hand below
+    MAIL_WORKERS = 0
+    STRIPE_WEBHOOK_SECRET = 'whsec_replay_check'
+
+def sign(payload, secret):
+    """Stripe-Signature header for a payload, as Stripe computes it"""
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return f't={timestamp},v1={signature}'
+
+def main():
+    # A file database, so the threads really share it
+    fd, path = tempfile.mkstemp(suffix='.db')
+    os.close(fd)
+    ReplayConfig.SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+    app = create_app(ReplayConfig)
+    try:
+        with app.app_context():
+            db.create_all()
+            plan = SubscriptionPlan(name='Pro', price=20, team_size_limit=10, features=[])
+            org = Organization(name='Example', domain='example.com')
+            db.session.add_all([plan, org])
+            db.session.commit()
+            org_id, plan_id = org.id, plan.id
+
+        payload = json.dumps({
+            'id': 'evt_replay_check',
+            'object': 'event',
+            'type': 'checkout.session.completed',
+            'created': int(time.time()),
+            'data': {'object': {
+                'id': 'cs_test_replay',
+                'object': 'checkout.session',
+                'customer': 'cus_replay',
+                'subscription': 'sub_replay',
+                'metadata': {'organization_id': str(org_id), 'plan_id': str(plan_id)}
+            }}
+        })
+
+        def deliver(_):
+            headers = {'Stripe-Signature': sign(payload, ReplayConfig.STRIPE_WEBHOOK_SECRET),
+                       'Content-Type': 'application/json'}
+            return app.test_client().post('/admin/webhook', data=payload, headers=headers).get_json()['status']
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            statuses = list(pool.map(deliver, range(DELIVERIES)))
+        elapsed = time.perf_counter() - started
+        print(f'{DELIVERIES} deliveries acknowledged in {elapsed * 1000:.0f} ms: '
+              f'{statuses.count("queued")} queued, {statuses.count("duplicate")} duplicate')
+
+        # Several workers drain the queue while others apply the event
+        # directly, as a stale-job reclaim would
+        stop = threading.Event()
+        workers = [threading.Thread(target=job_queue.work, args=(stop,)) for _ in range(WORKERS)]
+        for worker in workers:
+            worker.start()
+
+        def apply_directly(_):
+            with app.app_context():
+                try:
+                    process_webhook_event('evt_replay_check')
+                except Exception:
+                    db.session.rollback()
+        with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+            list(pool.map(apply_directly, range(WORKERS)))
+
+        deadline = time.monotonic() + 10
+        with app.app_context():
+            while time.monotonic() < deadline and Job.query.filter(Job.status.in_(['pending', 'running'])).count():
+                db.session.remove()
+                time.sleep(0.1)
+        stop.set()
+        job_queue.wake()
+        for worker in workers:
+            worker.join()
+
+        with app.app_context():
+            events = ProcessedWebhookEvent.query.all()
+            subscriptions = Subscription.query.filter_by(organization_id=org_id).count()
+            org = db.session.get(Organization, org_id)
+            checks = [
+                ('one queued delivery', statuses.count('queued') == 1),
+                ('one stored event', len(events) == 1),
+                ('event processed', bool(events) and events[0].status == 'processed'),
+                ('one subscription created', subscriptions == 1),
+                ('organization linked to Stripe', org.stripe_subscription_id == 'sub_replay'),
+            ]
+        failures = 0
+        for name, ok in checks:
+            failures += not ok
+            print(f'  {"OK" if ok else "FAIL":5} {name}')
+        print(f'{failures} check(s) failed.')
+        return 1 if failures else 0
+    finally:
+        os.remove(path)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -15,6 +15,12 @@ class Config:
     MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER')
     MAIL_MAX_EMAILS = 10
     MAIL_TIMEOUT = 10  # seconds
+    # Outbound mail queue; for local testing point MAIL_SERVER/MAIL_PORT at a
+    # debugging SMTP server such as `python -m smtpd -n -c DebuggingServer localhost:1025`
+    MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS', '1'))
+    MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE', '20'))
+    MAIL_POLL_INTERVAL = float(os.environ.get('MAIL_POLL_INTERVAL', '5'))
+    MAIL_MAX_ATTEMPTS = int(os.environ.get('MAIL_MAX_ATTEMPTS', '5'))
     
     # Database configuration
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
@@ -24,10 +30,50 @@ class Config:
     
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Connection pool per process (app/database.py); pool size and overflow
+    # don't apply to SQLite. Keep workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW)
+    # under the server's max_connections.
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '5'))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '10'))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '30'))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+    DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'true').lower() in ['true', 'on', '1']
+    # PostgreSQL only: server-side statement_timeout (0 = none), the name shown
+    # in pg_stat_activity, and, with the psycopg 3 driver
+    # (postgresql+psycopg://), executions before a statement is prepared
+    DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', '30000'))
+    DB_APPLICATION_NAME = os.environ.get('DB_APPLICATION_NAME', 'helpdesk')
+    DB_PREPARE_THRESHOLD = int(os.environ['DB_PREPARE_THRESHOLD']) if os.environ.get('DB_PREPARE_THRESHOLD') else None
+    # Optional read replica, registered as the "replica" bind and used by the
+    # dashboard and ticket list views; after committing a write a user reads
+    # from the primary for DB_REPLICA_STICKY_SECONDS (set it above the
+    # replica's usual lag)
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+    DB_REPLICA_STICKY_SECONDS = float(os.environ.get('DB_REPLICA_STICKY_SECONDS', '5'))
+    
+    # Seconds to reuse a loaded user/organization/plan across requests in one
+    # process (0 = load once per request)
+    IDENTITY_CACHE_TTL = float(os.environ.get('IDENTITY_CACHE_TTL', '0'))
+    
+    # Ticket listing page size (tickets.index and tickets.filter_tickets)
+    TICKETS_PER_PAGE = int(os.environ.get('TICKETS_PER_PAGE', '25'))
+    # round_robin (rotate through staff) or least_open (fewest open assigned tickets)
+    TICKET_ASSIGNMENT_STRATEGY = os.environ.get('TICKET_ASSIGNMENT_STRATEGY', 'round_robin')
+    # /tickets/search ranks at most this many of the newest matching tickets,
+    # which bounds the cost of very common terms
+    SEARCH_MAX_CANDIDATES = int(os.environ.get('SEARCH_MAX_CANDIDATES', '5000'))
+    
     # Stripe configuration
     STRIPE_PUBLIC_KEY = os.environ.get('STRIPE_PUBLIC_KEY')
     STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY')
     STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
+    # Override the Stripe API host, e.g. http://localhost:12111 for fake_stripe.py
+    STRIPE_API_BASE = os.environ.get('STRIPE_API_BASE')
+    # Seconds per Stripe HTTP request; keep it under GUNICORN_TIMEOUT
+    STRIPE_TIMEOUT = float(os.environ.get('STRIPE_TIMEOUT', '20'))
+    # Outbox retries: 20 attempts, waits doubling up to an hour, span about 9 hours
+    STRIPE_CALL_MAX_ATTEMPTS = int(os.environ.get('STRIPE_CALL_MAX_ATTEMPTS', '20'))
+    STRIPE_CALL_MAX_BACKOFF = int(os.environ.get('STRIPE_CALL_MAX_BACKOFF', '3600'))
     
     # Session configuration
     SESSION_TYPE = 'filesystem'
@@ -35,6 +81,63 @@ class Config:
     # OpenAI configuration
     OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY', '')
     
+    # Background job queue (AI suggestions); set JOB_WORKERS=0 to run jobs
+    # only from a separate `flask jobs work` process
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', '2'))
+    JOB_POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', '2'))
+    JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '3'))
+    
+    # `flask maintenance run`: rows per batch (one transaction each), seconds
+    # to pause between batches, and how long closed rows are kept
+    MAINTENANCE_BATCH_SIZE = int(os.environ.get('MAINTENANCE_BATCH_SIZE', '500'))
+    MAINTENANCE_BATCH_PAUSE = float(os.environ.get('MAINTENANCE_BATCH_PAUSE', '0.1'))
+    MAINTENANCE_INVITATION_RETENTION_DAYS = int(os.environ.get('MAINTENANCE_INVITATION_RETENTION_DAYS', '30'))
+    MAINTENANCE_SUBSCRIPTION_RETENTION_DAYS = int(os.environ.get('MAINTENANCE_SUBSCRIPTION_RETENTION_DAYS', '90'))
+    MAINTENANCE_JOB_RETENTION_DAYS = int(os.environ.get('MAINTENANCE_JOB_RETENTION_DAYS', '14'))
+    
+    # Logging: JSON lines (or LOG_FORMAT=text) on stdout through a background
+    # thread. LOG_LEVELS sets levels per logger, e.g.
+    # "app.email=DEBUG,httpx=WARNING"; only this fraction of DEBUG records
+    # is kept
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    LOG_LEVELS = os.environ.get('LOG_LEVELS', '')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+    LOG_DEBUG_SAMPLE_RATE = float(os.environ.get('LOG_DEBUG_SAMPLE_RATE', '0.1'))
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+    
+    # Per-request timing: Server-Timing header, per-endpoint histograms and a
+    # warning with the request's SQL when it takes longer than SLOW_REQUEST_MS.
+    # Set INSTRUMENTATION_TOKEN to read the histograms at /_timings
+    INSTRUMENTATION_ENABLED = os.environ.get('INSTRUMENTATION_ENABLED', 'True').lower() == 'true'
+    SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER', 'True').lower() == 'true'
+    SLOW_REQUEST_MS = float(os.environ.get('SLOW_REQUEST_MS', '1000'))
+    SLOW_REQUEST_STATEMENTS = int(os.environ.get('SLOW_REQUEST_STATEMENTS', '10'))
+    INSTRUMENTATION_TOKEN = os.environ.get('INSTRUMENTATION_TOKEN')
+    
+    # Prometheus metrics at /metrics, served only when METRICS_TOKEN is set;
+    # scrapers must send "Authorization: Bearer <token>". Under gunicorn the
+    # workers share PROMETHEUS_MULTIPROC_DIR (see gunicorn.conf.py)
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True').lower() == 'true'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    
+    # Similar-ticket index: one memory-mapped TF-IDF file per organization
+    # (rebuild with `flask similar rebuild` after changing the dimensions).
+    # Matches above GROUND_SCORE are given to the AI suggestion; a closed
+    # ticket above SKIP_SCORE has its resolution reused without calling OpenAI
+    SIMILARITY_INDEX_DIR = os.environ.get('SIMILARITY_INDEX_DIR') or os.path.join(basedir, 'instance', 'similarity')
+    SIMILARITY_DIMENSIONS = int(os.environ.get('SIMILARITY_DIMENSIONS', '1024'))
+    SIMILARITY_TOP_K = int(os.environ.get('SIMILARITY_TOP_K', '5'))
+    SIMILARITY_MIN_SCORE = float(os.environ.get('SIMILARITY_MIN_SCORE', '0.2'))
+    SIMILARITY_GROUND_SCORE = float(os.environ.get('SIMILARITY_GROUND_SCORE', '0.35'))
+    SIMILARITY_SKIP_SCORE = float(os.environ.get('SIMILARITY_SKIP_SCORE', '0.9'))
+    
+    # AI completion cache: memory (per process), database (shared table),
+    # redis (any Redis-compatible store) or none
+    AI_CACHE_BACKEND = os.environ.get('AI_CACHE_BACKEND', 'memory')
+    AI_CACHE_TTL = int(os.environ.get('AI_CACHE_TTL', '86400'))  # seconds
+    AI_CACHE_MAX_ENTRIES = int(os.environ.get('AI_CACHE_MAX_ENTRIES', '1000'))
+    AI_CACHE_REDIS_URL = os.environ.get('AI_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    
     # Security headers
     REMEMBER_COOKIE_SECURE = True
     SESSION_COOKIE_SECURE = True
@@ -0,0 +1,118 @@
+"""Check that the hot route queries use the indexes added for them.
+
+Runs EXPLAIN against whatever DATABASE_URL points at (SQLite or PostgreSQL),
+so run it once per database after `flask db upgrade`:
+
+    DATABASE_URL=sqlite:///app.db python explain_queries.py
+    DATABASE_URL=postgresql://... python explain_queries.py
+"""
+from app import create_app, db
+from app.models import Ticket, TicketResponse, User, Invitation, Subscription
+from datetime import datetime, timedelta
+import sys
+
+# Stand-in ids; EXPLAIN only needs the query shape, not real rows
+ORG_ID = 1
+USER_ID = 1
+
+def route_queries():
+    """(route, query, indexes any of which satisfies the check)"""
+    now = datetime.utcnow()
+    org_tickets = Ticket.query.filter_by(organization_id=ORG_ID)
+    newest_first = (Ticket.created_at.desc(), Ticket.id.desc())
+
+    return [
+        ('tickets.index (staff)',
+         org_tickets.order_by(*newest_first).limit(26),
+         {'ix_tickets_org_created'}),
+        ('tickets.index (user)',
+         org_tickets.filter_by(submitter_id=USER_ID).order_by(*newest_first).limit(26),
+         {'ix_tickets_submitter_created', 'ix_tickets_org_created'}),
+        ('tickets.filter_tickets assigned_to_me',
+         org_tickets.filter_by(assignee_id=USER_ID).order_by(*newest_first).limit(26),
+         {'ix_tickets_assignee_status', 'ix_tickets_org_created'}),
+        ('tickets.filter_tickets high_priority',
+         org_tickets.filter_by(priority='high').order_by(*newest_first).limit(26),
+         {'ix_tickets_org_status_priority', 'ix_tickets_org_created'}),
+        ('tickets.filter_tickets overdue',
+         org_tickets.filter(Ticket.status == 'open',
+                            Ticket.created_at <= now - timedelta(hours=24)).order_by(*newest_first).limit(26),
+         {'ix_tickets_open_org_created', 'ix_tickets_org_status_priority', 'ix_tickets_org_created'}),
+        ('tickets.filter_tickets needs_response',
+         org_tickets.filter(Ticket.status == 'open',
+                            Ticket.last_response_by_staff.is_(None)).order_by(*newest_first).limit(26),
+         {'ix_tickets_needs_response_org_created', 'ix_tickets_open_org_created'}),
+        ('tickets.index (recently_updated)',
+         org_tickets.order_by(Ticket.updated_at.desc(), Ticket.id.desc()).limit(26),
+         {'ix_tickets_org_updated'}),
+        ('main.index recent tickets (user)',
+         Ticket.query.filter_by(submitter_id=USER_ID).order_by(Ticket.created_at.desc()).limit(5),
+         {'ix_tickets_submitter_created'}),
+        ('main.dashboard resolved today',
+         org_tickets.filter(Ticket.status == 'closed', Ticket.updated_at >= now.replace(hour=0, minute=0)),
+         {'ix_tickets_org_updated', 'ix_tickets_org_status_priority', 'ix_tickets_org_created'}),
+        ('tickets.view responses',
+         TicketResponse.query.filter_by(ticket_id=1).order_by(TicketResponse.created_at),
+         {'ix_ticket_responses_ticket_created'}),
+        ('tickets.create staff lookup',
+         User.query.filter(User.organization_id == ORG_ID, User.role.in_(['staff', 'admin']),
+                           User.is_active == True),
+         {'ix_users_org_role', 'ix_users_org_created'}),
+        ('admin.manage_organization members',
+         User.query.filter_by(organization_id=ORG_ID).order_by(User.created_at.desc()),
+         {'ix_users_org_created'}),
+        ('admin.manage_organization pending invites',
+         Invitation.query.filter_by(organization_id=ORG_ID, accepted=False).filter(Invitation.expires_at > now),
+         {'ix_invitation_org_expires'}),
+        ('main.index pending invites',
+         Invitation.query.filter_by(email='user@example.com', accepted=False).filter(Invitation.expires_at > now),
+         {'ix_invitation_email_org'}),
+        ('admin.invite_user existing invite',
+         Invitation.query.filter_by(email='user@example.com', organization_id=ORG_ID, accepted=False),
+         {'ix_invitation_email_org'}),
+        ('admin.fix_subscription active subscription',
+         Subscription.query.filter_by(organization_id=ORG_ID, status='active'),
+         {'ix_subscriptions_org_status'}),
+    ]
+
+def explain(connection, query):
+    """Return the query plan as a single string"""
+    compiled = query.statement.compile(dialect=connection.dialect,
+                                       compile_kwargs={'render_postcompile': True})
+    if compiled.positional:
+        params = tuple(compiled.params[name] for name in compiled.positiontup)
+    else:
+        params = compiled.params
+
+    if connection.dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params).fetchall()
+        return '\n'.join(str(row[-1]) for row in rows)
+
+    # Small or empty tables make a sequential scan look cheapest, so ask the
+    # planner whether the index is usable at all
+    connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+    rows = connection.exec_driver_sql(f'EXPLAIN {compiled}', params).fetchall()
+    return '\n'.join(row[0] for row in rows)
+
+def main():
+    app = create_app()
+    failures = 0
+    with app.app_context():
+        with db.engine.connect() as connection:
+            print(f'Database: {connection.dialect.name}')
+            for route, query, indexes in route_queries():
+                with connection.begin():
+                    plan = explain(connection, query)
+                used = sorted(name for name in indexes if name in plan)
+                if used:
+                    print(f'  OK    {route}: {", ".join(used)}')
+                else:
+                    failures += 1
+                    print(f'  MISS  {route}: expected one of {", ".join(sorted(indexes))}')
+                    for line in plan.splitlines():
+                        print(f'          {line}')
+    print(f'{failures} route quer{"y" if failures == 1 else "ies"} without a matching index.')
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
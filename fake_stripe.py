@@ -0,0 +1,130 @@
+"""Minimal fake Stripe API for exercising billing sync without the network.
+
+Implements just the endpoints app/billing.py and the admin routes call, keeps
+subscriptions in memory and honours Idempotency-Key the way Stripe does: a
+repeated key replays the first response instead of applying the change again.
+
+    python fake_stripe.py --port 12111
+    STRIPE_API_BASE=http://localhost:12111 STRIPE_SECRET_KEY=sk_test_fake flask run
+
+Add --fail N to answer the first N mutating requests with a 500, to watch the
+billing outbox retry. GET /_requests lists every request received.
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlparse
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+
+class FakeStripe:
+    def __init__(self, fail=0):
+        self.lock = threading.Lock()
+        self.subscriptions = {}
+        self.idempotent = {}
+        self.requests = []
+        self.fail = fail
+
+    def subscription(self, subscription_id):
+        """Existing subscription, or a fresh active one for ids the fake hasn't seen"""
+        if subscription_id not in self.subscriptions:
+            now = int(time.time())
+            self.subscriptions[subscription_id] = {
+                'id': subscription_id,
+                'object': 'subscription',
+                'status': 'active',
+                'customer': 'cus_fake',
+                'cancel_at_period_end': False,
+                'current_period_start': now,
+                'current_period_end': now + 30 * 86400,
+                'items': {'object': 'list', 'data': [{'id': 'si_fake', 'price': {'id': 'price_fake'}}]},
+                'metadata': {}
+            }
+        return self.subscriptions[subscription_id]
+
+    def handle(self, method, path, params, idempotency_key):
+        with self.lock:
+            self.requests.append({'method': method, 'path': path, 'params': params,
+                                  'idempotency_key': idempotency_key})
+            if method == 'POST' and idempotency_key in self.idempotent:
+                return self.idempotent[idempotency_key]
+            if method == 'POST' and self.fail > 0:
+                self.fail -= 1
+                return 500, {'error': {'type': 'api_error', 'message': 'Injected failure'}}
+
+            result = self.route(method, path, params)
+            if method == 'POST' and idempotency_key:
+                self.idempotent[idempotency_key] = result
+            return result
+
+    def route(self, method, path, params):
+        match = re.fullmatch(r'/v1/subscriptions/([\w-]+)', path)
+        if match:
+            subscription = self.subscription(match.group(1))
+            if method == 'POST':
+                if 'cancel_at_period_end' in params:
+                    subscription['cancel_at_period_end'] = params['cancel_at_period_end'].lower() == 'true'
+                if 'items[0][price]' in params:
+                    subscription['items']['data'][0]['price'] = {'id': params['items[0][price]']}
+                for key, value in params.items():
+                    meta = re.fullmatch(r'metadata\[(\w+)\]', key)
+                    if meta:
+                        subscription['metadata'][meta.group(1)] = value
+            return 200, subscription
+        if path == '/v1/subscription_schedules' and method == 'POST':
+            return 200, {'id': f'sub_sched_{uuid.uuid4().hex[:14]}', 'object': 'subscription_schedule',
+                         'customer': params.get('customer'), 'status': 'not_started'}
+        if path == '/v1/checkout/sessions' and method == 'POST':
+            return 200, {'id': f'cs_test_{uuid.uuid4().hex[:24]}', 'object': 'checkout.session',
+                         'url': 'http://localhost/fake-checkout'}
+        return 404, {'error': {'type': 'invalid_request_error', 'message': f'No fake for {method} {path}'}}
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        def _respond(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == '/_requests':
+                with fake.lock:
+                    return self._respond(200, fake.requests)
+            self._respond(*fake.handle('GET', url.path, dict(parse_qsl(url.query)), None))
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            length = int(self.headers.get('Content-Length') or 0)
+            params = dict(parse_qsl(self.rfile.read(length).decode()))
+            self._respond(*fake.handle('POST', url.path, params, self.headers.get('Idempotency-Key')))
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+def serve(port=12111, fail=0):
+    """Start the fake in a background thread and return (server, fake)"""
+    fake = FakeStripe(fail=fail)
+    server = ThreadingHTTPServer(('localhost', port), make_handler(fake))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, fake
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=12111)
+    parser.add_argument('--fail', type=int, default=0, help='fail the first N mutating requests')
+    args = parser.parse_args()
+    fake = FakeStripe(fail=args.fail)
+    server = ThreadingHTTPServer(('localhost', args.port), make_handler(fake))
+    print(f'Fake Stripe listening on http://localhost:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
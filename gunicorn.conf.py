@@ -0,0 +1,78 @@
+"""Gunicorn settings, read by `gunicorn -c gunicorn.conf.py run:app`.
+
+Every setting comes from the environment, so a deploy is tuned without a
+code change (benchmark_gunicorn.py compares settings under load):
+
+    WEB_CONCURRENCY               worker processes (default: CPU count)
+    GUNICORN_WORKER_CLASS         gthread (default), gevent or sync
+    GUNICORN_THREADS              threads per gthread worker (default 8)
+    GUNICORN_WORKER_CONNECTIONS   concurrent requests per gevent worker (default 100)
+    GUNICORN_TIMEOUT              seconds before a silent worker is restarted (default 60)
+    GUNICORN_GRACEFUL_TIMEOUT     seconds to finish requests on restart (default 30)
+    GUNICORN_KEEPALIVE            seconds to hold an idle connection open (default 5)
+    GUNICORN_PRELOAD              load the app before forking (default true, false for gevent)
+    GUNICORN_MAX_REQUESTS         restart a worker after this many requests, 0 = never (default 1000)
+    GUNICORN_MAX_REQUESTS_JITTER  random extra requests, so workers don't restart together (default 100)
+
+OpenAI and Stripe calls spend their time waiting on the network. Sync
+workers hold a whole process for that wait and are killed when it passes
+the timeout; with gthread or gevent the wait only holds a thread or a
+greenlet, and the worker's heartbeat carries on, so GUNICORN_TIMEOUT only
+catches workers that are really stuck. Each worker serves up to
+GUNICORN_THREADS (or GUNICORN_WORKER_CONNECTIONS) requests at once from one
+pool of DB_POOL_SIZE + DB_MAX_OVERFLOW connections; keep
+WEB_CONCURRENCY * (DB_POOL_SIZE + DB_MAX_OVERFLOW) under the database's
+max_connections.
+"""
+import multiprocessing
+import os
+import shutil
+import tempfile
+
+def _flag(name, default):
+    return os.environ.get(name, default).lower() in ['true', 'on', '1']
+
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+# Shares the imported code between workers and fails a deploy early on an
+# import error. Database connections and the log thread are reset in each
+# worker (app/database.py, app/log.py); job and mail threads start on the
+# first request. Off by default for gevent, whose worker then patches the
+# standard library before the app is imported.
+preload_app = _flag('GUNICORN_PRELOAD', 'false' if worker_class == 'gevent' else 'true')
+
+if worker_class == 'gevent':
+    if preload_app:
+        # The app is imported in the master, so patch before that happens
+        from gevent import monkey
+        monkey.patch_all()
+    try:
+        # psycopg2 blocks in C; with a wait callback it waits in select(),
+        # which gevent makes cooperative, so other requests run during a query
+        from psycopg2 import extensions, extras
+        extensions.set_wait_callback(extras.wait_select)
+    except ImportError:
+        pass
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# gunicorn turns sync workers with more than one thread into gthread workers
+threads = int(os.environ.get('GUNICORN_THREADS', '8' if worker_class == 'gthread' else '1'))
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', '100'))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '100'))
+
+# Workers write their metrics here and /metrics adds them up (app/metrics.py).
+# The master runs this file before loading the app or forking, so the
+# directory is set for every worker and starts empty on each deploy.
+multiproc_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                                      os.path.join(tempfile.gettempdir(), 'helpdesk-metrics'))
+shutil.rmtree(multiproc_dir, ignore_errors=True)
+os.makedirs(multiproc_dir, exist_ok=True)
+
+def child_exit(server, worker):
+    # Drop the dead worker's live gauges (pool connections in use)
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
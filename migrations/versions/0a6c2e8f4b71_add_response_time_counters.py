@@ -0,0 +1,50 @@
+"""Add materialized first-response time counters to organizations
+
+Revision ID: 0a6c2e8f4b71
+Revises: 1d7e4a9c3b52
+Create Date: 2026-10-18 21:40:17.283551
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0a6c2e8f4b71'
+down_revision = '1d7e4a9c3b52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('organizations', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('response_seconds_sum', sa.BigInteger(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('responded_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Backfill in Python, with the same whole-second rounding as the Ticket events
+    tickets = sa.table('tickets', sa.column('organization_id', sa.Integer),
+                       sa.column('created_at', sa.DateTime), sa.column('first_response_time', sa.DateTime))
+    organizations = sa.table('organizations', sa.column('id', sa.Integer),
+                             sa.column('response_seconds_sum', sa.BigInteger),
+                             sa.column('responded_count', sa.Integer))
+    connection = op.get_bind()
+    totals = {}
+    for org_id, created_at, first_response_time in connection.execute(
+        sa.select(tickets.c.organization_id, tickets.c.created_at, tickets.c.first_response_time).where(
+            tickets.c.organization_id.isnot(None),
+            tickets.c.created_at.isnot(None),
+            tickets.c.first_response_time.isnot(None)
+        )
+    ):
+        total, count = totals.get(org_id, (0, 0))
+        totals[org_id] = (total + int((first_response_time - created_at).total_seconds()), count + 1)
+    for org_id, (total, count) in totals.items():
+        connection.execute(organizations.update().where(organizations.c.id == org_id).values(
+            response_seconds_sum=total, responded_count=count
+        ))
+
+
+def downgrade():
+    with op.batch_alter_table('organizations', schema=None) as batch_op:
+        batch_op.drop_column('responded_count')
+        batch_op.drop_column('response_seconds_sum')
@@ -0,0 +1,79 @@
+"""Add full-text search: tsvector columns and GIN indexes on PostgreSQL, an FTS5 table on SQLite
+
+Revision ID: 1d7e4a9c3b52
+Revises: 6f2c9b1d8e40
+Create Date: 2026-10-18 19:12:08.604215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1d7e4a9c3b52'
+down_revision = '6f2c9b1d8e40'
+branch_labels = None
+depends_on = None
+
+# Same statements as app/tickets/search.py, which runs them on db.create_all()
+POSTGRESQL_UPGRADE = [
+    "ALTER TABLE tickets ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')) STORED",
+    "CREATE INDEX ix_tickets_search_vector ON tickets USING gin (search_vector)",
+    "ALTER TABLE ticket_responses ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(content, '')), 'C')) STORED",
+    "CREATE INDEX ix_ticket_responses_search_vector ON ticket_responses USING gin (search_vector)",
+]
+
+RESPONSES_OF = ("(SELECT coalesce(group_concat(content, ' '), '') FROM ticket_responses "
+                "WHERE ticket_id = {ticket})")
+
+SQLITE_UPGRADE = [
+    "CREATE VIRTUAL TABLE ticket_search USING fts5("
+    "title, description, responses, tokenize = 'porter unicode61')",
+    # Index what is already there
+    "INSERT INTO ticket_search (rowid, title, description, responses) "
+    f"SELECT id, title, description, {RESPONSES_OF.format(ticket='tickets.id')} FROM tickets",
+    "CREATE TRIGGER ticket_search_insert AFTER INSERT ON tickets BEGIN "
+    "INSERT INTO ticket_search (rowid, title, description, responses) "
+    "VALUES (new.id, new.title, new.description, ''); END",
+    "CREATE TRIGGER ticket_search_update AFTER UPDATE OF title, description ON tickets BEGIN "
+    "UPDATE ticket_search SET title = new.title, description = new.description "
+    "WHERE rowid = new.id; END",
+    "CREATE TRIGGER ticket_search_delete AFTER DELETE ON tickets BEGIN "
+    "DELETE FROM ticket_search WHERE rowid = old.id; END",
+    "CREATE TRIGGER ticket_search_response_insert AFTER INSERT ON ticket_responses BEGIN "
+    "UPDATE ticket_search SET responses = responses || ' ' || coalesce(new.content, '') "
+    "WHERE rowid = new.ticket_id; END",
+    "CREATE TRIGGER ticket_search_response_update AFTER UPDATE OF content, ticket_id ON ticket_responses BEGIN "
+    f"UPDATE ticket_search SET responses = {RESPONSES_OF.format(ticket='old.ticket_id')} "
+    "WHERE rowid = old.ticket_id; "
+    f"UPDATE ticket_search SET responses = {RESPONSES_OF.format(ticket='new.ticket_id')} "
+    "WHERE rowid = new.ticket_id; END",
+    "CREATE TRIGGER ticket_search_response_delete AFTER DELETE ON ticket_responses BEGIN "
+    f"UPDATE ticket_search SET responses = {RESPONSES_OF.format(ticket='old.ticket_id')} "
+    "WHERE rowid = old.ticket_id; END",
+]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    statements = {'postgresql': POSTGRESQL_UPGRADE, 'sqlite': SQLITE_UPGRADE}.get(dialect, [])
+    for statement in statements:
+        op.execute(statement)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_ticket_responses_search_vector")
+        op.execute("ALTER TABLE ticket_responses DROP COLUMN IF EXISTS search_vector")
+        op.execute("DROP INDEX IF EXISTS ix_tickets_search_vector")
+        op.execute("ALTER TABLE tickets DROP COLUMN IF EXISTS search_vector")
+    elif dialect == 'sqlite':
+        for trigger in ('ticket_search_insert', 'ticket_search_update', 'ticket_search_delete',
+                        'ticket_search_response_insert', 'ticket_search_response_update',
+                        'ticket_search_response_delete'):
+            op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        op.execute("DROP TABLE IF EXISTS ticket_search")
@@ -0,0 +1,48 @@
+"""Add round-robin assignment cursor and per-user open ticket counters
+
+Revision ID: 2b8e6f1c4d93
+Revises: 9c4f2d7a8b15
+Create Date: 2026-10-18 14:48:27.331960
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b8e6f1c4d93'
+down_revision = '9c4f2d7a8b15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('organizations', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('assignment_cursor', sa.Integer(), nullable=True))
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('open_ticket_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Continue the rotation from whoever got each organization's latest ticket
+    op.execute("""
+        UPDATE organizations SET assignment_cursor = (
+            SELECT tickets.assignee_id FROM tickets
+            WHERE tickets.organization_id = organizations.id
+            ORDER BY tickets.created_at DESC, tickets.id DESC
+            LIMIT 1
+        )
+    """)
+    op.execute("""
+        UPDATE users SET open_ticket_count = (
+            SELECT COUNT(tickets.id) FROM tickets
+            WHERE tickets.assignee_id = users.id AND tickets.status != 'closed'
+        )
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('open_ticket_count')
+
+    with op.batch_alter_table('organizations', schema=None) as batch_op:
+        batch_op.drop_column('assignment_cursor')
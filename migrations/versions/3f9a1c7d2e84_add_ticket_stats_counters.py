@@ -0,0 +1,53 @@
+"""Add materialized ticket and active user counters
+
+Revision ID: 3f9a1c7d2e84
+Revises: b4ce5d850e00
+Create Date: 2026-10-18 09:12:31.504118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f9a1c7d2e84'
+down_revision = 'b4ce5d850e00'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('ticket_stats',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('organization_id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('priority', sa.String(length=20), nullable=False),
+    sa.Column('count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['organization_id'], ['organizations.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('organization_id', 'status', 'priority', name='uq_ticket_stats_key')
+    )
+    with op.batch_alter_table('organizations', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('active_user_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Backfill the counters from the existing rows
+    op.execute("""
+        INSERT INTO ticket_stats (organization_id, status, priority, count)
+        SELECT organization_id, status, priority, COUNT(id)
+        FROM tickets
+        WHERE organization_id IS NOT NULL AND status IS NOT NULL AND priority IS NOT NULL
+        GROUP BY organization_id, status, priority
+    """)
+    op.execute("""
+        UPDATE organizations SET active_user_count = (
+            SELECT COUNT(users.id) FROM users
+            WHERE users.organization_id = organizations.id AND users.is_active
+        )
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('organizations', schema=None) as batch_op:
+        batch_op.drop_column('active_user_count')
+
+    op.drop_table('ticket_stats')
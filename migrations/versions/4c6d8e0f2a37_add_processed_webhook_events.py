@@ -0,0 +1,33 @@
+"""Add processed_webhook_events for deduplicated, queued Stripe webhooks
+
+Revision ID: 4c6d8e0f2a37
+Revises: d8f1b3a6e274
+Create Date: 2026-10-18 16:52:13.408726
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c6d8e0f2a37'
+down_revision = 'd8f1b3a6e274'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('processed_webhook_events',
+    sa.Column('event_id', sa.String(length=100), nullable=False),
+    sa.Column('type', sa.String(length=100), nullable=False),
+    sa.Column('payload', sa.JSON(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('received_at', sa.DateTime(), nullable=False),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('event_id')
+    )
+
+
+def downgrade():
+    op.drop_table('processed_webhook_events')
@@ -0,0 +1,42 @@
+"""Add archived_subscriptions for closed subscriptions moved out by maintenance
+
+Revision ID: 6f2c9b1d8e40
+Revises: 4c6d8e0f2a37
+Create Date: 2026-10-18 18:05:41.217390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6f2c9b1d8e40'
+down_revision = '4c6d8e0f2a37'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('archived_subscriptions',
+    sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('organization_id', sa.Integer(), nullable=True),
+    sa.Column('plan_id', sa.Integer(), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=True),
+    sa.Column('start_date', sa.DateTime(), nullable=True),
+    sa.Column('end_date', sa.DateTime(), nullable=True),
+    sa.Column('last_billing_date', sa.DateTime(), nullable=True),
+    sa.Column('next_billing_date', sa.DateTime(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('archived_subscriptions', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_archived_subscriptions_organization_id'), ['organization_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('archived_subscriptions', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_archived_subscriptions_organization_id'))
+
+    op.drop_table('archived_subscriptions')
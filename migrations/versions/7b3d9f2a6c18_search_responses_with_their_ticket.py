@@ -0,0 +1,75 @@
+"""Search each ticket together with its responses on PostgreSQL
+
+Revision ID: 7b3d9f2a6c18
+Revises: 0a6c2e8f4b71
+Create Date: 2026-10-18 22:31:05.918342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7b3d9f2a6c18'
+down_revision = '0a6c2e8f4b71'
+branch_labels = None
+depends_on = None
+
+# Same statements as app/tickets/search.py, which runs them on db.create_all()
+RESPONSES_OF = ("(SELECT string_agg(content, ' ' ORDER BY id) FROM ticket_responses "
+                "WHERE ticket_id = {ticket})")
+
+POSTGRESQL_UPGRADE = [
+    "DROP INDEX IF EXISTS ix_ticket_responses_search_vector",
+    "ALTER TABLE ticket_responses DROP COLUMN IF EXISTS search_vector",
+    "DROP INDEX IF EXISTS ix_tickets_search_vector",
+    "ALTER TABLE tickets DROP COLUMN IF EXISTS search_vector",
+    "ALTER TABLE tickets ADD COLUMN search_responses text",
+    # Fill in what is already there
+    f"UPDATE tickets SET search_responses = {RESPONSES_OF.format(ticket='tickets.id')} "
+    "WHERE EXISTS (SELECT 1 FROM ticket_responses WHERE ticket_id = tickets.id)",
+    "ALTER TABLE tickets ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(search_responses, '')), 'C')) STORED",
+    "CREATE INDEX ix_tickets_search_vector ON tickets USING gin (search_vector)",
+    "CREATE OR REPLACE FUNCTION ticket_search_responses() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN "
+    "IF TG_OP <> 'INSERT' THEN "
+    f"UPDATE tickets SET search_responses = {RESPONSES_OF.format(ticket='OLD.ticket_id')} "
+    "WHERE id = OLD.ticket_id; END IF; "
+    "IF TG_OP <> 'DELETE' THEN "
+    f"UPDATE tickets SET search_responses = {RESPONSES_OF.format(ticket='NEW.ticket_id')} "
+    "WHERE id = NEW.ticket_id; END IF; "
+    "RETURN NULL; END $$",
+    "CREATE TRIGGER ticket_search_responses AFTER INSERT OR DELETE OR UPDATE OF content, ticket_id "
+    "ON ticket_responses FOR EACH ROW EXECUTE FUNCTION ticket_search_responses()",
+]
+
+# Back to the separate per-table vectors of 1d7e4a9c3b52
+POSTGRESQL_DOWNGRADE = [
+    "DROP TRIGGER IF EXISTS ticket_search_responses ON ticket_responses",
+    "DROP FUNCTION IF EXISTS ticket_search_responses()",
+    "DROP INDEX IF EXISTS ix_tickets_search_vector",
+    "ALTER TABLE tickets DROP COLUMN IF EXISTS search_vector",
+    "ALTER TABLE tickets DROP COLUMN IF EXISTS search_responses",
+    "ALTER TABLE tickets ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(description, '')), 'B')) STORED",
+    "CREATE INDEX ix_tickets_search_vector ON tickets USING gin (search_vector)",
+    "ALTER TABLE ticket_responses ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(content, '')), 'C')) STORED",
+    "CREATE INDEX ix_ticket_responses_search_vector ON ticket_responses USING gin (search_vector)",
+]
+
+
+def upgrade():
+    # SQLite's FTS5 table already indexes the responses with their ticket
+    if op.get_bind().dialect.name == 'postgresql':
+        for statement in POSTGRESQL_UPGRADE:
+            op.execute(statement)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for statement in POSTGRESQL_DOWNGRADE:
+            op.execute(statement)
@@ -0,0 +1,39 @@
+"""Index tickets needing a staff response and backfill last_response_by_staff
+
+Revision ID: 7e3a9d2c5f61
+Revises: 2b8e6f1c4d93
+Create Date: 2026-10-18 15:20:04.772815
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7e3a9d2c5f61'
+down_revision = '2b8e6f1c4d93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Tickets answered before add_response kept this column up to date
+    op.execute("""
+        UPDATE tickets SET last_response_by_staff = (
+            SELECT MAX(ticket_responses.created_at)
+            FROM ticket_responses JOIN users ON users.id = ticket_responses.user_id
+            WHERE ticket_responses.ticket_id = tickets.id
+              AND users.role IN ('staff', 'admin')
+        )
+        WHERE last_response_by_staff IS NULL
+    """)
+
+    with op.batch_alter_table('tickets', schema=None) as batch_op:
+        batch_op.create_index('ix_tickets_needs_response_org_created', ['organization_id', 'created_at', 'id'], unique=False,
+                              postgresql_where=sa.text("status = 'open' AND last_response_by_staff IS NULL"),
+                              sqlite_where=sa.text("status = 'open' AND last_response_by_staff IS NULL"))
+
+
+def downgrade():
+    with op.batch_alter_table('tickets', schema=None) as batch_op:
+        batch_op.drop_index('ix_tickets_needs_response_org_created')
@@ -0,0 +1,71 @@
+"""Add composite indexes for ticket, response, invitation and member queries
+
+Revision ID: 8d2b6e4a91c3
+Revises: 3f9a1c7d2e84
+Create Date: 2026-10-18 10:41:07.287395
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2b6e4a91c3'
+down_revision = '3f9a1c7d2e84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('tickets', schema=None) as batch_op:
+        batch_op.create_index('ix_tickets_org_created', ['organization_id', 'created_at', 'id'], unique=False)
+        batch_op.create_index('ix_tickets_org_updated', ['organization_id', 'updated_at'], unique=False)
+        batch_op.create_index('ix_tickets_org_status_priority', ['organization_id', 'status', 'priority'], unique=False)
+        batch_op.create_index('ix_tickets_submitter_created', ['submitter_id', 'created_at'], unique=False)
+        batch_op.create_index('ix_tickets_assignee_status', ['assignee_id', 'status'], unique=False)
+        # Partial index over open tickets, which the needs_response and overdue filters scan
+        batch_op.create_index('ix_tickets_open_org_created', ['organization_id', 'created_at'], unique=False,
+                              postgresql_where=sa.text("status = 'open'"),
+                              sqlite_where=sa.text("status = 'open'"))
+
+    with op.batch_alter_table('ticket_responses', schema=None) as batch_op:
+        batch_op.create_index('ix_ticket_responses_ticket_created', ['ticket_id', 'created_at'], unique=False)
+        batch_op.create_index('ix_ticket_responses_user_id', ['user_id'], unique=False)
+
+    with op.batch_alter_table('invitation', schema=None) as batch_op:
+        batch_op.create_index('ix_invitation_email_org', ['email', 'organization_id'], unique=False)
+        batch_op.create_index('ix_invitation_org_expires', ['organization_id', 'expires_at'], unique=False)
+        batch_op.create_index('ix_invitation_expires_at', ['expires_at'], unique=False)
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.create_index('ix_users_org_role', ['organization_id', 'role'], unique=False)
+        batch_op.create_index('ix_users_org_created', ['organization_id', 'created_at'], unique=False)
+
+    with op.batch_alter_table('subscriptions', schema=None) as batch_op:
+        batch_op.create_index('ix_subscriptions_org_status', ['organization_id', 'status'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('subscriptions', schema=None) as batch_op:
+        batch_op.drop_index('ix_subscriptions_org_status')
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index('ix_users_org_created')
+        batch_op.drop_index('ix_users_org_role')
+
+    with op.batch_alter_table('invitation', schema=None) as batch_op:
+        batch_op.drop_index('ix_invitation_expires_at')
+        batch_op.drop_index('ix_invitation_org_expires')
+        batch_op.drop_index('ix_invitation_email_org')
+
+    with op.batch_alter_table('ticket_responses', schema=None) as batch_op:
+        batch_op.drop_index('ix_ticket_responses_user_id')
+        batch_op.drop_index('ix_ticket_responses_ticket_created')
+
+    with op.batch_alter_table('tickets', schema=None) as batch_op:
+        batch_op.drop_index('ix_tickets_open_org_created')
+        batch_op.drop_index('ix_tickets_assignee_status')
+        batch_op.drop_index('ix_tickets_submitter_created')
+        batch_op.drop_index('ix_tickets_org_status_priority')
+        batch_op.drop_index('ix_tickets_org_updated')
+        batch_op.drop_index('ix_tickets_org_created')
@@ -0,0 +1,53 @@
+"""Add Stripe ids and the subscription snapshot table for billing sync
+
+Revision ID: d8f1b3a6e274
+Revises: 7e3a9d2c5f61
+Create Date: 2026-10-18 16:05:48.219337
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd8f1b3a6e274'
+down_revision = '7e3a9d2c5f61'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # organizations.stripe_subscription_id already exists (b4ce5d850e00)
+    with op.batch_alter_table('organizations', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('stripe_customer_id', sa.String(length=100), nullable=True))
+
+    with op.batch_alter_table('subscription_plans', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('stripe_price_id', sa.String(length=100), nullable=True))
+
+    op.create_table('stripe_subscription_snapshots',
+    sa.Column('stripe_subscription_id', sa.String(length=100), nullable=False),
+    sa.Column('organization_id', sa.Integer(), nullable=True),
+    sa.Column('status', sa.String(length=30), nullable=True),
+    sa.Column('cancel_at_period_end', sa.Boolean(), nullable=False),
+    sa.Column('current_period_end', sa.DateTime(), nullable=True),
+    sa.Column('price_id', sa.String(length=100), nullable=True),
+    sa.Column('source_updated_at', sa.DateTime(), nullable=False),
+    sa.Column('synced_at', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['organization_id'], ['organizations.id'], ),
+    sa.PrimaryKeyConstraint('stripe_subscription_id')
+    )
+    with op.batch_alter_table('stripe_subscription_snapshots', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_stripe_subscription_snapshots_organization_id'), ['organization_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('stripe_subscription_snapshots', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_stripe_subscription_snapshots_organization_id'))
+
+    op.drop_table('stripe_subscription_snapshots')
+
+    with op.batch_alter_table('subscription_plans', schema=None) as batch_op:
+        batch_op.drop_column('stripe_price_id')
+
+    with op.batch_alter_table('organizations', schema=None) as batch_op:
+        batch_op.drop_column('stripe_customer_id')
@@ -0,0 +1,38 @@
+"""Add completion_cache table for the database AI cache backend
+
+Revision ID: e61c08f5d2a7
+Revises: 5a7e3b19c0d6
+Create Date: 2026-10-18 13:26:40.118532
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e61c08f5d2a7'
+down_revision = '5a7e3b19c0d6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('completion_cache',
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('value', sa.Text(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('last_used_at', sa.DateTime(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    with op.batch_alter_table('completion_cache', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_completion_cache_expires_at'), ['expires_at'], unique=False)
+        batch_op.create_index(batch_op.f('ix_completion_cache_last_used_at'), ['last_used_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('completion_cache', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_completion_cache_last_used_at'))
+        batch_op.drop_index(batch_op.f('ix_completion_cache_expires_at'))
+
+    op.drop_table('completion_cache')